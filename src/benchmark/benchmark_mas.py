@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Benchmark monotonic alignment search (MAS) from piper_train.
+
+Run with src/python on PYTHONPATH after building the extension
+with build_monotonic_align.sh. Set OMP_NUM_THREADS=1 to get the serial
+baseline of the Cython version.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+
+from piper_train.vits.monotonic_align import (
+    maximum_path,
+    maximum_path_c,
+    maximum_path_numpy,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument(
+        "--max-frames", type=int, default=800, help="Longest spectrogram (t_t)"
+    )
+    parser.add_argument(
+        "--max-phonemes", type=int, default=200, help="Longest phoneme list (t_s)"
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+
+    rng = np.random.default_rng(args.seed)
+    neg_cent = torch.from_numpy(
+        rng.standard_normal(
+            (args.batch_size, args.max_frames, args.max_phonemes), dtype=np.float32
+        )
+    )
+
+    # Random lengths, like a padded training batch
+    mask = torch.zeros_like(neg_cent)
+    frame_lengths = rng.integers(
+        args.max_frames // 2, args.max_frames + 1, size=args.batch_size
+    )
+    frame_lengths[0] = args.max_frames
+    for i, num_frames in enumerate(frame_lengths):
+        num_phonemes = min(
+            num_frames, int(num_frames * args.max_phonemes / args.max_frames)
+        )
+        mask[i, :num_frames, :num_phonemes] = 1
+
+    t_t_max = mask.sum(1)[:, 0].numpy().astype(np.int32)
+    t_s_max = mask.sum(2)[:, 0].numpy().astype(np.int32)
+
+    results = {
+        "batch_size": args.batch_size,
+        "max_frames": args.max_frames,
+        "max_phonemes": args.max_phonemes,
+        "omp_num_threads": os.environ.get("OMP_NUM_THREADS"),
+    }
+
+    # maximum_path overwrites a contiguous float32 input, so time on copies
+    results["maximum_path_sec"] = time_calls(
+        lambda inputs: maximum_path(inputs, mask),
+        lambda: neg_cent.clone(),
+        args.iterations,
+    )
+
+    expected_path = maximum_path(neg_cent.clone(), mask).numpy().astype(np.int32)
+
+    implementations = {"numpy": maximum_path_numpy}
+    if maximum_path_c is not None:
+        implementations["cython"] = maximum_path_c
+    else:
+        _LOGGER.warning("Extension is not built; only timing NumPy version")
+
+    for name, maximum_path_impl in implementations.items():
+        path = np.zeros(neg_cent.shape, dtype=np.int32)
+        maximum_path_impl(path, neg_cent.numpy().copy(), t_t_max, t_s_max)
+        assert np.array_equal(path, expected_path), f"{name} path differs"
+
+        results[f"{name}_sec"] = time_calls(
+            lambda values: maximum_path_impl(
+                np.zeros(values.shape, dtype=np.int32), values, t_t_max, t_s_max
+            ),
+            lambda: neg_cent.numpy().copy(),
+            args.iterations,
+        )
+
+    json.dump(results, sys.stdout)
+
+
+def time_calls(func, make_input, iterations: int):
+    seconds = []
+    for _ in range(iterations):
+        func_input = make_input()
+        start_time = time.monotonic_ns()
+        func(func_input)
+        end_time = time.monotonic_ns()
+        seconds.append((end_time - start_time) / 1e9)
+
+    return {
+        "mean": statistics.mean(seconds),
+        "stdev": statistics.stdev(seconds) if len(seconds) > 1 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    main()
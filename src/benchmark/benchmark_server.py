@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Benchmark the piper binary's server mode against one process per request.
+
+Reads lines of text from stdin. Each line is synthesized by a new
+`piper --output_file` process (paying model load time every time), then by a
+single `piper --server` process, one request at a time and concurrently.
+"""
+import argparse
+import json
+import logging
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+# Frame types (see src/cpp/server.hpp)
+_FRAME_REQUEST = b"R"
+_FRAME_HEADER = b"H"
+_FRAME_AUDIO = b"A"
+_FRAME_DONE = b"D"
+_FRAME_ERROR = b"E"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--piper", default="piper", help="Path to piper binary")
+    parser.add_argument(
+        "-m", "--model", required=True, help="Path to Onnx model file (.onnx)"
+    )
+    parser.add_argument(
+        "--server",
+        help="Address of a running server (default: start one on a Unix socket)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Number of connections for the concurrent run",
+    )
+    parser.add_argument(
+        "--startup-timeout",
+        type=float,
+        default=60,
+        help="Seconds to wait for the server to start",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+
+    texts = [line.strip() for line in sys.stdin if line.strip()]
+    results: Dict[str, Any] = {"num_texts": len(texts)}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # One process per request
+        process_sec = []
+        for text in texts:
+            start_time = time.monotonic_ns()
+            subprocess.run(
+                [
+                    args.piper,
+                    "--model",
+                    args.model,
+                    "--output_file",
+                    str(Path(temp_dir) / "output.wav"),
+                    "--quiet",
+                ],
+                input=text.encode(),
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            end_time = time.monotonic_ns()
+            process_sec.append((end_time - start_time) / 1e9)
+
+        results["process"] = summarize(process_sec)
+
+        # One long-lived server
+        server_proc: Optional[subprocess.Popen] = None
+        address = args.server
+        if not address:
+            address = f"unix:{Path(temp_dir) / 'piper.sock'}"
+            start_time = time.monotonic_ns()
+            server_proc = subprocess.Popen(
+                [args.piper, "--model", args.model, "--server", address, "--quiet"]
+            )
+            wait_for_server(address, args.startup_timeout)
+            end_time = time.monotonic_ns()
+            results["server_startup_sec"] = (end_time - start_time) / 1e9
+
+        try:
+            with connect(address) as sock:
+                server_sec = []
+                first_audio_sec = []
+                for text in texts:
+                    request_result = synthesize(sock, {"text": text})
+                    server_sec.append(request_result["total_sec"])
+                    first_audio_sec.append(request_result["first_audio_sec"])
+
+            results["server"] = summarize(server_sec)
+            results["server"]["first_audio_sec_mean"] = statistics.mean(first_audio_sec)
+
+            # Concurrent requests, one connection per worker
+            def synthesize_on_new_connection(text: str) -> Dict[str, Any]:
+                with connect(address) as sock:
+                    return synthesize(sock, {"text": text})
+
+            start_time = time.monotonic_ns()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                concurrent_results = list(
+                    executor.map(synthesize_on_new_connection, texts)
+                )
+            end_time = time.monotonic_ns()
+            total_sec = (end_time - start_time) / 1e9
+            results["server_concurrent"] = {
+                "concurrency": args.concurrency,
+                "total_sec": total_sec,
+                "requests_per_sec": len(texts) / total_sec,
+                **summarize([r["total_sec"] for r in concurrent_results]),
+            }
+        finally:
+            if server_proc is not None:
+                server_proc.terminate()
+                server_proc.wait()
+
+    results["speedup"] = (
+        results["process"]["latency_sec_mean"] / results["server"]["latency_sec_mean"]
+    )
+
+    json.dump(results, sys.stdout)
+
+
+def summarize(latencies_sec: List[float]) -> Dict[str, float]:
+    return {
+        "latency_sec_mean": statistics.mean(latencies_sec),
+        "latency_sec_stdev": statistics.stdev(latencies_sec)
+        if len(latencies_sec) > 1
+        else 0.0,
+    }
+
+
+# -----------------------------------------------------------------------------
+
+
+def connect(address: str) -> socket.socket:
+    """Connect to unix:PATH or tcp:[HOST:]PORT"""
+    if address.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[len("unix:") :])
+        return sock
+
+    if not address.startswith("tcp:"):
+        raise ValueError(f"Address must be unix:PATH or tcp:[HOST:]PORT: {address}")
+
+    host, _, port = address[len("tcp:") :].rpartition(":")
+    sock = socket.create_connection((host or "127.0.0.1", int(port)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def wait_for_server(address: str, timeout_sec: float) -> None:
+    deadline = time.monotonic() + timeout_sec
+    while True:
+        try:
+            connect(address).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.01)
+
+
+def read_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Server closed the connection")
+
+        data += chunk
+
+    return data
+
+
+def read_frame(sock: socket.socket):
+    frame_type, size = struct.unpack(">cI", read_exactly(sock, 5))
+    return frame_type, read_exactly(sock, size)
+
+
+def synthesize(sock: socket.socket, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Send one request and read its response."""
+    payload = json.dumps(request, ensure_ascii=False).encode()
+
+    start_time = time.monotonic_ns()
+    sock.sendall(struct.pack(">cI", _FRAME_REQUEST, len(payload)) + payload)
+
+    header: Optional[Dict[str, Any]] = None
+    audio = bytearray()
+    first_audio_sec: Optional[float] = None
+    while True:
+        frame_type, frame_data = read_frame(sock)
+        if frame_type == _FRAME_HEADER:
+            header = json.loads(frame_data)
+        elif frame_type == _FRAME_AUDIO:
+            if first_audio_sec is None:
+                first_audio_sec = (time.monotonic_ns() - start_time) / 1e9
+
+            audio.extend(frame_data)
+        elif frame_type == _FRAME_DONE:
+            done = json.loads(frame_data)
+            break
+        elif frame_type == _FRAME_ERROR:
+            raise RuntimeError(json.loads(frame_data)["error"])
+        else:
+            raise RuntimeError(f"Unexpected frame type: {frame_type!r}")
+
+    end_time = time.monotonic_ns()
+    total_sec = (end_time - start_time) / 1e9
+
+    _LOGGER.debug(
+        "Synthesized %s byte(s) in %s sec (first audio after %s sec): %s",
+        len(audio),
+        total_sec,
+        first_audio_sec,
+        done,
+    )
+
+    return {
+        "header": header,
+        "audio": bytes(audio),
+        "done": done,
+        "total_sec": total_sec,
+        "first_audio_sec": total_sec if first_audio_sec is None else first_audio_sec,
+    }
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,18 @@ def main() -> None:
         "-m", "--model", required=True, help="Path to Torchscript file (.ts)"
     )
     parser.add_argument("-c", "--config", help="Path to model config file (.json)")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Utterances per (padded) batch",
+    )
+    parser.add_argument("--num-threads", type=int, help="Torch intra-op threads")
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Freeze model and run torch.jit.optimize_for_inference",
+    )
     args = parser.parse_args()
     logging.basicConfig(level=logging.DEBUG)
 
@@ -30,25 +42,30 @@ def main() -> None:
     with open(args.config, "r", encoding="utf-8") as config_file:
         config = json.load(config_file)
 
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
     sample_rate = config["audio"]["sample_rate"]
     utterances = [json.loads(line) for line in sys.stdin]
 
     start_time = time.monotonic_ns()
     model = torch.jit.load(args.model)
-    end_time = time.monotonic_ns()
-
     model.eval()
 
+    if args.optimize:
+        model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+
+    end_time = time.monotonic_ns()
+
     load_sec = (end_time - start_time) / 1e9
     synthesize_rtf = []
-    for utterance in utterances:
-        phoneme_ids = utterance["phoneme_ids"]
-        speaker_id = utterance.get("speaker_id")
+    for batch_start in range(0, len(utterances), args.batch_size):
+        batch = utterances[batch_start : batch_start + args.batch_size]
         synthesize_rtf.append(
             synthesize(
                 model,
-                phoneme_ids,
-                speaker_id,
+                [utterance["phoneme_ids"] for utterance in batch],
+                [utterance.get("speaker_id") for utterance in batch],
                 sample_rate,
             )
         )
@@ -56,44 +73,55 @@ def main() -> None:
     json.dump(
         {
             "load_sec": load_sec,
+            "batch_size": args.batch_size,
+            "num_threads": torch.get_num_threads(),
+            "optimize": args.optimize,
             "rtf_mean": statistics.mean(synthesize_rtf),
-            "rtf_stdev": statistics.stdev(synthesize_rtf),
+            "rtf_stdev": statistics.stdev(synthesize_rtf)
+            if len(synthesize_rtf) > 1
+            else 0.0,
             "synthesize_rtf": synthesize_rtf,
         },
         sys.stdout,
     )
 
 
-def synthesize(model, phoneme_ids, speaker_id, sample_rate) -> float:
-    text = torch.LongTensor(phoneme_ids).unsqueeze(0)
-    text_lengths = torch.LongTensor([len(phoneme_ids)])
-    sid = torch.LongTensor([speaker_id]) if speaker_id is not None else None
+def synthesize(model, phoneme_ids_batch, speaker_ids, sample_rate) -> float:
+    """Real-time factor of a padded batch (total audio of all utterances)."""
+    max_length = max(len(phoneme_ids) for phoneme_ids in phoneme_ids_batch)
+    text = torch.zeros((len(phoneme_ids_batch), max_length), dtype=torch.long)
+    for i, phoneme_ids in enumerate(phoneme_ids_batch):
+        text[i, : len(phoneme_ids)] = torch.LongTensor(phoneme_ids)
+
+    text_lengths = torch.LongTensor(
+        [len(phoneme_ids) for phoneme_ids in phoneme_ids_batch]
+    )
+    sid = torch.LongTensor([speaker_id or 0 for speaker_id in speaker_ids])
 
     start_time = time.monotonic_ns()
-    audio = (
-        model(
+    with torch.inference_mode():
+        audio, y_mask = model(
             text,
             text_lengths,
             sid,
             torch.FloatTensor([_NOISE_SCALE]),
             torch.FloatTensor([_LENGTH_SCALE]),
             torch.FloatTensor([_NOISE_W]),
-        )[0]
-        .detach()
-        .numpy()
-        .squeeze()
-    )
+        )
     end_time = time.monotonic_ns()
 
-    audio_sec = len(audio) / sample_rate
+    # Audio without padding
+    hop_length = audio.size(-1) // y_mask.size(-1)
+    audio_sec = (y_mask.sum().item() * hop_length) / sample_rate
     infer_sec = (end_time - start_time) / 1e9
     rtf = infer_sec / audio_sec
 
     _LOGGER.debug(
-        "Real-time factor: %s (infer=%s sec, audio=%s sec)",
+        "Real-time factor: %s (infer=%s sec, audio=%s sec, batch=%s)",
         rtf,
         infer_sec,
         audio_sec,
+        len(phoneme_ids_batch),
     )
 
     return rtf
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Benchmark VITS training steps per second on a synthetic batch.
+
+Compares the default settings with the --fast-training profile
+(bf16 autocast, compiled decoder/discriminators, fused optimizers).
+Run with src/python on PYTHONPATH.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+
+from piper_train.vits.dataset import Batch
+from piper_train.vits.lightning import VitsModel
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--num-phonemes", type=int, default=100)
+    parser.add_argument(
+        "--num-frames", type=int, default=400, help="Spectrogram frames per utterance"
+    )
+    parser.add_argument(
+        "--quality", default="x-low", choices=("x-low", "medium"), help="Model size"
+    )
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument(
+        "--warmup-steps",
+        type=int,
+        default=3,
+        help="Untimed steps first (includes compilation)",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=("baseline", "fast", "both"),
+        default="both",
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+
+    device = torch.device(args.device)
+    profiles = ["baseline", "fast"] if args.profile == "both" else [args.profile]
+    results = {
+        "batch_size": args.batch_size,
+        "num_frames": args.num_frames,
+        "quality": args.quality,
+        "device": str(device),
+    }
+
+    for profile in profiles:
+        torch.manual_seed(args.seed)
+        step_sec = run_profile(args, device, is_fast=(profile == "fast"))
+        results[profile] = {
+            "steps_per_sec": 1.0 / statistics.mean(step_sec),
+            "step_sec_mean": statistics.mean(step_sec),
+            "step_sec_stdev": statistics.stdev(step_sec) if len(step_sec) > 1 else 0.0,
+        }
+
+    if ("baseline" in results) and ("fast" in results):
+        results["speedup"] = (
+            results["fast"]["steps_per_sec"] / results["baseline"]["steps_per_sec"]
+        )
+
+    json.dump(results, sys.stdout)
+
+
+def run_profile(args: argparse.Namespace, device: torch.device, is_fast: bool):
+    model_args = {}
+    if args.quality == "x-low":
+        model_args = {
+            "hidden_channels": 96,
+            "inter_channels": 96,
+            "filter_channels": 384,
+        }
+
+    model = VitsModel(
+        num_symbols=256,
+        num_speakers=1,
+        compile_model=is_fast,
+        fused_optimizers=is_fast,
+        **model_args,
+    ).to(device)
+    model.train()
+
+    if is_fast:
+        model.on_fit_start()
+
+    (opt_g, opt_d), _schedulers = model.configure_optimizers()
+    batch = make_batch(args, model.hparams, device)
+
+    use_bf16 = is_fast and (
+        torch.cuda.is_bf16_supported()
+        if device.type == "cuda"
+        else getattr(torch.cpu, "_is_avx512_bf16_supported", bool)()
+    )
+    _LOGGER.debug("fast=%s, bf16=%s", is_fast, use_bf16)
+
+    step_sec = []
+    for step_idx in range(args.warmup_steps + args.steps):
+        start_time = time.monotonic_ns()
+        with (
+            torch.autocast(device.type, dtype=torch.bfloat16)
+            if use_bf16
+            else nullcontext()
+        ):
+            # Same order as VitsModel.training_step
+            gen_outputs = model.forward_generator(batch)
+            y_d_hat_r, fmap_r = model.model_d.discriminate(gen_outputs.y)
+
+            model.model_d.requires_grad_(False)
+            loss_g = model.compute_generator_loss(gen_outputs, fmap_r)
+            opt_g.zero_grad()
+            loss_g.backward()
+            opt_g.step()
+            model.model_d.requires_grad_(True)
+
+            loss_d = model.compute_discriminator_loss(
+                y_d_hat_r, gen_outputs.y_hat.detach()
+            )
+            opt_d.zero_grad()
+            loss_d.backward()
+            opt_d.step()
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+        end_time = time.monotonic_ns()
+        if step_idx >= args.warmup_steps:
+            step_sec.append((end_time - start_time) / 1e9)
+
+    return step_sec
+
+
+def make_batch(args: argparse.Namespace, hparams, device: torch.device) -> Batch:
+    batch_size = args.batch_size
+    num_samples = args.num_frames * hparams.hop_length
+
+    return Batch(
+        phoneme_ids=torch.randint(
+            1, 256, (batch_size, args.num_phonemes), device=device
+        ),
+        phoneme_lengths=torch.full(
+            (batch_size,), args.num_phonemes, dtype=torch.long, device=device
+        ),
+        spectrograms=torch.rand(
+            (batch_size, hparams.filter_length // 2 + 1, args.num_frames),
+            device=device,
+        ),
+        spectrogram_lengths=torch.full(
+            (batch_size,), args.num_frames, dtype=torch.long, device=device
+        ),
+        audios=(torch.rand((batch_size, 1, num_samples), device=device) * 2) - 1,
+        audio_lengths=torch.full(
+            (batch_size,), num_samples, dtype=torch.long, device=device
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
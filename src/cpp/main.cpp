@@ -5,6 +5,7 @@
 #include <functional>
 #include <iostream>
 #include <map>
+#include <memory>
 #include <mutex>
 #include <sstream>
 #include <stdexcept>
@@ -32,6 +33,7 @@
 
 #include "json.hpp"
 #include "piper.hpp"
+#include "server.hpp"
 
 using namespace std;
 using json = nlohmann::json;
@@ -67,6 +69,9 @@ struct RunConfig {
   // Seconds of silence to add after each sentence
   optional<float> sentenceSilenceSeconds;
 
+  // Seed for models exported with --noise-seed-input (default: 0)
+  optional<int64_t> noiseSeed;
+
   // Path to espeak-ng data directory (default is next to piper executable)
   optional<filesystem::path> eSpeakDataPath;
 
@@ -79,6 +84,7 @@ struct RunConfig {
   //   "text": str,               (required)
   //   "speaker_id": int,         (optional)
   //   "speaker": str,            (optional)
+  //   "noise_seed": int,         (optional)
   //   "output_file": str,        (optional)
   // }
   bool jsonInput = false;
@@ -88,9 +94,26 @@ struct RunConfig {
 
   // true to use CUDA execution provider
   bool useCuda = false;
+
+  // Number of sentences synthesized at the same time
+  optional<int> sentenceWorkers;
+
+  // Threads used by onnxruntime within each inference
+  // (default: cores split between sentence workers)
+  optional<int> intraOpThreads;
+
+  // Serve requests on unix:PATH or tcp:[HOST:]PORT instead of reading stdin
+  optional<string> serverAddress;
+
+  // Paths to additional .onnx voice files (--server)
+  vector<filesystem::path> serverModelPaths;
 };
 
 void parseArgs(int argc, char *argv[], RunConfig &runConfig);
+void loadRunVoice(piper::PiperConfig &piperConfig, RunConfig &runConfig,
+                  filesystem::path modelPath, filesystem::path modelConfigPath,
+                  piper::Voice &voice);
+void applyRunConfig(RunConfig &runConfig, piper::Voice &voice);
 void rawOutputProc(vector<int16_t> &sharedAudioBuffer, mutex &mutAudio,
                    condition_variable &cvAudio, bool &audioReady,
                    bool &audioFinished);
@@ -98,7 +121,7 @@ void rawOutputProc(vector<int16_t> &sharedAudioBuffer, mutex &mutAudio,
 // ----------------------------------------------------------------------------
 
 int main(int argc, char *argv[]) {
-  spdlog::set_default_logger(spdlog::stderr_color_st("piper"));
+  spdlog::set_default_logger(spdlog::stderr_color_mt("piper"));
 
   RunConfig runConfig;
   parseArgs(argc, argv, runConfig);
@@ -111,17 +134,41 @@ int main(int argc, char *argv[]) {
   piper::PiperConfig piperConfig;
   piper::Voice voice;
 
-  spdlog::debug("Loading voice from {} (config={})",
-                runConfig.modelPath.string(),
-                runConfig.modelConfigPath.string());
+  loadRunVoice(piperConfig, runConfig, runConfig.modelPath,
+               runConfig.modelConfigPath, voice);
 
-  auto startTime = chrono::steady_clock::now();
-  loadVoice(piperConfig, runConfig.modelPath.string(),
-            runConfig.modelConfigPath.string(), voice, runConfig.speakerId,
-            runConfig.useCuda);
-  auto endTime = chrono::steady_clock::now();
-  spdlog::info("Loaded voice in {} second(s)",
-               chrono::duration<double>(endTime - startTime).count());
+  // Voices by name (more can be loaded with --server_voice)
+  map<string, piper::Voice *> voicesByName;
+  voicesByName[runConfig.modelPath.stem().string()] = &voice;
+
+  vector<unique_ptr<piper::Voice>> serverVoices;
+  for (auto &serverModelPath : runConfig.serverModelPaths) {
+    auto voiceName = serverModelPath.stem().string();
+    if (voicesByName.count(voiceName) > 0) {
+      throw runtime_error("Duplicate voice name: " + voiceName);
+    }
+
+    serverVoices.push_back(make_unique<piper::Voice>());
+    loadRunVoice(piperConfig, runConfig, serverModelPath,
+                 filesystem::path(serverModelPath.string() + ".json"),
+                 *serverVoices.back());
+    voicesByName[voiceName] = serverVoices.back().get();
+  }
+
+  bool useESpeak = false;
+  bool useTashkeel = false;
+  for (const auto &voiceItem : voicesByName) {
+    auto &phonemizeConfig = voiceItem.second->phonemizeConfig;
+    if (phonemizeConfig.phonemeType == piper::eSpeakPhonemes) {
+      spdlog::debug("Voice {} uses eSpeak phonemes ({})", voiceItem.first,
+                    phonemizeConfig.eSpeak.voice);
+      useESpeak = true;
+
+      if (phonemizeConfig.eSpeak.voice == "ar") {
+        useTashkeel = true;
+      }
+    }
+  }
 
   // Get the path to the piper executable so we can locate espeak-ng-data, etc.
   // next to it.
@@ -144,10 +191,7 @@ int main(int argc, char *argv[]) {
 #endif
 #endif
 
-  if (voice.phonemizeConfig.phonemeType == piper::eSpeakPhonemes) {
-    spdlog::debug("Voice uses eSpeak phonemes ({})",
-                  voice.phonemizeConfig.eSpeak.voice);
-
+  if (useESpeak) {
     if (runConfig.eSpeakDataPath) {
       // User provided path
       piperConfig.eSpeakDataPath = runConfig.eSpeakDataPath.value().string();
@@ -167,7 +211,7 @@ int main(int argc, char *argv[]) {
   }
 
   // Enable libtashkeel for Arabic
-  if (voice.phonemizeConfig.eSpeak.voice == "ar") {
+  if (useTashkeel) {
     piperConfig.useTashkeel = true;
     if (runConfig.tashkeelModelPath) {
       // User provided path
@@ -187,40 +231,23 @@ int main(int argc, char *argv[]) {
 
   piper::initialize(piperConfig);
 
-  // Scales
-  if (runConfig.noiseScale) {
-    voice.synthesisConfig.noiseScale = runConfig.noiseScale.value();
+  for (const auto &voiceItem : voicesByName) {
+    applyRunConfig(runConfig, *voiceItem.second);
   }
 
-  if (runConfig.lengthScale) {
-    voice.synthesisConfig.lengthScale = runConfig.lengthScale.value();
-  }
+  if (runConfig.serverAddress) {
+    // Long-lived server instead of stdin
+    piper::ServerConfig serverConfig;
+    serverConfig.address = runConfig.serverAddress.value();
+    serverConfig.voices = voicesByName;
+    serverConfig.defaultVoiceName = runConfig.modelPath.stem().string();
 
-  if (runConfig.noiseW) {
-    voice.synthesisConfig.noiseW = runConfig.noiseW.value();
-  }
+    piper::runServer(piperConfig, serverConfig);
+    piper::terminate(piperConfig);
 
-  if (runConfig.sentenceSilenceSeconds) {
-    voice.synthesisConfig.sentenceSilenceSeconds =
-        runConfig.sentenceSilenceSeconds.value();
+    return EXIT_SUCCESS;
   }
 
-  if (runConfig.phonemeSilenceSeconds) {
-    if (!voice.synthesisConfig.phonemeSilenceSeconds) {
-      // Overwrite
-      voice.synthesisConfig.phonemeSilenceSeconds =
-          runConfig.phonemeSilenceSeconds;
-    } else {
-      // Merge
-      for (const auto &[phoneme, silenceSeconds] :
-           *runConfig.phonemeSilenceSeconds) {
-        voice.synthesisConfig.phonemeSilenceSeconds->try_emplace(
-            phoneme, silenceSeconds);
-      }
-    }
-
-  } // if phonemeSilenceSeconds
-
   if (runConfig.outputType == OUTPUT_DIRECTORY) {
     runConfig.outputPath = filesystem::absolute(runConfig.outputPath.value());
     spdlog::info("Output directory: {}", runConfig.outputPath.value().string());
@@ -231,6 +258,7 @@ int main(int argc, char *argv[]) {
   while (getline(cin, line)) {
     auto outputType = runConfig.outputType;
     auto speakerId = voice.synthesisConfig.speakerId;
+    auto noiseSeed = voice.synthesisConfig.noiseSeed;
     std::optional<filesystem::path> maybeOutputPath = runConfig.outputPath;
 
     if (runConfig.jsonInput) {
@@ -262,6 +290,11 @@ int main(int argc, char *argv[]) {
           spdlog::warn("No speaker named: {}", speakerName);
         }
       }
+
+      if (lineRoot.contains("noise_seed")) {
+        // Override noise seed
+        voice.synthesisConfig.noiseSeed = lineRoot["noise_seed"].get<int64_t>();
+      }
     }
 
     // Timestamp is used for path to output WAV file
@@ -358,6 +391,7 @@ int main(int argc, char *argv[]) {
 
     // Restore config (--json-input)
     voice.synthesisConfig.speakerId = speakerId;
+    voice.synthesisConfig.noiseSeed = noiseSeed;
 
   } // for each line
 
@@ -368,6 +402,81 @@ int main(int argc, char *argv[]) {
 
 // ----------------------------------------------------------------------------
 
+void loadRunVoice(piper::PiperConfig &piperConfig, RunConfig &runConfig,
+                  filesystem::path modelPath, filesystem::path modelConfigPath,
+                  piper::Voice &voice) {
+  spdlog::debug("Loading voice from {} (config={})", modelPath.string(),
+                modelConfigPath.string());
+
+  if (runConfig.sentenceWorkers) {
+    voice.synthesisConfig.numSentenceWorkers =
+        max(1, runConfig.sentenceWorkers.value());
+  }
+
+  int intraOpThreads = runConfig.intraOpThreads.value_or(0);
+  if ((intraOpThreads <= 0) && (voice.synthesisConfig.numSentenceWorkers > 1)) {
+    // Avoid oversubscribing cores with concurrent inferences
+    intraOpThreads = max(1, (int)thread::hardware_concurrency() /
+                                voice.synthesisConfig.numSentenceWorkers);
+  }
+
+  if (intraOpThreads > 0) {
+    spdlog::debug("Using {} intra-op thread(s) with {} sentence worker(s)",
+                  intraOpThreads, voice.synthesisConfig.numSentenceWorkers);
+    voice.session.options.SetIntraOpNumThreads(intraOpThreads);
+  }
+
+  auto startTime = chrono::steady_clock::now();
+  loadVoice(piperConfig, modelPath.string(), modelConfigPath.string(), voice,
+            runConfig.speakerId, runConfig.useCuda);
+  auto endTime = chrono::steady_clock::now();
+  spdlog::info("Loaded voice in {} second(s)",
+               chrono::duration<double>(endTime - startTime).count());
+}
+
+// Apply synthesis settings from the command line
+void applyRunConfig(RunConfig &runConfig, piper::Voice &voice) {
+  // Scales
+  if (runConfig.noiseScale) {
+    voice.synthesisConfig.noiseScale = runConfig.noiseScale.value();
+  }
+
+  if (runConfig.lengthScale) {
+    voice.synthesisConfig.lengthScale = runConfig.lengthScale.value();
+  }
+
+  if (runConfig.noiseW) {
+    voice.synthesisConfig.noiseW = runConfig.noiseW.value();
+  }
+
+  if (runConfig.sentenceSilenceSeconds) {
+    voice.synthesisConfig.sentenceSilenceSeconds =
+        runConfig.sentenceSilenceSeconds.value();
+  }
+
+  if (runConfig.noiseSeed) {
+    voice.synthesisConfig.noiseSeed = runConfig.noiseSeed.value();
+  }
+
+  if (runConfig.phonemeSilenceSeconds) {
+    if (!voice.synthesisConfig.phonemeSilenceSeconds) {
+      // Overwrite
+      voice.synthesisConfig.phonemeSilenceSeconds =
+          runConfig.phonemeSilenceSeconds;
+    } else {
+      // Merge
+      for (const auto &[phoneme, silenceSeconds] :
+           *runConfig.phonemeSilenceSeconds) {
+        voice.synthesisConfig.phonemeSilenceSeconds->try_emplace(
+            phoneme, silenceSeconds);
+      }
+    }
+
+  } // if phonemeSilenceSeconds
+}
+
+// ----------------------------------------------------------------------------
+
 void rawOutputProc(vector<int16_t> &sharedAudioBuffer, mutex &mutAudio,
                    condition_variable &cvAudio, bool &audioReady,
                    bool &audioFinished) {
@@ -430,6 +539,9 @@ void printUsage(char *argv[]) {
   cerr << "   --sentence_silence      NUM   seconds of silence after each "
           "sentence (default: 0.2)"
        << endl;
+  cerr << "   --noise_seed            NUM   noise seed for models with a "
+          "noise_seed input (default: 0)"
+       << endl;
   cerr << "   --espeak_data           DIR   path to espeak-ng data directory"
        << endl;
   cerr << "   --tashkeel_model        FILE  path to libtashkeel onnx model "
@@ -440,6 +552,18 @@ void printUsage(char *argv[]) {
        << endl;
   cerr << "   --use-cuda                    use CUDA execution provider"
        << endl;
+  cerr << "   --sentence_workers      NUM   number of sentences to synthesize "
+          "at the same time (default: 1)"
+       << endl;
+  cerr << "   --intra_op_threads      NUM   onnxruntime threads per sentence "
+          "(default: cores / sentence workers)"
+       << endl;
+  cerr << "   --server             ADDRESS  serve requests on unix:PATH or "
+          "tcp:[HOST:]PORT instead of reading stdin"
+       << endl;
+  cerr << "   --server_voice          FILE  path to another onnx model to "
+          "serve (may be repeated)"
+       << endl;
   cerr << "   --debug                       print DEBUG messages to the console"
        << endl;
   cerr << "   -q       --quiet              disable logging" << endl;
@@ -498,6 +622,9 @@ void parseArgs(int argc, char *argv[], RunConfig &runConfig) {
     } else if (arg == "--sentence_silence" || arg == "--sentence-silence") {
       ensureArg(argc, argv, i);
       runConfig.sentenceSilenceSeconds = stof(argv[++i]);
+    } else if (arg == "--noise_seed" || arg == "--noise-seed") {
+      ensureArg(argc, argv, i);
+      runConfig.noiseSeed = (int64_t)stoll(argv[++i]);
     } else if (arg == "--phoneme_silence" || arg == "--phoneme-silence") {
       ensureArg(argc, argv, i);
       ensureArg(argc, argv, i + 1);
@@ -525,6 +652,18 @@ void parseArgs(int argc, char *argv[], RunConfig &runConfig) {
       runConfig.jsonInput = true;
     } else if (arg == "--use_cuda" || arg == "--use-cuda") {
       runConfig.useCuda = true;
+    } else if (arg == "--sentence_workers" || arg == "--sentence-workers") {
+      ensureArg(argc, argv, i);
+      runConfig.sentenceWorkers = stoi(argv[++i]);
+    } else if (arg == "--intra_op_threads" || arg == "--intra-op-threads") {
+      ensureArg(argc, argv, i);
+      runConfig.intraOpThreads = stoi(argv[++i]);
+    } else if (arg == "--server") {
+      ensureArg(argc, argv, i);
+      runConfig.serverAddress = argv[++i];
+    } else if (arg == "--server_voice" || arg == "--server-voice") {
+      ensureArg(argc, argv, i);
+      runConfig.serverModelPaths.push_back(filesystem::path(argv[++i]));
     } else if (arg == "--version") {
       std::cout << piper::getVersion() << std::endl;
       exit(0);
@@ -558,4 +697,13 @@ void parseArgs(int argc, char *argv[], RunConfig &runConfig) {
   if (!modelConfigFile.good()) {
     throw runtime_error("Model config doesn't exist");
   }
+
+  // Verify server voices exist (config is next to model)
+  for (auto &serverModelPath : runConfig.serverModelPaths) {
+    if (!filesystem::exists(serverModelPath) ||
+        !filesystem::exists(serverModelPath.string() + ".json")) {
+      throw runtime_error("Server voice or its config doesn't exist: " +
+                          serverModelPath.string());
+    }
+  }
 }
@@ -1,9 +1,15 @@
+#include <algorithm>
 #include <array>
+#include <atomic>
 #include <chrono>
+#include <condition_variable>
+#include <exception>
 #include <fstream>
 #include <limits>
+#include <mutex>
 #include <sstream>
 #include <stdexcept>
+#include <thread>
 
 #include <espeak-ng/speak_lib.h>
 #include <onnxruntime_cxx_api.h>
@@ -30,6 +36,9 @@ const float MAX_WAV_VALUE = 32767.0f;
 
 const std::string instanceName{"piper"};
 
+// eSpeak and libtashkeel are not thread-safe
+std::mutex phonemizeMutex;
+
 std::string getVersion() { return VERSION; }
 
 // True if the string is a single UTF-8 codepoint
@@ -274,6 +283,9 @@ void loadModel(std::string modelPath, ModelSession &session, bool useCuda) {
 
   // Slows down performance by ~2x
   // session.options.SetIntraOpNumThreads(1);
+  //
+  // NOTE: Callers may set intra-op threads on session.options before loading,
+  // e.g. to split cores between sentence workers (see numSentenceWorkers).
 
   // Roughly doubles load time for no visible inference benefit
   // session.options.SetGraphOptimizationLevel(
@@ -300,6 +312,13 @@ void loadModel(std::string modelPath, ModelSession &session, bool useCuda) {
 
   session.onnx = Ort::Session(session.env, modelPathStr, session.options);
 
+  // Inputs differ between models (sid, noise_seed)
+  session.inputNames.clear();
+  for (std::size_t i = 0; i < session.onnx.GetInputCount(); i++) {
+    session.inputNames.push_back(
+        session.onnx.GetInputNameAllocated(i, session.allocator).get());
+  }
+
   auto endTime = std::chrono::steady_clock::now();
   spdlog::debug("Loaded onnx model in {} second(s)",
                 std::chrono::duration<double>(endTime - startTime).count());
@@ -348,37 +367,50 @@ void synthesize(std::vector<PhonemeId> &phonemeIds,
                             synthesisConfig.lengthScale,
                             synthesisConfig.noiseW};
 
-  std::vector<Ort::Value> inputTensors;
-  std::vector<int64_t> phonemeIdsShape{1, (int64_t)phonemeIds.size()};
-  inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
-      memoryInfo, phonemeIds.data(), phonemeIds.size(), phonemeIdsShape.data(),
-      phonemeIdsShape.size()));
+  // Speaker id (defaults to 0 for models with a sid input) and noise seed.
+  // NOTE: These must be kept alive until the model is run.
+  std::vector<int64_t> speakerId{
+      (int64_t)synthesisConfig.speakerId.value_or(0)};
+  std::vector<int64_t> noiseSeed{synthesisConfig.noiseSeed};
 
+  std::vector<int64_t> phonemeIdsShape{1, (int64_t)phonemeIds.size()};
   std::vector<int64_t> phomemeIdLengthsShape{(int64_t)phonemeIdLengths.size()};
-  inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
-      memoryInfo, phonemeIdLengths.data(), phonemeIdLengths.size(),
-      phomemeIdLengthsShape.data(), phomemeIdLengthsShape.size()));
-
   std::vector<int64_t> scalesShape{(int64_t)scales.size()};
-  inputTensors.push_back(
-      Ort::Value::CreateTensor<float>(memoryInfo, scales.data(), scales.size(),
-                                      scalesShape.data(), scalesShape.size()));
-
-  // Add speaker id.
-  // NOTE: These must be kept outside the "if" below to avoid being deallocated.
-  std::vector<int64_t> speakerId{
-      (int64_t)synthesisConfig.speakerId.value_or(0)};
   std::vector<int64_t> speakerIdShape{(int64_t)speakerId.size()};
+  std::vector<int64_t> noiseSeedShape{(int64_t)noiseSeed.size()};
+
+  // From export_onnx.py. Inputs are passed in the model's order, since
+  // optional inputs (sid, noise_seed) may or may not be present.
+  std::vector<Ort::Value> inputTensors;
+  std::vector<const char *> inputNames;
+  for (const auto &inputName : session.inputNames) {
+    if (inputName == "input") {
+      inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
+          memoryInfo, phonemeIds.data(), phonemeIds.size(),
+          phonemeIdsShape.data(), phonemeIdsShape.size()));
+    } else if (inputName == "input_lengths") {
+      inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
+          memoryInfo, phonemeIdLengths.data(), phonemeIdLengths.size(),
+          phomemeIdLengthsShape.data(), phomemeIdLengthsShape.size()));
+    } else if (inputName == "scales") {
+      inputTensors.push_back(Ort::Value::CreateTensor<float>(
+          memoryInfo, scales.data(), scales.size(), scalesShape.data(),
+          scalesShape.size()));
+    } else if (inputName == "sid") {
+      inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
+          memoryInfo, speakerId.data(), speakerId.size(), speakerIdShape.data(),
+          speakerIdShape.size()));
+    } else if (inputName == "noise_seed") {
+      inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
+          memoryInfo, noiseSeed.data(), noiseSeed.size(), noiseSeedShape.data(),
+          noiseSeedShape.size()));
+    } else {
+      throw std::runtime_error("Unexpected model input: " + inputName);
+    }
 
-  if (synthesisConfig.speakerId) {
-    inputTensors.push_back(Ort::Value::CreateTensor<int64_t>(
-        memoryInfo, speakerId.data(), speakerId.size(), speakerIdShape.data(),
-        speakerIdShape.size()));
+    inputNames.push_back(inputName.c_str());
   }
 
-  // From export_onnx.py
-  std::array<const char *, 4> inputNames = {"input", "input_lengths", "scales",
-                                            "sid"};
   std::array<const char *, 1> outputNames = {"output"};
 
   // Infer
@@ -442,48 +474,97 @@ void synthesize(std::vector<PhonemeId> &phonemeIds,
 
 // ----------------------------------------------------------------------------
 
+// Phoneme ids of a sentence's phrases, and the sentence's synthesized audio
+struct SentenceJob {
+  std::vector<std::vector<PhonemeId>> phraseIds;
+  std::vector<std::size_t> phraseSilenceSamples;
+
+  std::vector<int16_t> audioBuffer;
+  SynthesisResult result{};
+  std::exception_ptr error;
+};
+
+// Synthesize all phrases of a sentence into the job's own audio buffer
+void synthesizeSentence(SentenceJob &job, SynthesisConfig &synthesisConfig,
+                        ModelSession &session) {
+  try {
+    for (size_t phraseIdx = 0; phraseIdx < job.phraseIds.size(); phraseIdx++) {
+      // ids -> audio
+      SynthesisResult phraseResult{};
+      synthesize(job.phraseIds[phraseIdx], synthesisConfig, session,
+                 job.audioBuffer, phraseResult);
+
+      // Add end of phrase silence
+      job.audioBuffer.insert(job.audioBuffer.end(),
+                             job.phraseSilenceSamples[phraseIdx], 0);
+
+      job.result.audioSeconds += phraseResult.audioSeconds;
+      job.result.inferSeconds += phraseResult.inferSeconds;
+    }
+  } catch (...) {
+    // Rethrown in order by textToAudio
+    job.error = std::current_exception();
+  }
+}
+
 // Phonemize text and synthesize audio
-void textToAudio(PiperConfig &config, Voice &voice, std::string text,
+void textToAudio(PiperConfig &config, Voice &voice,
+                 SynthesisConfig &synthesisConfig, std::string text,
                  std::vector<int16_t> &audioBuffer, SynthesisResult &result,
                  const std::function<void()> &audioCallback) {
 
   std::size_t sentenceSilenceSamples = 0;
-  if (voice.synthesisConfig.sentenceSilenceSeconds > 0) {
-    sentenceSilenceSamples = (std::size_t)(
-        voice.synthesisConfig.sentenceSilenceSeconds *
-        voice.synthesisConfig.sampleRate * voice.synthesisConfig.channels);
-  }
-
-  if (config.useTashkeel) {
-    if (!config.tashkeelState) {
-      throw std::runtime_error("Tashkeel model is not loaded");
-    }
-
-    spdlog::debug("Diacritizing text with libtashkeel: {}", text);
-    text = tashkeel::tashkeel_run(text, *config.tashkeelState);
+  if (synthesisConfig.sentenceSilenceSeconds > 0) {
+    sentenceSilenceSamples =
+        (std::size_t)(synthesisConfig.sentenceSilenceSeconds *
+                      synthesisConfig.sampleRate * synthesisConfig.channels);
   }
 
   // Phonemes for each sentence
-  spdlog::debug("Phonemizing text: {}", text);
   std::vector<std::vector<Phoneme>> phonemes;
 
-  if (voice.phonemizeConfig.phonemeType == eSpeakPhonemes) {
-    // Use espeak-ng for phonemization
-    eSpeakPhonemeConfig eSpeakConfig;
-    eSpeakConfig.voice = voice.phonemizeConfig.eSpeak.voice;
-    phonemize_eSpeak(text, eSpeakConfig, phonemes);
-  } else {
-    // Use UTF-8 codepoints as "phonemes"
-    CodepointsPhonemeConfig codepointsConfig;
-    phonemize_codepoints(text, codepointsConfig, phonemes);
+  {
+    // eSpeak and libtashkeel state is shared by all voices and threads
+    std::unique_lock lockPhonemize(phonemizeMutex);
+
+    if (config.useTashkeel) {
+      if (!config.tashkeelState) {
+        throw std::runtime_error("Tashkeel model is not loaded");
+      }
+
+      spdlog::debug("Diacritizing text with libtashkeel: {}", text);
+      text = tashkeel::tashkeel_run(text, *config.tashkeelState);
+    }
+
+    spdlog::debug("Phonemizing text: {}", text);
+
+    if (voice.phonemizeConfig.phonemeType == eSpeakPhonemes) {
+      // Use espeak-ng for phonemization
+      eSpeakPhonemeConfig eSpeakConfig;
+      eSpeakConfig.voice = voice.phonemizeConfig.eSpeak.voice;
+      phonemize_eSpeak(text, eSpeakConfig, phonemes);
+    } else {
+      // Use UTF-8 codepoints as "phonemes"
+      CodepointsPhonemeConfig codepointsConfig;
+      phonemize_codepoints(text, codepointsConfig, phonemes);
+    }
   }
 
-  // Synthesize each sentence independently.
+  // Phoneme ids for each sentence, split into phrases.
+  // Sentences are synthesized independently.
+  std::vector<SentenceJob> sentenceJobs(phonemes.size());
   std::vector<PhonemeId> phonemeIds;
   std::map<Phoneme, std::size_t> missingPhonemes;
-  for (auto phonemesIter = phonemes.begin(); phonemesIter != phonemes.end();
-       ++phonemesIter) {
-    std::vector<Phoneme> &sentencePhonemes = *phonemesIter;
+
+  // Use phoneme/id map from config
+  PhonemeIdConfig idConfig;
+  idConfig.phonemeIdMap =
+      std::make_shared<PhonemeIdMap>(voice.phonemizeConfig.phonemeIdMap);
+
+  for (std::size_t sentenceIdx = 0; sentenceIdx < phonemes.size();
+       sentenceIdx++) {
+    std::vector<Phoneme> &sentencePhonemes = phonemes[sentenceIdx];
+    SentenceJob &sentenceJob = sentenceJobs[sentenceIdx];
 
     if (spdlog::should_log(spdlog::level::debug)) {
       // DEBUG log for phonemes
@@ -497,18 +578,12 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
     }
 
     std::vector<std::shared_ptr<std::vector<Phoneme>>> phrasePhonemes;
-    std::vector<SynthesisResult> phraseResults;
     std::vector<size_t> phraseSilenceSamples;
 
-    // Use phoneme/id map from config
-    PhonemeIdConfig idConfig;
-    idConfig.phonemeIdMap =
-        std::make_shared<PhonemeIdMap>(voice.phonemizeConfig.phonemeIdMap);
-
-    if (voice.synthesisConfig.phonemeSilenceSeconds) {
+    if (synthesisConfig.phonemeSilenceSeconds) {
       // Split into phrases
       std::map<Phoneme, float> &phonemeSilenceSeconds =
-          *voice.synthesisConfig.phonemeSilenceSeconds;
+          *synthesisConfig.phonemeSilenceSeconds;
 
       auto currentPhrasePhonemes = std::make_shared<std::vector<Phoneme>>();
       phrasePhonemes.push_back(currentPhrasePhonemes);
@@ -523,8 +598,8 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
           // Split at phrase boundary
           phraseSilenceSamples.push_back(
               (std::size_t)(phonemeSilenceSeconds[currentPhoneme] *
-                            voice.synthesisConfig.sampleRate *
-                            voice.synthesisConfig.channels));
+                            synthesisConfig.sampleRate *
+                            synthesisConfig.channels));
 
           currentPhrasePhonemes = std::make_shared<std::vector<Phoneme>>();
           phrasePhonemes.push_back(currentPhrasePhonemes);
@@ -536,22 +611,17 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
           std::make_shared<std::vector<Phoneme>>(sentencePhonemes));
     }
 
-    // Ensure results/samples are the same size
-    while (phraseResults.size() < phrasePhonemes.size()) {
-      phraseResults.emplace_back();
-    }
-
+    // Ensure samples are the same size
     while (phraseSilenceSamples.size() < phrasePhonemes.size()) {
       phraseSilenceSamples.push_back(0);
     }
 
-    // phonemes -> ids -> audio
+    // phonemes -> ids
     for (size_t phraseIdx = 0; phraseIdx < phrasePhonemes.size(); phraseIdx++) {
       if (phrasePhonemes[phraseIdx]->size() <= 0) {
         continue;
       }
 
-      // phonemes -> ids
       phonemes_to_ids(*(phrasePhonemes[phraseIdx]), idConfig, phonemeIds,
                       missingPhonemes);
       if (spdlog::should_log(spdlog::level::debug)) {
@@ -566,35 +636,99 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
                       phonemeIdsStr.str());
       }
 
-      // ids -> audio
-      synthesize(phonemeIds, voice.synthesisConfig, voice.session, audioBuffer,
-                 phraseResults[phraseIdx]);
+      sentenceJob.phraseIds.push_back(std::move(phonemeIds));
+      sentenceJob.phraseSilenceSamples.push_back(
+          phraseSilenceSamples[phraseIdx]);
+      phonemeIds.clear();
+    }
+  }
 
-      // Add end of phrase silence
-      for (std::size_t i = 0; i < phraseSilenceSamples[phraseIdx]; i++) {
-        audioBuffer.push_back(0);
+  // Sentences are synthesized by a pool of worker threads (sharing the ONNX
+  // session), or one at a time on this thread. Either way, each sentence's
+  // audio is output in order as soon as it and the ones before it are done.
+  std::size_t numWorkers = 0;
+  if (synthesisConfig.numSentenceWorkers > 1) {
+    numWorkers = std::min((std::size_t)synthesisConfig.numSentenceWorkers,
+                          sentenceJobs.size());
+  }
+
+  std::mutex jobsMutex;
+  std::condition_variable jobDone;
+  std::vector<bool> isJobDone(sentenceJobs.size(), false);
+  std::atomic<std::size_t> nextJobIdx{0};
+
+  std::vector<std::thread> workers;
+  for (std::size_t workerIdx = 0; workerIdx < numWorkers; workerIdx++) {
+    workers.emplace_back([&]() {
+      while (true) {
+        std::size_t jobIdx = nextJobIdx++;
+        if (jobIdx >= sentenceJobs.size()) {
+          break;
+        }
+
+        synthesizeSentence(sentenceJobs[jobIdx], synthesisConfig,
+                           voice.session);
+
+        {
+          std::unique_lock lockJobs(jobsMutex);
+          isJobDone[jobIdx] = true;
+        }
+        jobDone.notify_all();
       }
+    });
+  }
 
-      result.audioSeconds += phraseResults[phraseIdx].audioSeconds;
-      result.inferSeconds += phraseResults[phraseIdx].inferSeconds;
+  std::exception_ptr error;
+  try {
+    for (std::size_t sentenceIdx = 0; sentenceIdx < sentenceJobs.size();
+         sentenceIdx++) {
+      SentenceJob &sentenceJob = sentenceJobs[sentenceIdx];
+
+      if (workers.empty()) {
+        synthesizeSentence(sentenceJob, synthesisConfig, voice.session);
+      } else {
+        std::unique_lock lockJobs(jobsMutex);
+        jobDone.wait(lockJobs, [&isJobDone, sentenceIdx] {
+          return isJobDone[sentenceIdx];
+        });
+      }
 
-      phonemeIds.clear();
-    }
+      if (sentenceJob.error) {
+        std::rethrow_exception(sentenceJob.error);
+      }
+
+      audioBuffer.insert(audioBuffer.end(), sentenceJob.audioBuffer.begin(),
+                         sentenceJob.audioBuffer.end());
+
+      // Free sentence audio now that it's been copied
+      std::vector<int16_t>().swap(sentenceJob.audioBuffer);
+
+      // Add end of sentence silence
+      audioBuffer.insert(audioBuffer.end(), sentenceSilenceSamples, 0);
 
-    // Add end of sentence silence
-    if (sentenceSilenceSamples > 0) {
-      for (std::size_t i = 0; i < sentenceSilenceSamples; i++) {
-        audioBuffer.push_back(0);
+      // Inference time is summed over sentences, even when they overlap
+      result.audioSeconds += sentenceJob.result.audioSeconds;
+      result.inferSeconds += sentenceJob.result.inferSeconds;
+
+      if (audioCallback) {
+        // Call back must copy audio since it is cleared afterwards.
+        audioCallback();
+        audioBuffer.clear();
       }
     }
+  } catch (...) {
+    // Failed sentence or callback. Stop handing out sentences, and rethrow
+    // once the workers are finished.
+    error = std::current_exception();
+    nextJobIdx = sentenceJobs.size();
+  }
 
-    if (audioCallback) {
-      // Call back must copy audio since it is cleared afterwards.
-      audioCallback();
-      audioBuffer.clear();
-    }
+  for (auto &worker : workers) {
+    worker.join();
+  }
 
-    phonemeIds.clear();
+  if (error) {
+    std::rethrow_exception(error);
   }
 
   if (missingPhonemes.size() > 0) {
@@ -615,15 +749,22 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
 
 } /* textToAudio */
 
+void textToAudio(PiperConfig &config, Voice &voice, std::string text,
+                 std::vector<int16_t> &audioBuffer, SynthesisResult &result,
+                 const std::function<void()> &audioCallback) {
+  textToAudio(config, voice, voice.synthesisConfig, text, audioBuffer, result,
+              audioCallback);
+}
+
 // Phonemize text and synthesize audio to WAV file
-void textToWavFile(PiperConfig &config, Voice &voice, std::string text,
+void textToWavFile(PiperConfig &config, Voice &voice,
+                   SynthesisConfig &synthesisConfig, std::string text,
                    std::ostream &audioFile, SynthesisResult &result) {
 
   std::vector<int16_t> audioBuffer;
-  textToAudio(config, voice, text, audioBuffer, result, NULL);
+  textToAudio(config, voice, synthesisConfig, text, audioBuffer, result, NULL);
 
   // Write WAV
-  auto synthesisConfig = voice.synthesisConfig;
   writeWavHeader(synthesisConfig.sampleRate, synthesisConfig.sampleWidth,
                  synthesisConfig.channels, (int32_t)audioBuffer.size(),
                  audioFile);
@@ -633,4 +774,9 @@ void textToWavFile(PiperConfig &config, Voice &voice, std::string text,
 
 } /* textToWavFile */
 
+void textToWavFile(PiperConfig &config, Voice &voice, std::string text,
+                   std::ostream &audioFile, SynthesisResult &result) {
+  textToWavFile(config, voice, voice.synthesisConfig, text, audioFile, result);
+}
+
 } // namespace piper
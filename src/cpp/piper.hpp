@@ -63,9 +63,17 @@ struct SynthesisConfig {
   // Speaker id from 0 to numSpeakers - 1
   std::optional<SpeakerId> speakerId;
 
+  // Seed for the noise of models exported with --noise-seed-input.
+  // The same text, settings, and seed always give the same audio.
+  int64_t noiseSeed = 0;
+
   // Extra silence
   float sentenceSilenceSeconds = 0.2f;
   std::optional<std::map<piper::Phoneme, float>> phonemeSilenceSeconds;
+
+  // Number of threads synthesizing sentences at the same time.
+  // Audio is still output in sentence order. 1 = one sentence at a time.
+  int numSentenceWorkers = 1;
 };
 
 struct ModelConfig {
@@ -77,6 +85,9 @@ struct ModelConfig {
 
 struct ModelSession {
   Ort::Session onnx;
+
+  // Names of the model's inputs, in order (see export_onnx.py)
+  std::vector<std::string> inputNames;
   Ort::AllocatorWithDefaultOptions allocator;
   Ort::SessionOptions options;
   Ort::Env env;
@@ -123,10 +134,21 @@ void textToAudio(PiperConfig &config, Voice &voice, std::string text,
                  std::vector<int16_t> &audioBuffer, SynthesisResult &result,
                  const std::function<void()> &audioCallback);
 
+// Same, with synthesis settings other than the voice's (e.g. per request).
+// Safe to call from multiple threads.
+void textToAudio(PiperConfig &config, Voice &voice,
+                 SynthesisConfig &synthesisConfig, std::string text,
+                 std::vector<int16_t> &audioBuffer, SynthesisResult &result,
+                 const std::function<void()> &audioCallback);
+
 // Phonemize text and synthesize audio to WAV file
 void textToWavFile(PiperConfig &config, Voice &voice, std::string text,
                    std::ostream &audioFile, SynthesisResult &result);
 
+void textToWavFile(PiperConfig &config, Voice &voice,
+                   SynthesisConfig &synthesisConfig, std::string text,
+                   std::ostream &audioFile, SynthesisResult &result);
+
 } // namespace piper
 
 #endif // PIPER_H_
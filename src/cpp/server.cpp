@@ -0,0 +1,385 @@
+#include <cerrno>
+#include <cstdint>
+#include <cstring>
+#include <functional>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+#ifndef _WIN32
+#include <csignal>
+#include <netdb.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+#endif
+
+#include <spdlog/spdlog.h>
+
+#include "json.hpp"
+#include "server.hpp"
+
+namespace piper {
+
+#ifdef _WIN32
+
+void runServer(PiperConfig &, ServerConfig &) {
+  throw std::runtime_error("Server mode is not supported on Windows");
+}
+
+#else
+
+// Frame types (see server.hpp)
+const char FRAME_REQUEST = 'R';
+const char FRAME_HEADER = 'H';
+const char FRAME_AUDIO = 'A';
+const char FRAME_DONE = 'D';
+const char FRAME_ERROR = 'E';
+
+// Largest request payload accepted from a client
+const uint32_t MAX_REQUEST_BYTES = 16 * 1024 * 1024;
+
+// Client disconnected or socket failed
+struct ConnectionError : public std::runtime_error {
+  using std::runtime_error::runtime_error;
+};
+
+// Read exactly size bytes. Returns false if the connection is closed first.
+bool readExactly(int fd, char *data, std::size_t size) {
+  while (size > 0) {
+    ssize_t numRead = recv(fd, data, size, 0);
+    if (numRead < 0) {
+      if (errno == EINTR) {
+        continue;
+      }
+
+      throw ConnectionError(std::string("Read failed: ") + strerror(errno));
+    }
+
+    if (numRead == 0) {
+      return false;
+    }
+
+    data += numRead;
+    size -= (std::size_t)numRead;
+  }
+
+  return true;
+}
+
+void writeExactly(int fd, const char *data, std::size_t size) {
+  while (size > 0) {
+    ssize_t numWritten = send(fd, data, size, 0);
+    if (numWritten < 0) {
+      if (errno == EINTR) {
+        continue;
+      }
+
+      throw ConnectionError(std::string("Write failed: ") + strerror(errno));
+    }
+
+    data += numWritten;
+    size -= (std::size_t)numWritten;
+  }
+}
+
+// Read the next frame. Returns false if the client closed the connection.
+bool readFrame(int fd, char &frameType, std::string &payload) {
+  unsigned char header[5];
+  if (!readExactly(fd, (char *)header, sizeof(header))) {
+    return false;
+  }
+
+  frameType = (char)header[0];
+  uint32_t payloadSize = ((uint32_t)header[1] << 24) |
+                         ((uint32_t)header[2] << 16) |
+                         ((uint32_t)header[3] << 8) | (uint32_t)header[4];
+
+  if (payloadSize > MAX_REQUEST_BYTES) {
+    throw ConnectionError("Frame is too large");
+  }
+
+  payload.resize(payloadSize);
+  if ((payloadSize > 0) && !readExactly(fd, payload.data(), payloadSize)) {
+    throw ConnectionError("Connection closed in the middle of a frame");
+  }
+
+  return true;
+}
+
+void writeFrame(int fd, char frameType, const char *data, std::size_t size) {
+  uint32_t payloadSize = (uint32_t)size;
+  unsigned char header[5] = {
+      (unsigned char)frameType, (unsigned char)(payloadSize >> 24),
+      (unsigned char)(payloadSize >> 16), (unsigned char)(payloadSize >> 8),
+      (unsigned char)payloadSize};
+
+  writeExactly(fd, (const char *)header, sizeof(header));
+  writeExactly(fd, data, size);
+}
+
+void writeJsonFrame(int fd, char frameType, const json &value) {
+  std::string payload = value.dump();
+  writeFrame(fd, frameType, payload.data(), payload.size());
+}
+
+// Bind and listen on unix:PATH or tcp:[HOST:]PORT
+int listenOn(const std::string &address) {
+  if (address.rfind("unix:", 0) == 0) {
+    std::string socketPath = address.substr(5);
+
+    sockaddr_un socketAddress{};
+    socketAddress.sun_family = AF_UNIX;
+    if (socketPath.empty() ||
+        (socketPath.size() >= sizeof(socketAddress.sun_path))) {
+      throw std::runtime_error("Invalid Unix socket path: " + socketPath);
+    }
+
+    std::strncpy(socketAddress.sun_path, socketPath.c_str(),
+                 sizeof(socketAddress.sun_path) - 1);
+
+    // Remove socket left over from a previous run
+    unlink(socketPath.c_str());
+
+    int serverFd = socket(AF_UNIX, SOCK_STREAM, 0);
+    if ((serverFd < 0) ||
+        (bind(serverFd, (sockaddr *)&socketAddress, sizeof(socketAddress)) <
+         0) ||
+        (listen(serverFd, SOMAXCONN) < 0)) {
+      std::string error = strerror(errno);
+      if (serverFd >= 0) {
+        close(serverFd);
+      }
+
+      throw std::runtime_error("Failed to listen on " + address + ": " + error);
+    }
+
+    return serverFd;
+  }
+
+  if (address.rfind("tcp:", 0) != 0) {
+    throw std::runtime_error("Server address must be unix:PATH or "
+                             "tcp:[HOST:]PORT, got: " +
+                             address);
+  }
+
+  std::string host = "127.0.0.1";
+  std::string port = address.substr(4);
+  auto colonIdx = port.rfind(':');
+  if (colonIdx != std::string::npos) {
+    host = port.substr(0, colonIdx);
+    port = port.substr(colonIdx + 1);
+  }
+
+  addrinfo hints{};
+  hints.ai_family = AF_UNSPEC;
+  hints.ai_socktype = SOCK_STREAM;
+  hints.ai_flags = AI_PASSIVE;
+
+  addrinfo *addresses = nullptr;
+  int result = getaddrinfo(host.c_str(), port.c_str(), &hints, &addresses);
+  if (result != 0) {
+    throw std::runtime_error("Invalid server address " + address + ": " +
+                             gai_strerror(result));
+  }
+
+  int serverFd = -1;
+  std::string error;
+  for (addrinfo *info = addresses; info != nullptr; info = info->ai_next) {
+    serverFd = socket(info->ai_family, info->ai_socktype, info->ai_protocol);
+    if (serverFd < 0) {
+      error = strerror(errno);
+      continue;
+    }
+
+    // Allow restarting the server right away
+    int reuseAddress = 1;
+    setsockopt(serverFd, SOL_SOCKET, SO_REUSEADDR, &reuseAddress,
+               sizeof(reuseAddress));
+
+    if ((bind(serverFd, info->ai_addr, info->ai_addrlen) == 0) &&
+        (listen(serverFd, SOMAXCONN) == 0)) {
+      break;
+    }
+
+    error = strerror(errno);
+    close(serverFd);
+    serverFd = -1;
+  }
+
+  freeaddrinfo(addresses);
+
+  if (serverFd < 0) {
+    throw std::runtime_error("Failed to listen on " + address + ": " + error);
+  }
+
+  return serverFd;
+}
+
+// Synthesize one request, streaming audio to the client sentence by sentence
+void handleRequest(PiperConfig &piperConfig, ServerConfig &serverConfig,
+                   int clientFd, const std::string &payload) {
+  json requestRoot = json::parse(payload);
+
+  if (!requestRoot.contains("text")) {
+    throw std::runtime_error("Request has no text");
+  }
+
+  std::string text = requestRoot["text"].get<std::string>();
+
+  std::string voiceName = serverConfig.defaultVoiceName;
+  if (requestRoot.contains("voice")) {
+    voiceName = requestRoot["voice"].get<std::string>();
+  }
+
+  auto voiceIter = serverConfig.voices.find(voiceName);
+  if (voiceIter == serverConfig.voices.end()) {
+    throw std::runtime_error("No voice named: " + voiceName);
+  }
+
+  Voice &voice = *voiceIter->second;
+
+  // Copy, so requests don't change each other's settings
+  SynthesisConfig synthesisConfig = voice.synthesisConfig;
+
+  if (requestRoot.contains("speaker_id")) {
+    synthesisConfig.speakerId = requestRoot["speaker_id"].get<SpeakerId>();
+  } else if (requestRoot.contains("speaker")) {
+    // Resolve to id using speaker id map
+    auto speakerName = requestRoot["speaker"].get<std::string>();
+    if ((!voice.modelConfig.speakerIdMap) ||
+        (voice.modelConfig.speakerIdMap->count(speakerName) < 1)) {
+      throw std::runtime_error("No speaker named: " + speakerName);
+    }
+
+    synthesisConfig.speakerId = (*voice.modelConfig.speakerIdMap)[speakerName];
+  }
+
+  if (requestRoot.contains("length_scale")) {
+    synthesisConfig.lengthScale = requestRoot["length_scale"].get<float>();
+  }
+
+  if (requestRoot.contains("noise_scale")) {
+    synthesisConfig.noiseScale = requestRoot["noise_scale"].get<float>();
+  }
+
+  if (requestRoot.contains("noise_w")) {
+    synthesisConfig.noiseW = requestRoot["noise_w"].get<float>();
+  }
+
+  if (requestRoot.contains("noise_seed")) {
+    synthesisConfig.noiseSeed = requestRoot["noise_seed"].get<int64_t>();
+  }
+
+  if (requestRoot.contains("sentence_silence")) {
+    synthesisConfig.sentenceSilenceSeconds =
+        requestRoot["sentence_silence"].get<float>();
+  }
+
+  writeJsonFrame(clientFd, FRAME_HEADER,
+                 {{"voice", voiceName},
+                  {"sample_rate", synthesisConfig.sampleRate},
+                  {"sample_width", synthesisConfig.sampleWidth},
+                  {"channels", synthesisConfig.channels}});
+
+  std::vector<int16_t> audioBuffer;
+  SynthesisResult result;
+  auto audioCallback = [clientFd, &audioBuffer]() {
+    writeFrame(clientFd, FRAME_AUDIO, (const char *)audioBuffer.data(),
+               sizeof(int16_t) * audioBuffer.size());
+  };
+
+  textToAudio(piperConfig, voice, synthesisConfig, text, audioBuffer, result,
+              audioCallback);
+
+  writeJsonFrame(clientFd, FRAME_DONE,
+                 {{"infer_seconds", result.inferSeconds},
+                  {"audio_seconds", result.audioSeconds},
+                  {"real_time_factor", result.realTimeFactor}});
+
+  spdlog::info("Real-time factor: {} (infer={} sec, audio={} sec, voice={})",
+               result.realTimeFactor, result.inferSeconds, result.audioSeconds,
+               voiceName);
+}
+
+// Answer requests on a connection until the client closes it
+void serveConnection(PiperConfig &piperConfig, ServerConfig &serverConfig,
+                     int clientFd) {
+  spdlog::debug("Client connected (fd={})", clientFd);
+
+  try {
+    char frameType = 0;
+    std::string payload;
+    while (readFrame(clientFd, frameType, payload)) {
+      if (frameType != FRAME_REQUEST) {
+        writeJsonFrame(clientFd, FRAME_ERROR,
+                       {{"error", "Unexpected frame type"}});
+        break;
+      }
+
+      try {
+        handleRequest(piperConfig, serverConfig, clientFd, payload);
+      } catch (const ConnectionError &) {
+        throw;
+      } catch (const std::exception &e) {
+        spdlog::warn("Request failed: {}", e.what());
+        writeJsonFrame(clientFd, FRAME_ERROR, {{"error", e.what()}});
+      }
+    }
+  } catch (const std::exception &e) {
+    spdlog::debug("Connection error (fd={}): {}", clientFd, e.what());
+  }
+
+  close(clientFd);
+  spdlog::debug("Client disconnected (fd={})", clientFd);
+}
+
+void runServer(PiperConfig &piperConfig, ServerConfig &serverConfig) {
+  if (serverConfig.voices.count(serverConfig.defaultVoiceName) < 1) {
+    throw std::runtime_error("No default voice for server");
+  }
+
+  // Clients that disconnect in the middle of a response must not stop the
+  // server. Writes to them fail with EPIPE instead.
+  signal(SIGPIPE, SIG_IGN);
+
+  int serverFd = listenOn(serverConfig.address);
+
+  std::string voiceNames;
+  for (const auto &voiceItem : serverConfig.voices) {
+    voiceNames += (voiceNames.empty() ? "" : ", ") + voiceItem.first;
+  }
+
+  spdlog::info("Listening on {} (voices: {})", serverConfig.address,
+               voiceNames);
+
+  while (true) {
+    int clientFd = accept(serverFd, nullptr, nullptr);
+    if (clientFd < 0) {
+      if ((errno == EINTR) || (errno == ECONNABORTED)) {
+        continue;
+      }
+
+      std::string error = strerror(errno);
+      close(serverFd);
+      throw std::runtime_error("Failed to accept connection: " + error);
+    }
+
+    // Send small frames right away (fails harmlessly on Unix sockets)
+    int noDelay = 1;
+    setsockopt(clientFd, IPPROTO_TCP, TCP_NODELAY, &noDelay, sizeof(noDelay));
+
+    // One thread per connection. Requests on different connections run
+    // concurrently, sharing each voice's onnx session.
+    std::thread(serveConnection, std::ref(piperConfig), std::ref(serverConfig),
+                clientFd)
+        .detach();
+  }
+}
+
+#endif
+
+} // namespace piper
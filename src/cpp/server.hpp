@@ -0,0 +1,57 @@
+#ifndef PIPER_SERVER_H_
+#define PIPER_SERVER_H_
+
+#include <map>
+#include <string>
+
+#include "piper.hpp"
+
+namespace piper {
+
+// Long-lived synthesis server (piper --server ADDRESS).
+//
+// ADDRESS is unix:PATH for a Unix domain socket, or tcp:[HOST:]PORT for TCP
+// (HOST defaults to 127.0.0.1).
+//
+// Every message in either direction is a frame:
+//   1 byte   frame type
+//   4 bytes  payload length (unsigned, big endian)
+//   N bytes  payload
+//
+// Client -> server:
+//   'R'  request (JSON):
+//        {
+//          "text": str,               (required)
+//          "voice": str,              (optional, default: first voice)
+//          "speaker_id": int,         (optional)
+//          "speaker": str,            (optional)
+//          "length_scale": float,     (optional)
+//          "noise_scale": float,      (optional)
+//          "noise_w": float,          (optional)
+//          "noise_seed": int,         (optional)
+//          "sentence_silence": float  (optional)
+//        }
+//
+// Server -> client, for each request:
+//   'H'  header (JSON): {"voice", "sample_rate", "sample_width", "channels"}
+//   'A'  audio: 16-bit little-endian PCM of one sentence (zero or more frames)
+//   'D'  done (JSON): {"infer_seconds", "audio_seconds", "real_time_factor"}
+// or, if the request fails at any point:
+//   'E'  error (JSON): {"error": str}
+//
+// Requests on a connection are answered in order. Each connection is served
+// by its own thread, so separate connections are synthesized concurrently.
+struct ServerConfig {
+  std::string address;
+
+  // Voices by name. Requests without "voice" use defaultVoiceName.
+  std::map<std::string, Voice *> voices;
+  std::string defaultVoiceName;
+};
+
+// Serve requests until the process is stopped
+void runServer(PiperConfig &piperConfig, ServerConfig &serverConfig);
+
+} // namespace piper
+
+#endif // PIPER_SERVER_H_
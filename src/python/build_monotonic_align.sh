@@ -9,5 +9,12 @@ fi
 
 cd "${this_dir}/piper_train/vits/monotonic_align"
 mkdir -p monotonic_align
+
+# Compile with OpenMP so batch items are aligned in parallel (prange)
+if [ "$(uname)" = 'Linux' ]; then
+    export CFLAGS="${CFLAGS} -fopenmp"
+    export LDFLAGS="${LDFLAGS} -fopenmp"
+fi
+
 cythonize -i core.pyx
 mv core*.so monotonic_align/
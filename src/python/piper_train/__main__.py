@@ -27,13 +27,18 @@ def main():
     parser.add_argument(
         "--quality",
         default="medium",
-        choices=("x-low", "medium", "high"),
+        choices=("x-low", "x-low-distilled", "medium", "high"),
         help="Quality/size of model (default: medium)",
     )
     parser.add_argument(
         "--resume_from_single_speaker_checkpoint",
         help="For multi-speaker models only. Converts a single-speaker checkpoint to multi-speaker and resumes training",
     )
+    parser.add_argument(
+        "--fast-training",
+        action="store_true",
+        help="Use bf16 mixed precision (if supported), compiled models, and fused optimizers",
+    )
     Trainer.add_argparse_args(parser)
     VitsModel.add_model_specific_args(parser)
     parser.add_argument("--seed", type=int, default=1234)
@@ -57,6 +62,20 @@ def main():
         num_speakers = int(config["num_speakers"])
         sample_rate = int(config["audio"]["sample_rate"])
 
+    if args.fast_training:
+        apply_fast_training(args)
+
+    # Training batches are already split between processes by the model's
+    # LengthBucketSampler, so Lightning must not replace it.
+    args.replace_sampler_ddp = False
+
+    # The model steps its optimizers itself, so gradient accumulation and
+    # clipping are done there instead of by the Trainer.
+    accumulate_grad_batches = args.accumulate_grad_batches or 1
+    grad_clip = args.gradient_clip_val
+    args.accumulate_grad_batches = None
+    args.gradient_clip_val = None
+
     trainer = Trainer.from_argparse_args(args)
     if args.checkpoint_epochs is not None:
         trainer.callbacks = [ModelCheckpoint(every_n_epochs=args.checkpoint_epochs)]
@@ -65,10 +84,22 @@ def main():
         )
 
     dict_args = vars(args)
-    if args.quality == "x-low":
+    dict_args["accumulate_grad_batches"] = accumulate_grad_batches
+    if grad_clip is not None:
+        dict_args["grad_clip"] = grad_clip
+
+    if args.quality in ("x-low", "x-low-distilled"):
         dict_args["hidden_channels"] = 96
         dict_args["inter_channels"] = 96
         dict_args["filter_channels"] = 384
+
+    if args.quality == "x-low-distilled":
+        assert (
+            args.teacher_checkpoint
+        ), "--quality x-low-distilled requires --teacher-checkpoint"
+
+        # Half the decoder channels of x-low (same ResBlock2 layout)
+        dict_args["upsample_initial_channel"] = 128
     elif args.quality == "high":
         dict_args["resblock"] = "1"
         dict_args["resblock_kernel_sizes"] = (3, 7, 11)
@@ -121,9 +152,91 @@ def main():
             "Successfully converted single-speaker checkpoint to multi-speaker"
         )
 
+    if args.teacher_checkpoint and (not args.resume_from_checkpoint):
+        init_from_teacher(model, args.teacher_checkpoint)
+
     trainer.fit(model)
 
 
+def apply_fast_training(args: argparse.Namespace) -> None:
+    """Enable settings that speed up training without changing the model."""
+    args.compile_model = True
+    args.fused_optimizers = True
+
+    if str(args.precision) != "32":
+        # Keep precision chosen by user
+        return
+
+    use_gpu = (args.accelerator == "gpu") or (
+        (args.accelerator in (None, "auto")) and torch.cuda.is_available()
+    )
+    if use_gpu:
+        bf16_supported = torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    else:
+        bf16_supported = _cpu_bf16_supported()
+
+    if bf16_supported:
+        args.precision = "bf16"
+        _LOGGER.debug("Using bf16 mixed precision")
+    else:
+        _LOGGER.debug("bf16 is not supported; using full precision")
+
+
+def _cpu_bf16_supported() -> bool:
+    """True if the CPU has native bfloat16 support.
+
+    bfloat16 is only faster than float32 on these CPUs, where oneDNN (mkldnn)
+    runs it natively. torch only exposes this through a private function, so
+    any change to it means full precision instead of an error.
+    """
+    if not torch.backends.mkldnn.is_available():
+        return False
+
+    is_bf16_supported = getattr(
+        getattr(torch, "cpu", None), "_is_avx512_bf16_supported", None
+    )
+    if not callable(is_bf16_supported):
+        _LOGGER.debug("Can't check CPU for bf16 support")
+        return False
+
+    try:
+        return bool(is_bf16_supported())
+    except Exception:
+        _LOGGER.exception("Failed to check CPU for bf16 support")
+        return False
+
+
+def init_from_teacher(model: VitsModel, teacher_checkpoint: str) -> None:
+    """Initialize a student model from its teacher's weights.
+
+    Weights with the same shape are copied. Smaller weights get the leading
+    channels of the teacher's, like a channel-pruned copy of the teacher.
+    """
+    _LOGGER.debug("Initializing from teacher: %s", teacher_checkpoint)
+    teacher = VitsModel.load_from_checkpoint(teacher_checkpoint, dataset=None)
+
+    for student_module, teacher_module in (
+        (model.model_g, teacher.model_g),
+        (model.model_d, teacher.model_d),
+    ):
+        teacher_dict = teacher_module.state_dict()
+        pruned_dict = {}
+        for key, value in student_module.state_dict().items():
+            teacher_value = teacher_dict.get(key)
+            if (teacher_value is None) or (teacher_value.dim() != value.dim()):
+                continue
+
+            if all(
+                student_size <= teacher_size
+                for student_size, teacher_size in zip(value.shape, teacher_value.shape)
+            ):
+                pruned_dict[key] = teacher_value[
+                    tuple(slice(0, size) for size in value.shape)
+                ].clone()
+
+        load_state_dict(student_module, pruned_dict)
+
+
 def load_state_dict(model, saved_state_dict):
     state_dict = model.state_dict()
     new_state_dict = {}
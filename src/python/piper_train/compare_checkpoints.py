@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Compare a distilled (student) checkpoint with its teacher.
+
+Reports the CPU real-time factor of each model, and the log-spectral distance
+of each model's resynthesis of dataset audio from its spectrogram. Both
+models decode the same frames, so predicted durations don't affect it.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from .quantize import load_utterances, log_spectral_distance
+from .vits.lightning import VitsModel
+from .vits.models import SynthesizerTrn
+
+_LOGGER = logging.getLogger("piper_train.compare_checkpoints")
+
+_NOISE_SCALE = 0.667
+_LENGTH_SCALE = 1.0
+_NOISE_W = 0.8
+
+
+def main() -> None:
+    """Main entry point"""
+    parser = argparse.ArgumentParser(prog="piper_train.compare_checkpoints")
+    parser.add_argument("teacher", help="Path to teacher checkpoint (.ckpt)")
+    parser.add_argument("student", help="Path to student checkpoint (.ckpt)")
+    parser.add_argument(
+        "--dataset",
+        required=True,
+        help="Path to dataset.jsonl from preprocess",
+    )
+    parser.add_argument(
+        "--utterances",
+        type=int,
+        default=10,
+        help="Number of utterances to synthesize (default: 10)",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="Time each utterance this many times and keep the fastest (default: 3)",
+    )
+    parser.add_argument(
+        "--num-threads", type=int, help="Number of threads for PyTorch on the CPU"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Print DEBUG messages to the console"
+    )
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _LOGGER.debug(args)
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    # -------------------------------------------------------------------------
+
+    utterances = load_utterances(args.dataset, args.utterances)
+    _LOGGER.debug("Loaded %s utterance(s) from %s", len(utterances), args.dataset)
+
+    report: Dict[str, Any] = {}
+    for name, checkpoint_path in (("teacher", args.teacher), ("student", args.student)):
+        model = VitsModel.load_from_checkpoint(checkpoint_path, dataset=None)
+        model_g = model.model_g
+        model_g.eval()
+
+        with torch.no_grad():
+            model_g.dec.remove_weight_norm()
+
+        sample_rate = model.hparams.sample_rate
+        infer_sec, num_samples = synthesize_all(model_g, utterances, args.runs)
+        report[name] = {
+            "checkpoint": str(checkpoint_path),
+            "parameters": count_parameters(model_g),
+            "decoder_parameters": count_parameters(model_g.dec),
+            "rtf": infer_sec / max(1e-6, num_samples / sample_rate),
+            "log_spectral_distance_db": statistics.mean(
+                resynthesis_distance(model_g, utterance) for utterance in utterances
+            ),
+        }
+        _LOGGER.info("%s: %s", name, report[name])
+
+    report["speedup"] = report["teacher"]["rtf"] / report["student"]["rtf"]
+    report["log_spectral_distance_delta_db"] = (
+        report["student"]["log_spectral_distance_db"]
+        - report["teacher"]["log_spectral_distance_db"]
+    )
+
+    json.dump(report, sys.stdout, indent=4)
+    print("")
+
+
+# -----------------------------------------------------------------------------
+
+
+def count_parameters(module: torch.nn.Module) -> int:
+    return sum(param.numel() for param in module.parameters())
+
+
+def speaker_id_tensor(
+    model_g: SynthesizerTrn, utterance: Dict[str, Any]
+) -> Optional[torch.LongTensor]:
+    if model_g.n_speakers <= 1:
+        return None
+
+    return torch.LongTensor([utterance.get("speaker_id") or 0])
+
+
+def synthesize_all(
+    model_g: SynthesizerTrn, utterances: List[Dict[str, Any]], runs: int = 1
+):
+    """Synthesize utterances from phoneme ids with fixed noise.
+
+    Returns the total of each utterance's fastest run, and the number of
+    audio samples.
+    """
+    infer_sec = 0.0
+    num_samples = 0
+
+    with torch.no_grad():
+        for utterance in utterances:
+            text = torch.LongTensor(utterance["phoneme_ids"]).unsqueeze(0)
+            text_lengths = torch.LongTensor([text.size(1)])
+
+            run_sec = []
+            for _ in range(1 + max(1, runs)):
+                start_time = time.perf_counter()
+                audio, *_ = model_g.infer(
+                    text,
+                    text_lengths,
+                    sid=speaker_id_tensor(model_g, utterance),
+                    noise_scale=_NOISE_SCALE,
+                    length_scale=_LENGTH_SCALE,
+                    noise_scale_w=_NOISE_W,
+                    noise_seed=torch.LongTensor([0]),
+                )
+                run_sec.append(time.perf_counter() - start_time)
+
+            # First run is warm-up
+            infer_sec += min(run_sec[1:])
+            num_samples += audio.size(-1)
+
+    return infer_sec, num_samples
+
+
+def resynthesis_distance(model_g: SynthesizerTrn, utterance: Dict[str, Any]) -> float:
+    """Log-spectral distance (dB) of audio decoded from its own spectrogram."""
+    spec = torch.load(utterance["audio_spec_path"]).unsqueeze(0)
+    spec_lengths = torch.LongTensor([spec.size(2)])
+    audio_norm = torch.load(utterance["audio_norm_path"]).squeeze()
+
+    with torch.no_grad():
+        g = None
+        sid = speaker_id_tensor(model_g, utterance)
+        if sid is not None:
+            g = model_g.emb_g(sid).unsqueeze(-1)  # [1, h, 1]
+
+        _z, m_q, _logs_q, y_mask = model_g.enc_q(spec, spec_lengths, g=g)
+
+        # Posterior mean, so both models decode without noise
+        audio = model_g.dec(m_q * y_mask, g=g).squeeze()
+
+    return log_spectral_distance(audio_norm.numpy(), audio.numpy())
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from pathlib import Path
 
 import torch
 
+from .verify_export import add_verify_args, check_export
 from .vits.lightning import VitsModel
 
 _LOGGER = logging.getLogger("piper_train.export_generator")
@@ -16,6 +17,7 @@ def main():
     parser.add_argument("checkpoint", help="Path to model checkpoint (.ckpt)")
     parser.add_argument("output", help="Path to output model (.pt)")
 
+    add_verify_args(parser)
     parser.add_argument(
         "--debug", action="store_true", help="Print DEBUG messages to the console"
     )
@@ -48,6 +50,7 @@ def main():
     torch.save(model_g, args.output)
 
     _LOGGER.info("Exported model to %s", args.output)
+    check_export(args, model_g, args.output, "generator", model.hparams.sample_rate)
 
 
 # -----------------------------------------------------------------------------
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import logging
+import math
+import sys
 from pathlib import Path
 from typing import Optional
 
 import torch
 
+from .optimize_onnx import OPTIMIZATION_LEVELS, default_output_path, optimize_onnx
+from .verify_export import add_verify_args, check_export
 from .vits.lightning import VitsModel
+from .vits.models import SynthesizerTrn
 
 _LOGGER = logging.getLogger("piper_train.export_onnx")
 
@@ -21,6 +27,29 @@ def main() -> None:
     parser.add_argument("checkpoint", help="Path to model checkpoint (.ckpt)")
     parser.add_argument("output", help="Path to output model (.onnx)")
 
+    parser.add_argument(
+        "--output-lengths",
+        action="store_true",
+        help="Add output_lengths with the number of audio samples of each batch item",
+    )
+    parser.add_argument(
+        "--noise-seed-input",
+        action="store_true",
+        help="Add noise_seed input, so the same inputs always give the same audio",
+    )
+    parser.add_argument(
+        "--speaker-graphs",
+        nargs="+",
+        type=int,
+        metavar="SPEAKER_ID",
+        help="Also export a graph specialized to each speaker (multi-speaker only)",
+    )
+    parser.add_argument(
+        "--optimize",
+        choices=sorted(OPTIMIZATION_LEVELS),
+        help="Also save an optimized graph as <output>.optimized.onnx",
+    )
+    add_verify_args(parser)
     parser.add_argument(
         "--debug", action="store_true", help="Print DEBUG messages to the console"
     )
@@ -42,7 +71,6 @@ def main() -> None:
     model = VitsModel.load_from_checkpoint(args.checkpoint, dataset=None)
     model_g = model.model_g
 
-    num_symbols = model_g.n_vocab
     num_speakers = model_g.n_speakers
 
     # Inference only
@@ -51,22 +79,87 @@ def main() -> None:
     with torch.no_grad():
         model_g.dec.remove_weight_norm()
 
-    # old_forward = model_g.infer
+    # Copy before export, which leaves traced tensors on the model
+    speaker_models = {}
+    for speaker_id in args.speaker_graphs or []:
+        assert (
+            0 <= speaker_id < num_speakers
+        ), f"Speaker id {speaker_id} is not in [0, {num_speakers})"
+        speaker_models[speaker_id] = model_g.for_speaker(speaker_id)
+
+    export_model(model_g, args.output, model.hparams, args)
+    check_export(args, model_g, args.output, "onnx", model.hparams.sample_rate)
+
+    speaker_graphs = {}
+    for speaker_id, speaker_model in speaker_models.items():
+        # Speaker embedding is folded into the graph, so there's no sid input
+        speaker_path = args.output.with_name(
+            f"{args.output.stem}.speaker-{speaker_id}.onnx"
+        )
+        export_model(speaker_model, speaker_path, model.hparams, args)
+        check_export(
+            args,
+            model_g,
+            speaker_path,
+            "onnx",
+            model.hparams.sample_rate,
+            speaker_id=speaker_id,
+        )
+        speaker_graphs[str(speaker_id)] = speaker_path.name
+
+    if speaker_graphs:
+        speakers_path = Path(f"{args.output}.speakers.json")
+        with open(speakers_path, "w", encoding="utf-8") as speakers_file:
+            json.dump({"speaker_graphs": speaker_graphs}, speakers_file, indent=4)
+
+        _LOGGER.info("Wrote speaker graphs to %s", speakers_path)
+
+    if args.optimize:
+        optimized_path = default_output_path(args.output)
+        report = optimize_onnx(args.output, optimized_path, level=args.optimize)
+        json.dump(report, sys.stdout, indent=4)
+        print("")
+        check_export(args, model_g, optimized_path, "onnx", model.hparams.sample_rate)
+
+
+# -----------------------------------------------------------------------------
+
+
+def export_model(
+    model_g: SynthesizerTrn,
+    output_path: Path,
+    hparams,
+    args: argparse.Namespace,
+) -> None:
+    """Export generator for inference to an ONNX file."""
+    num_symbols = model_g.n_vocab
+    num_speakers = model_g.n_speakers
+
+    # Decoder upsamples each spectrogram frame to this many samples
+    samples_per_frame = math.prod(hparams.upsample_rates)
 
-    def infer_forward(text, text_lengths, scales, sid=None):
+    def infer_forward(text, text_lengths, scales, sid=None, noise_seed=None):
         noise_scale = scales[0]
         length_scale = scales[1]
         noise_scale_w = scales[2]
-        audio = model_g.infer(
+        audio, _attn, y_mask, _ = model_g.infer(
             text,
             text_lengths,
             noise_scale=noise_scale,
             length_scale=length_scale,
             noise_scale_w=noise_scale_w,
             sid=sid,
-        )[0].unsqueeze(1)
+            noise_seed=noise_seed,
+        )
+        audio = audio.unsqueeze(1)
+
+        if not args.output_lengths:
+            return audio
 
-        return audio
+        # Audio past each item's length is padding
+        audio_lengths = y_mask.sum([1, 2]).long() * samples_per_frame
+
+        return audio, audio_lengths
 
     model_g.forward = infer_forward
 
@@ -84,23 +177,45 @@ def main() -> None:
     scales = torch.FloatTensor([0.667, 1.0, 0.8])
     dummy_input = (sequences, sequence_lengths, scales, sid)
 
+    # None inputs are left out of the graph
+    input_names = ["input", "input_lengths", "scales"]
+    if sid is not None:
+        input_names.append("sid")
+
+    if args.noise_seed_input:
+        # One seed per batch item
+        dummy_input = (*dummy_input, torch.LongTensor([0]))
+        input_names.append("noise_seed")
+
+    output_names = ["output"]
+    dynamic_axes = {
+        "input": {0: "batch_size", 1: "phonemes"},
+        "input_lengths": {0: "batch_size"},
+        "output": {0: "batch_size", 1: "time"},
+    }
+    if sid is not None:
+        dynamic_axes["sid"] = {0: "batch_size"}
+
+    if args.noise_seed_input:
+        dynamic_axes["noise_seed"] = {0: "batch_size"}
+
+    if args.output_lengths:
+        output_names.append("output_lengths")
+        dynamic_axes["output_lengths"] = {0: "batch_size"}
+
     # Export
     torch.onnx.export(
         model=model_g,
         args=dummy_input,
-        f=str(args.output),
+        f=str(output_path),
         verbose=False,
         opset_version=OPSET_VERSION,
-        input_names=["input", "input_lengths", "scales", "sid"],
-        output_names=["output"],
-        dynamic_axes={
-            "input": {0: "batch_size", 1: "phonemes"},
-            "input_lengths": {0: "batch_size"},
-            "output": {0: "batch_size", 1: "time"},
-        },
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
     )
 
-    _LOGGER.info("Exported model to %s", args.output)
+    _LOGGER.info("Exported model to %s", output_path)
 
 
 # -----------------------------------------------------------------------------
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import logging
 import os
 from pathlib import Path
@@ -9,6 +10,7 @@ from typing import Optional
 import torch
 from torch import nn
 
+from .verify_export import add_verify_args, check_export
 from .vits import commons
 from .vits.lightning import VitsModel
 
@@ -21,7 +23,7 @@ class VitsEncoder(nn.Module):
         super().__init__()
         self.gen = gen
 
-    def forward(self, x, x_lengths, scales, sid=None):
+    def forward(self, x, x_lengths, scales, sid=None, noise_seed=None):
         noise_scale = scales[0]
         length_scale = scales[1]
         noise_scale_w = scales[2]
@@ -35,7 +37,20 @@ class VitsEncoder(nn.Module):
             g = None
 
         if gen.use_sdp:
-            logw = gen.dp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w)
+            dp_noise = None
+            if noise_seed is not None:
+                dp_noise = (
+                    commons.seeded_randn_like(x[:, :2], noise_seed, stream=0) * x_mask
+                )
+
+            logw = gen.dp(
+                x,
+                x_mask,
+                g=g,
+                reverse=True,
+                noise_scale=noise_scale_w,
+                noise=dp_noise,
+            )
         else:
             logw = gen.dp(x, x_mask, g=g)
         w = torch.exp(logw) * x_mask * length_scale
@@ -44,17 +59,17 @@ class VitsEncoder(nn.Module):
         y_mask = torch.unsqueeze(
             commons.sequence_mask(y_lengths, y_lengths.max()), 1
         ).type_as(x_mask)
-        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
-        attn = commons.generate_path(w_ceil, attn_mask)
 
-        m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(
-            1, 2
-        )  # [b, t', t], [b, t, d] -> [b, d, t']
-        logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(
-            1, 2
-        )  # [b, t', t], [b, t, d] -> [b, d, t']
+        # Repeat phoneme frames by duration: [b, d, t] -> [b, d, t']
+        m_p = commons.expand_by_duration(m_p, w_ceil, y_mask.size(2))
+        logs_p = commons.expand_by_duration(logs_p, w_ceil, y_mask.size(2))
 
-        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        if noise_seed is None:
+            noise = torch.randn_like(m_p)
+        else:
+            noise = commons.seeded_randn_like(m_p, noise_seed, stream=1)
+
+        z_p = m_p + noise * torch.exp(logs_p) * noise_scale
         return z_p, y_mask, g
 
 
@@ -77,6 +92,19 @@ def main() -> None:
     parser.add_argument("checkpoint", help="Path to model checkpoint (.ckpt)")
     parser.add_argument("output_dir", help="Path to output directory")
 
+    parser.add_argument(
+        "--noise-seed-input",
+        action="store_true",
+        help="Add noise_seed input to the encoder (same inputs give the same audio)",
+    )
+    parser.add_argument(
+        "--speaker-graphs",
+        nargs="+",
+        type=int,
+        metavar="SPEAKER_ID",
+        help="Also export models specialized to each speaker (multi-speaker only)",
+    )
+    add_verify_args(parser)
     parser.add_argument(
         "--debug", action="store_true", help="Print DEBUG messages to the console"
     )
@@ -101,14 +129,47 @@ def main() -> None:
     with torch.no_grad():
         model_g.dec.remove_weight_norm()
 
+    # Copy before export, which leaves traced tensors on the model
+    speaker_models = {}
+    for speaker_id in args.speaker_graphs or []:
+        assert (
+            0 <= speaker_id < model_g.n_speakers
+        ), f"Speaker id {speaker_id} is not in [0, {model_g.n_speakers})"
+        speaker_models[speaker_id] = model_g.for_speaker(speaker_id)
+
     _LOGGER.info("Exporting encoder...")
-    decoder_input = export_encoder(args, model_g)
+    decoder_input = export_encoder(args, model_g, args.output_dir)
     _LOGGER.info("Exporting decoder...")
-    export_decoder(args, model_g, decoder_input)
+    export_decoder(args, model_g, decoder_input, args.output_dir)
     _LOGGER.info("Exported model to  %s", str(args.output_dir))
-
-
-def export_encoder(args, model_g):
+    check_export(args, model_g, args.output_dir, "streaming", model.hparams.sample_rate)
+
+    speaker_graphs = {}
+    for speaker_id, speaker_model in speaker_models.items():
+        # Speaker embedding is folded into the models, so there's no sid or g
+        speaker_dir = args.output_dir / f"speaker-{speaker_id}"
+        speaker_dir.mkdir(parents=True, exist_ok=True)
+        decoder_input = export_encoder(args, speaker_model, speaker_dir)
+        export_decoder(args, speaker_model, decoder_input, speaker_dir)
+        check_export(
+            args,
+            model_g,
+            speaker_dir,
+            "streaming",
+            model.hparams.sample_rate,
+            speaker_id=speaker_id,
+        )
+        speaker_graphs[str(speaker_id)] = speaker_dir.name
+
+    if speaker_graphs:
+        speakers_path = args.output_dir / "speakers.json"
+        with open(speakers_path, "w", encoding="utf-8") as speakers_file:
+            json.dump({"speaker_graphs": speaker_graphs}, speakers_file, indent=4)
+
+        _LOGGER.info("Wrote speaker graphs to %s", speakers_path)
+
+
+def export_encoder(args, model_g, output_dir):
     model = VitsEncoder(model_g)
     model.eval()
 
@@ -129,6 +190,22 @@ def export_encoder(args, model_g):
     scales = torch.FloatTensor([0.667, 1.0, 0.8])
     dummy_input = (sequences, sequence_lengths, scales, sid)
 
+    # None inputs are left out of the graph
+    input_names = ["input", "input_lengths", "scales"]
+    if sid is not None:
+        input_names.append("sid")
+
+    dynamic_axes = {
+        "input": {0: "batch_size", 1: "phonemes"},
+        "input_lengths": {0: "batch_size"},
+        "output": {0: "batch_size", 2: "time"},
+    }
+    if args.noise_seed_input:
+        # One seed per batch item
+        dummy_input = (*dummy_input, torch.LongTensor([0]))
+        input_names.append("noise_seed")
+        dynamic_axes["noise_seed"] = {0: "batch_size"}
+
     output_names = [
         "z",
         "y_mask",
@@ -136,7 +213,7 @@ def export_encoder(args, model_g):
     if model_g.n_speakers > 1:
         output_names.append("g")
 
-    onnx_path = os.fspath(args.output_dir.joinpath("encoder.onnx"))
+    onnx_path = os.fspath(output_dir.joinpath("encoder.onnx"))
 
     # Export
     torch.onnx.export(
@@ -145,20 +222,16 @@ def export_encoder(args, model_g):
         f=onnx_path,
         verbose=False,
         opset_version=OPSET_VERSION,
-        input_names=["input", "input_lengths", "scales", "sid"],
+        input_names=input_names,
         output_names=output_names,
-        dynamic_axes={
-            "input": {0: "batch_size", 1: "phonemes"},
-            "input_lengths": {0: "batch_size"},
-            "output": {0: "batch_size", 2: "time"},
-        },
+        dynamic_axes=dynamic_axes,
     )
     _LOGGER.info("Exported encoder to %s", onnx_path)
 
     return model(*dummy_input)
 
 
-def export_decoder(args, model_g, decoder_input):
+def export_decoder(args, model_g, decoder_input, output_dir):
     model = VitsDecoder(model_g)
     model.eval()
 
@@ -169,7 +242,7 @@ def export_decoder(args, model_g, decoder_input):
     if model_g.n_speakers > 1:
         input_names.append("g")
 
-    onnx_path = os.fspath(args.output_dir.joinpath("decoder.onnx"))
+    onnx_path = os.fspath(output_dir.joinpath("decoder.onnx"))
 
     # Export
     torch.onnx.export(
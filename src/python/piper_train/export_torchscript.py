@@ -5,6 +5,7 @@ from pathlib import Path
 
 import torch
 
+from .verify_export import add_verify_args, check_export
 from .vits.lightning import VitsModel
 
 _LOGGER = logging.getLogger("piper_train.export_torchscript")
@@ -18,6 +19,7 @@ def main():
     parser.add_argument("checkpoint", help="Path to model checkpoint (.ckpt)")
     parser.add_argument("output", help="Path to output model (.onnx)")
 
+    add_verify_args(parser)
     parser.add_argument(
         "--debug", action="store_true", help="Print DEBUG messages to the console"
     )
@@ -47,15 +49,34 @@ def main():
     with torch.no_grad():
         model_g.dec.remove_weight_norm()
 
-    model_g.forward = model_g.infer
-
-    dummy_input_length = 50
-    sequences = torch.randint(
-        low=0, high=num_symbols, size=(1, dummy_input_length), dtype=torch.long
-    )
-    sequence_lengths = torch.LongTensor([sequences.size(1)])
-
-    sid = torch.LongTensor([0])
+    def infer_forward(
+        text, text_lengths, sid, noise_scale, length_scale, noise_scale_w
+    ):
+        # Only tensors can be outputs of a traced model
+        audio, _attn, y_mask, _ = model_g.infer(
+            text,
+            text_lengths,
+            sid=sid,
+            noise_scale=noise_scale,
+            length_scale=length_scale,
+            noise_scale_w=noise_scale_w,
+        )
+
+        return audio, y_mask
+
+    model_g.forward = infer_forward
+
+    # Trace with a padded batch and a speaker per utterance, so the model
+    # takes batches and any speaker. Single speaker models ignore sid.
+    dummy_input_lengths = [50, 30]
+    sequences = torch.zeros((len(dummy_input_lengths), 50), dtype=torch.long)
+    for i, dummy_input_length in enumerate(dummy_input_lengths):
+        sequences[i, :dummy_input_length] = torch.randint(
+            low=0, high=num_symbols, size=(dummy_input_length,), dtype=torch.long
+        )
+
+    sequence_lengths = torch.LongTensor(dummy_input_lengths)
+    sid = torch.LongTensor([0, max(0, model_g.n_speakers - 1)])
 
     dummy_input = (
         sequences,
@@ -70,6 +91,7 @@ def main():
     torch.jit.save(jitted_model, str(args.output))
 
     _LOGGER.info("Saved TorchScript model to %s", args.output)
+    check_export(args, model_g, args.output, "torchscript", model.hparams.sample_rate)
 
 
 # -----------------------------------------------------------------------------
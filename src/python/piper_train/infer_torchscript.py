@@ -45,7 +45,8 @@ def main():
 
         text = torch.LongTensor(phoneme_ids).unsqueeze(0)
         text_lengths = torch.LongTensor([len(phoneme_ids)])
-        sid = torch.LongTensor([speaker_id]) if speaker_id is not None else None
+        # Exported models always take a speaker id (ignored if single speaker)
+        sid = torch.LongTensor([speaker_id or 0])
 
         start_time = time.perf_counter()
         audio = (
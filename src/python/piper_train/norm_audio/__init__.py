@@ -1,16 +1,22 @@
+import inspect
+import logging
 from hashlib import sha256
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import librosa
 import torch
 
-from piper_train.vits.mel_processing import spectrogram_torch
+from piper_train.vits.mel_processing import batch_spectrogram_torch
 
 from .trim import trim_silence
 from .vad import SileroVoiceActivityDetector
 
 _DIR = Path(__file__).parent
+_LOGGER = logging.getLogger("norm_audio")
+
+# torch.load(mmap=True) was added in torch 2.1
+_TORCH_LOAD_HAS_MMAP = "mmap" in inspect.signature(torch.load).parameters
 
 
 def make_silence_detector() -> SileroVoiceActivityDetector:
@@ -31,7 +37,13 @@ def cache_norm_audio(
     window_length: int = 1024,
     hop_length: int = 256,
     ignore_cache: bool = False,
+    compute_spectrogram: bool = True,
 ) -> Tuple[Path, Path]:
+    """Normalize audio and cache it along with its spectrogram.
+
+    With compute_spectrogram=False, only the normalized audio is cached and
+    the spectrogram is left for cache_spectrograms.
+    """
     audio_path = Path(audio_path).absolute()
     cache_dir = Path(cache_dir)
 
@@ -74,19 +86,95 @@ def cache_norm_audio(
         torch.save(audio_norm_tensor, audio_norm_path)
 
     # Compute spectrogram
-    if ignore_cache or (not audio_spec_path.exists()):
+    if compute_spectrogram and (ignore_cache or (not audio_spec_path.exists())):
         if audio_norm_tensor is None:
             # Load pre-cached normalized audio
             audio_norm_tensor = torch.load(audio_norm_path)
 
-        audio_spec_tensor = spectrogram_torch(
-            y=audio_norm_tensor,
+        audio_spec_tensor = batch_spectrogram_torch(
+            [audio_norm_tensor.view(-1)],
             n_fft=filter_length,
             sampling_rate=sample_rate,
             hop_size=hop_length,
             win_size=window_length,
-            center=False,
-        ).squeeze(0)
+        )[0]
         torch.save(audio_spec_tensor, audio_spec_path)
 
     return audio_norm_path, audio_spec_path
+
+
+def cache_spectrograms(
+    audio_paths: Sequence[Tuple[Path, Path]],
+    sample_rate: int,
+    filter_length: int = 1024,
+    window_length: int = 1024,
+    hop_length: int = 256,
+    batch_size: int = 32,
+    ignore_cache: bool = False,
+) -> List[Optional[int]]:
+    """Compute spectrograms of cached normalized audio in batches.
+
+    audio_paths are (audio_norm_path, audio_spec_path) pairs. Audio is sorted
+    by length so each batch needs little padding, and every batch is a single
+    STFT call.
+
+    Returns the number of spectrogram frames for each pair (None on failure).
+    """
+    pad_size = int((filter_length - hop_length) / 2)
+    spec_lengths: List[Optional[int]] = [None] * len(audio_paths)
+    audio_to_process: List[Tuple[int, torch.Tensor]] = []
+
+    for path_idx, (audio_norm_path, audio_spec_path) in enumerate(audio_paths):
+        if (not ignore_cache) and audio_spec_path.exists():
+            try:
+                spec_lengths[path_idx] = _load_spec_length(audio_spec_path)
+                continue
+            except Exception:
+                _LOGGER.exception(
+                    "Failed to load cached spectrogram: %s", audio_spec_path
+                )
+
+        try:
+            audio_norm_tensor = torch.load(audio_norm_path).view(-1)
+            num_samples = audio_norm_tensor.size(0)
+            if (num_samples <= pad_size) or (
+                (num_samples + (2 * pad_size)) < filter_length
+            ):
+                raise ValueError(f"Audio is too short ({num_samples} sample(s))")
+
+            audio_to_process.append((path_idx, audio_norm_tensor))
+        except Exception:
+            _LOGGER.exception("Failed to load normalized audio: %s", audio_norm_path)
+
+    audio_to_process.sort(key=lambda item: item[1].size(0))
+
+    for batch_start in range(0, len(audio_to_process), batch_size):
+        audio_batch = audio_to_process[batch_start : batch_start + batch_size]
+        audio_spec_tensors = batch_spectrogram_torch(
+            [audio_norm_tensor for _path_idx, audio_norm_tensor in audio_batch],
+            n_fft=filter_length,
+            sampling_rate=sample_rate,
+            hop_size=hop_length,
+            win_size=window_length,
+        )
+
+        for (path_idx, _audio_norm_tensor), audio_spec_tensor in zip(
+            audio_batch, audio_spec_tensors
+        ):
+            # Clone so only this utterance's frames are saved, not the batch
+            torch.save(audio_spec_tensor.clone(), audio_paths[path_idx][1])
+            spec_lengths[path_idx] = audio_spec_tensor.size(1)
+
+    return spec_lengths
+
+
+def _load_spec_length(audio_spec_path: Path) -> int:
+    """Number of frames in a cached spectrogram.
+
+    The file is memory-mapped when torch supports it, so only its header is
+    read instead of the whole spectrogram.
+    """
+    if _TORCH_LOAD_HAS_MMAP:
+        return torch.load(str(audio_spec_path), mmap=True).size(1)
+
+    return torch.load(audio_spec_path).size(1)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Offline graph optimization of exported ONNX voices.
+
+Runs shape inference and ONNX Runtime's graph optimizations (constant
+folding, dead node elimination, and operator fusions) once, and saves the
+result. Consumers that load models with optimizations disabled, like the
+C++ piper binary, still get the optimized graph.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+import onnx
+import onnxruntime
+
+_LOGGER = logging.getLogger("piper_train.optimize_onnx")
+
+OPTIMIZATION_LEVELS = {
+    # Constant folding, redundant node elimination, and fusions that only
+    # use standard ONNX operators. Runs on any execution provider.
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    # Also fuses operators into ONNX Runtime's CPU/CUDA kernels, such as
+    # convolutions with their activations.
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+}
+
+_DEFAULT_NUM_SYMBOLS = 20
+
+
+def main() -> None:
+    """Main entry point"""
+    parser = argparse.ArgumentParser(prog="piper_train.optimize_onnx")
+    parser.add_argument("model", help="Path to exported model (.onnx)")
+    parser.add_argument(
+        "output",
+        nargs="?",
+        help="Path to optimized model (default: <model>.optimized.onnx)",
+    )
+    parser.add_argument(
+        "--level",
+        choices=sorted(OPTIMIZATION_LEVELS),
+        default="basic",
+        help="ONNX Runtime optimization level (default: basic)",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Print DEBUG messages to the console"
+    )
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _LOGGER.debug(args)
+
+    args.model = Path(args.model)
+    if args.output:
+        args.output = Path(args.output)
+    else:
+        args.output = default_output_path(args.model)
+
+    report = optimize_onnx(args.model, args.output, level=args.level)
+    json.dump(report, sys.stdout, indent=4)
+    print("")
+
+
+# -----------------------------------------------------------------------------
+
+
+def default_output_path(model_path: Union[str, Path]) -> Path:
+    model_path = Path(model_path)
+    return model_path.with_name(f"{model_path.stem}.optimized.onnx")
+
+
+def optimize_onnx(
+    model_path: Union[str, Path],
+    output_path: Union[str, Path],
+    level: str = "basic",
+    num_phonemes: int = 100,
+    num_runs: int = 5,
+) -> Dict[str, Any]:
+    """Optimize model and report node counts and latency before/after."""
+    model_path = Path(model_path)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    model = onnx.shape_inference.infer_shapes(onnx.load(str(model_path)))
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.graph_optimization_level = OPTIMIZATION_LEVELS[level]
+    sess_options.optimized_model_filepath = str(output_path)
+    onnxruntime.InferenceSession(
+        model.SerializeToString(),
+        sess_options=sess_options,
+        providers=["CPUExecutionProvider"],
+    )
+    _LOGGER.info("Saved optimized model to %s", output_path)
+
+    # Same inputs for both models, without noise so outputs can be compared
+    inputs = make_dummy_inputs(model_path, num_phonemes)
+    report: Dict[str, Any] = {"level": level, "num_phonemes": num_phonemes}
+    outputs = {}
+    for name, path in (("original", model_path), ("optimized", output_path)):
+        report[name], outputs[name] = measure_model(path, inputs, num_runs)
+
+    report["max_abs_diff"] = float(
+        np.max(np.abs(outputs["original"] - outputs["optimized"]))
+    )
+    report["speedup"] = (
+        report["original"]["latency_sec"] / report["optimized"]["latency_sec"]
+    )
+
+    return report
+
+
+def make_dummy_inputs(
+    model_path: Path, num_phonemes: int, seed: int = 1234
+) -> Dict[str, np.ndarray]:
+    num_symbols = _DEFAULT_NUM_SYMBOLS
+    config_path = Path(f"{model_path}.json")
+    if config_path.is_file():
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            num_symbols = int(json.load(config_file).get("num_symbols", num_symbols))
+
+    rng = np.random.default_rng(seed)
+    phoneme_ids = rng.integers(1, num_symbols, size=(1, num_phonemes), dtype=np.int64)
+
+    return {
+        "input": phoneme_ids,
+        "input_lengths": np.array([num_phonemes], dtype=np.int64),
+        "scales": np.array([0.0, 1.0, 0.0], dtype=np.float32),
+        "sid": np.array([0], dtype=np.int64),
+        "noise_seed": np.array([0], dtype=np.int64),
+    }
+
+
+def measure_model(
+    model_path: Path, inputs: Dict[str, np.ndarray], num_runs: int
+) -> Any:
+    """Node counts and mean latency (optimizations disabled at load time)."""
+    model = onnx.load(str(model_path))
+    op_counts = Counter(node.op_type for node in model.graph.node)
+
+    # Like the C++ runtime, so only the saved graph's optimizations count
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.graph_optimization_level = (
+        onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+    )
+
+    start_time = time.perf_counter()
+    session = onnxruntime.InferenceSession(
+        str(model_path), sess_options=sess_options, providers=["CPUExecutionProvider"]
+    )
+    load_sec = time.perf_counter() - start_time
+
+    input_names = {model_input.name for model_input in session.get_inputs()}
+    model_inputs = {
+        name: value for name, value in inputs.items() if name in input_names
+    }
+
+    output: Optional[np.ndarray] = None
+    run_sec = []
+    for run_idx in range(num_runs + 1):
+        start_time = time.perf_counter()
+        output = session.run(None, model_inputs)[0]
+        if run_idx > 0:
+            # First run is warm-up
+            run_sec.append(time.perf_counter() - start_time)
+
+    return (
+        {
+            "path": str(model_path),
+            "size_bytes": model_path.stat().st_size,
+            "nodes": len(model.graph.node),
+            "op_counts": dict(op_counts.most_common()),
+            "load_sec": load_sec,
+            "latency_sec": statistics.mean(run_sec),
+        },
+        output,
+    )
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,30 @@ import dataclasses
 import itertools
 import json
 import logging
+import math
 import os
+import time
 import unicodedata
 from collections import Counter
 from dataclasses import dataclass, field
 from enum import Enum
-from multiprocessing import JoinableQueue, Process, Queue
+from hashlib import sha256
+from multiprocessing import Process, Queue
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
+import torch
 from piper_phonemize import (
     phonemize_espeak,
     phonemize_codepoints,
@@ -25,12 +40,15 @@ from piper_phonemize import (
     tashkeel_run,
 )
 
-from .norm_audio import cache_norm_audio, make_silence_detector
+from .norm_audio import cache_norm_audio, cache_spectrograms, make_silence_detector
 
 _DIR = Path(__file__).parent
 _VERSION = (_DIR / "VERSION").read_text(encoding="utf-8").strip()
 _LOGGER = logging.getLogger("preprocess")
 
+# Spectrogram batches gathered before they are computed and written
+_SPEC_WINDOW_BATCHES = 8
+
 
 class PhonemeType(str, Enum):
     ESPEAK = "espeak"
@@ -62,6 +80,24 @@ def main() -> None:
     )
     parser.add_argument("--cache-dir", help="Directory to cache processed audio files")
     parser.add_argument("--max-workers", type=int)
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=16,
+        help="Number of utterances sent to a worker at a time (default: 16)",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10.0,
+        help="Seconds between progress reports (default: 10)",
+    )
+    parser.add_argument(
+        "--spectrogram-batch-size",
+        type=int,
+        default=32,
+        help="Number of utterances per batched spectrogram computation (default: 32)",
+    )
     parser.add_argument(
         "--single-speaker", action="store_true", help="Force single speaker dataset"
     )
@@ -100,6 +136,11 @@ def main() -> None:
     parser.add_argument(
         "--skip-audio", action="store_true", help="Don't preprocess audio"
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process new or changed utterances, reusing the previous run's output",
+    )
     parser.add_argument(
         "--debug", action="store_true", help="Print DEBUG messages to the console"
     )
@@ -136,16 +177,13 @@ def main() -> None:
     else:
         make_dataset = ljspeech_dataset
 
-    # Count speakers
-    _LOGGER.debug("Counting number of speakers/utterances in the dataset")
-    speaker_counts: "Counter[str]" = Counter()
-    num_utterances = 0
-    for utt in make_dataset(args):
-        speaker = utt.speaker or ""
-        speaker_counts[speaker] += 1
-        num_utterances += 1
+    # Scan the dataset once and keep the utterances in memory
+    _LOGGER.debug("Scanning dataset")
+    utterances = list(make_dataset(args))
+    assert utterances, "No utterances found"
 
-    assert num_utterances > 0, "No utterances found"
+    # Count speakers
+    speaker_counts: "Counter[str]" = Counter(utt.speaker or "" for utt in utterances)
 
     is_multispeaker = len(speaker_counts) > 1
     speaker_ids: Dict[str, int] = {}
@@ -201,73 +239,324 @@ def main() -> None:
 
     assert args.max_workers is not None
 
-    batch_size = int(num_utterances / (args.max_workers * 2))
-    queue_in: "Queue[Iterable[Utterance]]" = JoinableQueue()
-    queue_out: "Queue[Optional[Utterance]]" = Queue()
-
-    # Start workers
-    if args.phoneme_type == PhonemeType.TEXT:
-        target = phonemize_batch_text
-    else:
-        target = phonemize_batch_espeak
-
-    processes = [
-        Process(target=target, args=(args, queue_in, queue_out))
-        for _ in range(args.max_workers)
-    ]
-    for proc in processes:
-        proc.start()
+    # Utterances from a previous run that can be reused as-is
+    manifest_path = args.output_dir / "manifest.json"
+    dataset_path = args.output_dir / "dataset.jsonl"
+    params = get_params_fingerprint(args)
+    reusable: Dict[str, Tuple[Dict[str, str], Dict[str, Any]]] = {}
+    if args.incremental:
+        reusable = load_reusable_utterances(manifest_path, dataset_path, params)
+
+    # audio path -> fingerprint of processed input
+    manifest: Dict[str, Dict[str, str]] = {}
+    fingerprints: Dict[str, Dict[str, str]] = {}
+
+    # Utterances in input order: either an Utterance to process, or the
+    # already-processed JSON of an unchanged utterance.
+    dataset_items: List[Union[Utterance, Dict[str, Any]]] = []
+    utts_to_process: List[Utterance] = []
+
+    for utt in utterances:
+        utt_key = str(utt.audio_path)
+        fingerprint = get_utterance_fingerprint(utt, args.skip_audio)
+        reused = reusable.get(utt_key)
+        if (reused is not None) and (reused[0] == fingerprint):
+            # Unchanged since last run
+            utt_dict = reused[1]
+            utt_dict["speaker_id"] = (
+                speaker_ids[utt.speaker] if utt.speaker is not None else utt.speaker_id
+            )
+            manifest[utt_key] = fingerprint
+            dataset_items.append(utt_dict)
+        else:
+            if (reused is not None) and (
+                reused[0].get("audio") != fingerprint.get("audio")
+            ):
+                # Audio has changed, so cached files are stale
+                for cached_key in ("audio_norm_path", "audio_spec_path"):
+                    cached_path = reused[1].get(cached_key)
+                    if cached_path:
+                        Path(cached_path).unlink(missing_ok=True)
+
+            fingerprints[utt_key] = fingerprint
+            dataset_items.append(utt)
+            utts_to_process.append(utt)
+
+    if args.incremental:
+        _LOGGER.info(
+            "Reused %s unchanged utterance(s)",
+            len(dataset_items) - len(utts_to_process),
+        )
 
     _LOGGER.info(
-        "Processing %s utterance(s) with %s worker(s)", num_utterances, args.max_workers
+        "Processing %s utterance(s) with %s worker(s)",
+        len(utts_to_process),
+        args.max_workers,
     )
-    with open(args.output_dir / "dataset.jsonl", "w", encoding="utf-8") as dataset_file:
-        for utt_batch in batched(
-            make_dataset(args),
-            batch_size,
-        ):
-            queue_in.put(utt_batch)
 
-        _LOGGER.debug("Waiting for jobs to finish")
+    # Workers only normalize audio. Spectrograms are computed here in
+    # length-sorted batches, a window of utterances at a time, while the
+    # workers are still running. Use the cores they leave free.
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) - args.max_workers))
+    spec_window_size = args.spectrogram_batch_size * _SPEC_WINDOW_BATCHES
+
+    temp_dataset_path = dataset_path.with_suffix(".jsonl.tmp")
+    with open(temp_dataset_path, "w", encoding="utf-8") as dataset_file:
+        # Results come back in the same order as utts_to_process
+        processed_utts = process_utterances(args, utts_to_process)
         missing_phonemes: "Counter[str]" = Counter()
-        for _ in range(num_utterances):
-            utt = queue_out.get()
-            if utt is not None:
+
+        # Items waiting for their spectrograms, in input order
+        pending_items: List[Union[Utterance, Dict[str, Any]]] = []
+        num_pending_utts = 0
+
+        def write_pending_items():
+            pending_utts = [
+                item for item in pending_items if isinstance(item, Utterance)
+            ]
+            failed_utts: Set[int] = set()
+            if not args.skip_audio:
+                spec_lengths = cache_spectrograms(
+                    [
+                        (utt.audio_norm_path, utt.audio_spec_path)
+                        for utt in pending_utts
+                    ],
+                    args.sample_rate,
+                    batch_size=args.spectrogram_batch_size,
+                )
+
+                for utt, spec_length in zip(pending_utts, spec_lengths):
+                    if spec_length is None:
+                        failed_utts.add(id(utt))
+                    else:
+                        utt.audio_spec_length = spec_length
+
+            for item in pending_items:
+                if not isinstance(item, Utterance):
+                    write_utterance(item, dataset_file)
+                    continue
+
+                utt = item
+                if id(utt) in failed_utts:
+                    continue
+
                 if utt.speaker is not None:
                     utt.speaker_id = speaker_ids[utt.speaker]
 
                 utt_dict = dataclasses.asdict(utt)
                 utt_dict.pop("missing_phonemes")
+                utt_dict.pop("audio_stat")
+                write_utterance(utt_dict, dataset_file)
 
-                # JSONL
-                json.dump(
-                    utt_dict,
-                    dataset_file,
-                    ensure_ascii=False,
-                    cls=PathEncoder,
-                )
-                print("", file=dataset_file)
+                # Only successfully processed utterances are recorded
+                utt_key = str(utt.audio_path)
+                manifest[utt_key] = fingerprints[utt_key]
 
                 missing_phonemes.update(utt.missing_phonemes)
 
+            pending_items.clear()
+
+        for item in dataset_items:
+            if isinstance(item, Utterance):
+                processed_utt = next(processed_utts)
+                if processed_utt is None:
+                    # Failed
+                    continue
+
+                item = processed_utt
+                num_pending_utts += 1
+
+            pending_items.append(item)
+            if num_pending_utts >= spec_window_size:
+                write_pending_items()
+                num_pending_utts = 0
+
+        write_pending_items()
+
+        # Finish processing and stop workers
+        for _ in processed_utts:
+            pass
+
         if missing_phonemes:
             for phoneme, count in missing_phonemes.most_common():
                 _LOGGER.warning("Missing %s (%s)", phoneme, count)
 
             _LOGGER.warning("Missing %s phoneme(s)", len(missing_phonemes))
 
-    # Signal workers to stop
-    for proc in processes:
-        queue_in.put(None)
+    torch.set_num_threads(num_threads)
+    os.replace(temp_dataset_path, dataset_path)
 
-    # Wait for workers to stop
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(
+            {"params": params, "utterances": manifest},
+            manifest_file,
+            ensure_ascii=False,
+        )
+
+
+def process_utterances(
+    args: argparse.Namespace, utts: List["Utterance"]
+) -> Generator[Optional["Utterance"], None, None]:
+    """Phonemize/normalize utterances in worker processes.
+
+    Utterances are sent out in small chunks with a bounded number of chunks in
+    flight. Results are re-ordered, so they are yielded in the same order as
+    utts (None for utterances that failed).
+    """
+    if not utts:
+        return
+
+    queue_in: "Queue[Optional[Tuple[int, List[Utterance]]]]" = Queue()
+    queue_out: "Queue[Tuple[int, List[Optional[Utterance]]]]" = Queue()
+
+    # Start workers
+    if args.phoneme_type == PhonemeType.TEXT:
+        target = phonemize_batch_text
+    else:
+        target = phonemize_batch_espeak
+
+    processes = [
+        Process(target=target, args=(args, queue_in, queue_out))
+        for _ in range(args.max_workers)
+    ]
     for proc in processes:
-        proc.join(timeout=1)
+        proc.start()
+
+    num_chunks = math.ceil(len(utts) / args.chunk_size)
+    max_chunks_in_flight = args.max_workers * 2
+    chunks = enumerate(batched(utts, args.chunk_size))
+
+    # chunk index -> results waiting for earlier chunks to finish
+    finished_chunks: Dict[int, List[Optional[Utterance]]] = {}
+    next_chunk_to_send = 0
+    next_chunk_to_yield = 0
+
+    num_processed = 0
+    start_time = time.monotonic()
+    last_report_time = start_time
+
+    try:
+        while next_chunk_to_yield < num_chunks:
+            # Keep workers busy without queueing the whole dataset
+            while (next_chunk_to_send < num_chunks) and (
+                (next_chunk_to_send - next_chunk_to_yield) < max_chunks_in_flight
+            ):
+                queue_in.put(next(chunks))
+                next_chunk_to_send += 1
+
+            chunk_idx, chunk_results = queue_out.get()
+            finished_chunks[chunk_idx] = chunk_results
+
+            while next_chunk_to_yield in finished_chunks:
+                chunk_results = finished_chunks.pop(next_chunk_to_yield)
+                next_chunk_to_yield += 1
+                num_processed += len(chunk_results)
+                yield from chunk_results
+
+            current_time = time.monotonic()
+            if (current_time - last_report_time) >= args.progress_interval:
+                last_report_time = current_time
+                _LOGGER.info(
+                    "Processed %s/%s utterance(s) (%0.2f utterance(s)/sec)",
+                    num_processed,
+                    len(utts),
+                    num_processed / (current_time - start_time),
+                )
+
+        elapsed_sec = time.monotonic() - start_time
+        _LOGGER.info(
+            "Processed %s utterance(s) in %0.2f second(s) (%0.2f utterance(s)/sec)",
+            num_processed,
+            elapsed_sec,
+            num_processed / elapsed_sec if elapsed_sec > 0 else 0.0,
+        )
+    finally:
+        # Signal workers to stop
+        for proc in processes:
+            queue_in.put(None)
+
+        # Wait for workers to stop
+        for proc in processes:
+            proc.join(timeout=1)
 
 
 # -----------------------------------------------------------------------------
 
 
+def write_utterance(utt_dict: Dict[str, Any], dataset_file: TextIO) -> None:
+    """Write utterance as a line of JSON."""
+    json.dump(
+        utt_dict,
+        dataset_file,
+        ensure_ascii=False,
+        cls=PathEncoder,
+    )
+    print("", file=dataset_file)
+
+
+def get_params_fingerprint(args: argparse.Namespace) -> Dict[str, Any]:
+    """Settings that affect every utterance. Changing any of them invalidates
+    the whole incremental manifest."""
+    return {
+        "piper_version": _VERSION,
+        "language": args.language,
+        "sample_rate": args.sample_rate,
+        "phoneme_type": args.phoneme_type.value,
+        "text_casing": args.text_casing,
+        "tashkeel": args.tashkeel,
+        "skip_audio": args.skip_audio,
+        "cache_dir": str(args.cache_dir.absolute()),
+    }
+
+
+def get_utterance_fingerprint(utt: "Utterance", skip_audio: bool) -> Dict[str, str]:
+    """Hash of metadata row and audio file stats."""
+    row_hash = sha256()
+    row_hash.update(utt.text.encode())
+    row_hash.update(b"\0")
+    row_hash.update((utt.speaker or "").encode())
+
+    fingerprint = {"row": row_hash.hexdigest()}
+    if not skip_audio:
+        audio_stat = utt.audio_stat or utt.audio_path.stat()
+        fingerprint["audio"] = f"{audio_stat.st_size}:{audio_stat.st_mtime_ns}"
+
+    return fingerprint
+
+
+def load_reusable_utterances(
+    manifest_path: Path, dataset_path: Path, params: Dict[str, Any]
+) -> Dict[str, Tuple[Dict[str, str], Dict[str, Any]]]:
+    """Load audio path -> (fingerprint, utterance) from a previous run."""
+    if not (manifest_path.is_file() and dataset_path.is_file()):
+        _LOGGER.info("No previous run found, processing all utterances")
+        return {}
+
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest.get("params") != params:
+        _LOGGER.info("Settings have changed, processing all utterances")
+        return {}
+
+    fingerprints: Dict[str, Dict[str, str]] = manifest.get("utterances", {})
+    reusable: Dict[str, Tuple[Dict[str, str], Dict[str, Any]]] = {}
+    with open(dataset_path, "r", encoding="utf-8") as dataset_file:
+        for line in dataset_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            utt_dict = json.loads(line)
+            utt_key = utt_dict["audio_path"]
+            fingerprint = fingerprints.get(utt_key)
+            if fingerprint is not None:
+                reusable[utt_key] = (fingerprint, utt_dict)
+
+    return reusable
+
+
 def get_text_casing(casing: str):
     if casing == "lower":
         return str.lower
@@ -281,18 +570,18 @@ def get_text_casing(casing: str):
     return lambda s: s
 
 
-def phonemize_batch_espeak(
-    args: argparse.Namespace, queue_in: JoinableQueue, queue_out: Queue
-):
+def phonemize_batch_espeak(args: argparse.Namespace, queue_in: Queue, queue_out: Queue):
     try:
         casing = get_text_casing(args.text_casing)
         silence_detector = make_silence_detector()
 
         while True:
-            utt_batch = queue_in.get()
-            if utt_batch is None:
+            chunk = queue_in.get()
+            if chunk is None:
                 break
 
+            chunk_idx, utt_batch = chunk
+            chunk_results: List[Optional[Utterance]] = []
             for utt in utt_batch:
                 try:
                     if args.tashkeel:
@@ -317,31 +606,33 @@ def phonemize_batch_espeak(
                             args.cache_dir,
                             silence_detector,
                             args.sample_rate,
+                            compute_spectrogram=False,
                         )
-                    queue_out.put(utt)
+                    chunk_results.append(utt)
                 except TimeoutError:
                     _LOGGER.error("Skipping utterance due to timeout: %s", utt)
+                    chunk_results.append(None)
                 except Exception:
                     _LOGGER.exception("Failed to process utterance: %s", utt)
-                    queue_out.put(None)
+                    chunk_results.append(None)
 
-            queue_in.task_done()
+            queue_out.put((chunk_idx, chunk_results))
     except Exception:
         _LOGGER.exception("phonemize_batch_espeak")
 
 
-def phonemize_batch_text(
-    args: argparse.Namespace, queue_in: JoinableQueue, queue_out: Queue
-):
+def phonemize_batch_text(args: argparse.Namespace, queue_in: Queue, queue_out: Queue):
     try:
         casing = get_text_casing(args.text_casing)
         silence_detector = make_silence_detector()
 
         while True:
-            utt_batch = queue_in.get()
-            if utt_batch is None:
+            chunk = queue_in.get()
+            if chunk is None:
                 break
 
+            chunk_idx, utt_batch = chunk
+            chunk_results: List[Optional[Utterance]] = []
             for utt in utt_batch:
                 try:
                     if args.tashkeel:
@@ -366,15 +657,17 @@ def phonemize_batch_text(
                             args.cache_dir,
                             silence_detector,
                             args.sample_rate,
+                            compute_spectrogram=False,
                         )
-                    queue_out.put(utt)
+                    chunk_results.append(utt)
                 except TimeoutError:
                     _LOGGER.error("Skipping utterance due to timeout: %s", utt)
+                    chunk_results.append(None)
                 except Exception:
                     _LOGGER.exception("Failed to process utterance: %s", utt)
-                    queue_out.put(None)
+                    chunk_results.append(None)
 
-            queue_in.task_done()
+            queue_out.put((chunk_idx, chunk_results))
     except Exception:
         _LOGGER.exception("phonemize_batch_text")
 
@@ -392,7 +685,10 @@ class Utterance:
     phoneme_ids: Optional[List[int]] = None
     audio_norm_path: Optional[Path] = None
     audio_spec_path: Optional[Path] = None
+    audio_spec_length: Optional[int] = None
     missing_phonemes: "Counter[str]" = field(default_factory=Counter)
+    audio_stat: Optional[os.stat_result] = field(default=None, repr=False)
+    """Result of stat() on audio_path from the directory scan (not saved)"""
 
 
 class PathEncoder(json.JSONEncoder):
@@ -402,6 +698,36 @@ class PathEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+class AudioFileIndex:
+    """Resolves audio file names using one listing per directory.
+
+    Avoids probing the file system with exists()/stat() for every row, which
+    is slow on network storage.
+    """
+
+    def __init__(self):
+        # directory -> {file name: entry}
+        self._listings: Dict[Path, Dict[str, os.DirEntry]] = {}
+
+    def _list_dir(self, dir_path: Path) -> Dict[str, os.DirEntry]:
+        listing = self._listings.get(dir_path)
+        if listing is None:
+            listing = {}
+            if dir_path.is_dir():
+                with os.scandir(dir_path) as entries:
+                    listing = {
+                        entry.name: entry for entry in entries if entry.is_file()
+                    }
+
+            self._listings[dir_path] = listing
+
+        return listing
+
+    def find(self, file_path: Path) -> Optional[os.DirEntry]:
+        """Get directory entry for a file or None if it doesn't exist."""
+        return self._list_dir(file_path.parent).get(file_path.name)
+
+
 def ljspeech_dataset(args: argparse.Namespace) -> Iterable[Utterance]:
     dataset_dir = args.input_dir
     is_single_speaker = args.single_speaker
@@ -417,6 +743,8 @@ def ljspeech_dataset(args: argparse.Namespace) -> Iterable[Utterance]:
     if not wav_dir.is_dir():
         wav_dir = dataset_dir / "wavs"
 
+    audio_files = AudioFileIndex()
+
     with open(metadata_path, "r", encoding="utf-8") as csv_file:
         reader = csv.reader(csv_file, delimiter="|")
         for row in reader:
@@ -428,32 +756,36 @@ def ljspeech_dataset(args: argparse.Namespace) -> Iterable[Utterance]:
             else:
                 filename, speaker, text = row[0], row[1], row[-1]
 
-            # Try file name relative to metadata
-            wav_path = metadata_path.parent / filename
-
-            if not wav_path.exists():
-                # Try with .wav
-                wav_path = metadata_path.parent / f"{filename}.wav"
-
-            if not wav_path.exists():
-                # Try wav/ or wavs/
-                wav_path = wav_dir / filename
-
-            if not wav_path.exists():
-                # Try with .wav
-                wav_path = wav_dir / f"{filename}.wav"
-
+            # Try file name relative to metadata, then in wav/ or wavs/.
+            # Each may be missing the .wav extension.
+            wav_entry: Optional[os.DirEntry] = None
+            for wav_path in (
+                metadata_path.parent / filename,
+                metadata_path.parent / f"{filename}.wav",
+                wav_dir / filename,
+                wav_dir / f"{filename}.wav",
+            ):
+                wav_entry = audio_files.find(wav_path)
+                if wav_entry is not None:
+                    break
+
+            audio_stat: Optional[os.stat_result] = None
             if not skip_audio:
-                if not wav_path.exists():
+                if wav_entry is None:
                     _LOGGER.warning("Missing %s", filename)
                     continue
 
-                if wav_path.stat().st_size == 0:
+                audio_stat = wav_entry.stat()
+                if audio_stat.st_size == 0:
                     _LOGGER.warning("Empty file: %s", wav_path)
                     continue
 
             yield Utterance(
-                text=text, audio_path=wav_path, speaker=speaker, speaker_id=speaker_id
+                text=text,
+                audio_path=wav_path,
+                speaker=speaker,
+                speaker_id=speaker_id,
+                audio_stat=audio_stat,
             )
 
 
@@ -461,6 +793,7 @@ def mycroft_dataset(args: argparse.Namespace) -> Iterable[Utterance]:
     dataset_dir = args.input_dir
     is_single_speaker = args.single_speaker
     skip_audio = args.skip_audio
+    audio_files = AudioFileIndex()
 
     speaker_id = 0
     for metadata_path in dataset_dir.glob("**/*-metadata.txt"):
@@ -471,13 +804,23 @@ def mycroft_dataset(args: argparse.Namespace) -> Iterable[Utterance]:
             for row in reader:
                 filename, text = row[0], row[1]
                 wav_path = metadata_path.parent / filename
-                if skip_audio or (wav_path.exists() and (wav_path.stat().st_size > 0)):
-                    yield Utterance(
-                        text=text,
-                        audio_path=wav_path,
-                        speaker=speaker,
-                        speaker_id=speaker_id if not is_single_speaker else None,
-                    )
+                audio_stat: Optional[os.stat_result] = None
+                if not skip_audio:
+                    wav_entry = audio_files.find(wav_path)
+                    if wav_entry is None:
+                        continue
+
+                    audio_stat = wav_entry.stat()
+                    if audio_stat.st_size <= 0:
+                        continue
+
+                yield Utterance(
+                    text=text,
+                    audio_path=wav_path,
+                    speaker=speaker,
+                    speaker_id=speaker_id if not is_single_speaker else None,
+                    audio_stat=audio_stat,
+                )
         speaker_id += 1
 
 
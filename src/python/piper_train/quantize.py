@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""INT8 quantization of exported ONNX voices.
+
+Writes dynamic and/or static INT8 variants of a model from export_onnx, and
+reports the size, real-time factor, and spectral distance from the original
+(fp32) model of each one as JSON.
+"""
+import argparse
+import itertools
+import json
+import logging
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import onnxruntime
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+
+_LOGGER = logging.getLogger("piper_train.quantize")
+
+_NOISE_SCALE = 0.667
+_LENGTH_SCALE = 1.0
+_NOISE_W = 0.8
+_DEFAULT_SAMPLE_RATE = 22050
+
+# Spectrogram settings for quality comparison
+_FFT_SIZE = 1024
+_HOP_LENGTH = 256
+
+
+def main() -> None:
+    """Main entry point"""
+    parser = argparse.ArgumentParser(prog="piper_train.quantize")
+    parser.add_argument("model", help="Path to exported model (.onnx)")
+    parser.add_argument("output_dir", help="Directory to write quantized models")
+    parser.add_argument(
+        "--dataset",
+        required=True,
+        help="Path to dataset.jsonl from preprocess (phoneme ids for calibration)",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=("dynamic", "static", "both"),
+        default="both",
+        help="Type of quantization (default: both)",
+    )
+    parser.add_argument(
+        "--op-types",
+        nargs="+",
+        default=["Conv", "MatMul"],
+        help="Operator types to quantize (default: Conv MatMul)",
+    )
+    parser.add_argument(
+        "--per-channel",
+        action="store_true",
+        help="Quantize weights per output channel instead of per tensor",
+    )
+    parser.add_argument(
+        "--calibration-utterances",
+        type=int,
+        default=100,
+        help="Number of utterances used to calibrate static quantization",
+    )
+    parser.add_argument(
+        "--eval-utterances",
+        type=int,
+        default=10,
+        help="Number of utterances used to measure speed and quality",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Print DEBUG messages to the console"
+    )
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _LOGGER.debug(args)
+
+    # -------------------------------------------------------------------------
+
+    args.model = Path(args.model)
+    args.output_dir = Path(args.output_dir)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    sample_rate = _DEFAULT_SAMPLE_RATE
+    config_path = Path(f"{args.model}.json")
+    if config_path.is_file():
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            sample_rate = int(json.load(config_file)["audio"]["sample_rate"])
+
+    modes = ["dynamic", "static"] if args.mode == "both" else [args.mode]
+    num_utterances = max(args.calibration_utterances, args.eval_utterances)
+    utterances = load_utterances(args.dataset, num_utterances)
+    _LOGGER.debug("Loaded %s utterance(s) from %s", len(utterances), args.dataset)
+
+    input_names = {
+        model_input.name
+        for model_input in onnxruntime.InferenceSession(
+            str(args.model), providers=["CPUExecutionProvider"]
+        ).get_inputs()
+    }
+
+    model_paths = {"fp32": args.model}
+    for mode in modes:
+        output_path = args.output_dir / f"{args.model.stem}.int8-{mode}.onnx"
+        _LOGGER.info("Quantizing (%s): %s", mode, output_path)
+
+        if mode == "dynamic":
+            quantize_dynamic(
+                args.model,
+                output_path,
+                op_types_to_quantize=args.op_types,
+                per_channel=args.per_channel,
+                weight_type=QuantType.QInt8,
+            )
+        else:
+            quantize_static(
+                args.model,
+                output_path,
+                UtteranceCalibrationReader(
+                    utterances[: args.calibration_utterances], input_names
+                ),
+                quant_format=QuantFormat.QDQ,
+                op_types_to_quantize=args.op_types,
+                per_channel=args.per_channel,
+                activation_type=QuantType.QInt8,
+                weight_type=QuantType.QInt8,
+            )
+
+        # Quantized models use the same voice config
+        if config_path.is_file():
+            shutil.copy(config_path, f"{output_path}.json")
+
+        model_paths[mode] = output_path
+
+    # -------------------------------------------------------------------------
+
+    eval_utterances = utterances[: args.eval_utterances]
+    report: Dict[str, Any] = {}
+    reference_audios: Optional[List[np.ndarray]] = None
+    for name, model_path in model_paths.items():
+        session = onnxruntime.InferenceSession(
+            str(model_path), providers=["CPUExecutionProvider"]
+        )
+        audios, infer_sec = synthesize_all(session, eval_utterances, input_names)
+        num_samples = sum(len(audio) for audio in audios)
+
+        model_report: Dict[str, Any] = {
+            "path": str(model_path),
+            "size_bytes": model_path.stat().st_size,
+            "infer_sec": infer_sec,
+            "rtf": infer_sec / max(1e-6, num_samples / sample_rate),
+        }
+
+        if reference_audios is None:
+            reference_audios = audios
+        else:
+            model_report["log_spectral_distance_db"] = statistics.mean(
+                log_spectral_distance(reference_audio, audio)
+                for reference_audio, audio in zip(reference_audios, audios)
+            )
+            model_report["size_ratio"] = (
+                model_report["size_bytes"] / report["fp32"]["size_bytes"]
+            )
+            model_report["speedup"] = report["fp32"]["infer_sec"] / infer_sec
+
+        report[name] = model_report
+
+    json.dump(report, sys.stdout, indent=4)
+    print("")
+
+
+# -----------------------------------------------------------------------------
+
+
+def load_utterances(dataset_path: str, max_utterances: int) -> List[Dict[str, Any]]:
+    """Load the first utterances of a dataset.jsonl file."""
+    with open(dataset_path, "r", encoding="utf-8") as dataset_file:
+        lines = (line.strip() for line in dataset_file)
+        return [
+            json.loads(line)
+            for line in itertools.islice(filter(None, lines), max_utterances)
+        ]
+
+
+def make_inputs(
+    utterance: Dict[str, Any],
+    input_names: Iterable[str],
+    noise_scale: float = _NOISE_SCALE,
+    noise_w: float = _NOISE_W,
+) -> Dict[str, np.ndarray]:
+    """Model inputs for a single utterance."""
+    phoneme_ids = np.expand_dims(np.array(utterance["phoneme_ids"], dtype=np.int64), 0)
+    inputs = {
+        "input": phoneme_ids,
+        "input_lengths": np.array([phoneme_ids.shape[1]], dtype=np.int64),
+        "scales": np.array([noise_scale, _LENGTH_SCALE, noise_w], dtype=np.float32),
+    }
+
+    if "sid" in input_names:
+        inputs["sid"] = np.array([utterance.get("speaker_id") or 0], dtype=np.int64)
+
+    if "noise_seed" in input_names:
+        inputs["noise_seed"] = np.array([0], dtype=np.int64)
+
+    return inputs
+
+
+class UtteranceCalibrationReader(CalibrationDataReader):
+    """Feeds dataset utterances to static quantization calibration."""
+
+    def __init__(self, utterances: List[Dict[str, Any]], input_names: Iterable[str]):
+        self.utterances = utterances
+        self.input_names = set(input_names)
+        self._inputs = iter(self.utterances)
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        utterance = next(self._inputs, None)
+        if utterance is None:
+            return None
+
+        return make_inputs(utterance, self.input_names)
+
+    def rewind(self) -> None:
+        self._inputs = iter(self.utterances)
+
+
+def synthesize_all(
+    session: onnxruntime.InferenceSession,
+    utterances: List[Dict[str, Any]],
+    input_names: Iterable[str],
+):
+    """Synthesize utterances without noise, so models can be compared."""
+    audios: List[np.ndarray] = []
+    infer_sec = 0.0
+
+    if utterances:
+        # Warm up
+        session.run(None, make_inputs(utterances[0], input_names))
+
+    for utterance in utterances:
+        inputs = make_inputs(utterance, input_names, noise_scale=0.0, noise_w=0.0)
+        start_time = time.perf_counter()
+        audio = session.run(None, inputs)[0].squeeze()
+        infer_sec += time.perf_counter() - start_time
+        audios.append(audio)
+
+    return audios, infer_sec
+
+
+def log_spectral_distance(
+    reference_audio: np.ndarray, audio: np.ndarray, eps: float = 1e-10
+) -> float:
+    """Log-spectral distance (dB) between two audio clips.
+
+    Durations may differ slightly after quantization, so only the shared
+    length is compared.
+    """
+    num_samples = min(len(reference_audio), len(audio))
+    if num_samples < _FFT_SIZE:
+        return 0.0
+
+    reference_power = power_spectrogram(reference_audio[:num_samples])
+    power = power_spectrogram(audio[:num_samples])
+    log_diff = 10 * np.log10((reference_power + eps) / (power + eps))
+
+    return float(np.mean(np.sqrt(np.mean(log_diff**2, axis=-1))))
+
+
+def power_spectrogram(audio: np.ndarray) -> np.ndarray:
+    """Power spectrogram [frames, bins] with a Hann window."""
+    num_frames = 1 + ((len(audio) - _FFT_SIZE) // _HOP_LENGTH)
+    frame_indexes = (np.arange(num_frames) * _HOP_LENGTH)[:, None] + np.arange(
+        _FFT_SIZE
+    )
+    frames = audio[frame_indexes] * np.hanning(_FFT_SIZE)
+
+    return np.abs(np.fft.rfft(frames, axis=-1)) ** 2
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
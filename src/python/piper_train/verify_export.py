@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""Verification of exported models against the PyTorch generator.
+
+Each artifact is loaded in its own runtime and synthesizes a standard set of
+phoneme id sequences. Noise scales are 0, so the audio must match
+SynthesizerTrn.infer. Artifacts with a noise_seed input are also compared
+with noise from the same seed. Load time and real-time factor are measured
+too, and the report is written next to the artifact as JSON.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from .vits.lightning import VitsModel
+from .vits.models import SynthesizerTrn
+
+_LOGGER = logging.getLogger("piper_train.verify_export")
+
+ARTIFACT_KINDS = ("onnx", "streaming", "torchscript", "generator")
+
+# Audio is in [-1, 1]
+DEFAULT_MAX_ABS_DIFF = 1e-3
+
+_NOISE_SCALE = 0.667
+_LENGTH_SCALE = 1.0
+_NOISE_W = 0.8
+
+_STANDARD_LENGTHS = (10, 25, 50, 100, 200)
+_STANDARD_SEED = 1234
+
+
+class VerificationError(Exception):
+    """Raised when an exported artifact fails verification."""
+
+
+def main() -> None:
+    """Main entry point"""
+    parser = argparse.ArgumentParser(prog="piper_train.verify_export")
+    parser.add_argument("checkpoint", help="Path to model checkpoint (.ckpt)")
+    parser.add_argument(
+        "artifact", help="Path to exported model (directory for streaming)"
+    )
+    parser.add_argument("--kind", required=True, choices=ARTIFACT_KINDS)
+    parser.add_argument(
+        "--speaker-id",
+        type=int,
+        help="Speaker of a graph from --speaker-graphs (no sid input)",
+    )
+    add_verify_args(parser)
+    parser.add_argument(
+        "--debug", action="store_true", help="Print DEBUG messages to the console"
+    )
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    _LOGGER.debug(args)
+
+    model = VitsModel.load_from_checkpoint(args.checkpoint, dataset=None)
+    model_g = model.model_g
+    model_g.eval()
+
+    report = verify_export(
+        model_g,
+        args.artifact,
+        args.kind,
+        sample_rate=model.hparams.sample_rate,
+        speaker_id=args.speaker_id,
+        max_abs_diff=args.max_abs_diff,
+        max_rtf=args.max_rtf,
+    )
+    json.dump(report, sys.stdout, indent=4)
+    print("")
+
+    if not report["passed"]:
+        sys.exit(1)
+
+
+# -----------------------------------------------------------------------------
+
+
+def add_verify_args(parser: argparse.ArgumentParser) -> None:
+    """Add arguments for verify_export to an export script's parser."""
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="Don't check exported models against the PyTorch model",
+    )
+    parser.add_argument(
+        "--max-abs-diff",
+        type=float,
+        default=DEFAULT_MAX_ABS_DIFF,
+        help=f"Fail if audio differs from PyTorch by more (default: {DEFAULT_MAX_ABS_DIFF})",
+    )
+    parser.add_argument(
+        "--max-rtf",
+        type=float,
+        help="Fail if the real-time factor of an exported model is higher",
+    )
+
+
+def check_export(
+    args: argparse.Namespace,
+    model_g: SynthesizerTrn,
+    artifact_path: Path,
+    kind: str,
+    sample_rate: int,
+    speaker_id: Optional[int] = None,
+) -> None:
+    """Verify an artifact using the arguments from add_verify_args.
+
+    Raises VerificationError if it fails.
+    """
+    if args.no_verify:
+        return
+
+    report = verify_export(
+        model_g,
+        artifact_path,
+        kind,
+        sample_rate=sample_rate,
+        speaker_id=speaker_id,
+        max_abs_diff=args.max_abs_diff,
+        max_rtf=args.max_rtf,
+    )
+
+    if not report["passed"]:
+        raise VerificationError(f"{artifact_path}: {'; '.join(report['errors'])}")
+
+
+def verify_export(
+    model_g: SynthesizerTrn,
+    artifact_path: Path,
+    kind: str,
+    sample_rate: int,
+    speaker_id: Optional[int] = None,
+    max_abs_diff: float = DEFAULT_MAX_ABS_DIFF,
+    max_rtf: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Compare an exported artifact with model_g and write a JSON report.
+
+    speaker_id is the reference speaker for artifacts without a sid input
+    (specialized speaker graphs). Otherwise, speaker 0 is used.
+    """
+    artifact_path = Path(artifact_path)
+    errors: List[str] = []
+    report: Dict[str, Any] = {
+        "artifact": str(artifact_path),
+        "kind": kind,
+        "max_abs_diff_allowed": max_abs_diff,
+        "max_rtf_allowed": max_rtf,
+    }
+
+    if speaker_id is None:
+        speaker_id = 0
+
+    ref_sid: Optional[torch.LongTensor] = None
+    if model_g.n_speakers > 1:
+        ref_sid = torch.LongTensor([speaker_id])
+
+    try:
+        start_time = time.perf_counter()
+        runtime = load_runtime(kind, artifact_path)
+        report["load_sec"] = time.perf_counter() - start_time
+
+        utterances = standard_utterances(model_g.n_vocab)
+
+        # Warm up
+        runtime.synthesize(utterances[0], speaker_id)
+
+        infer_sec = 0.0
+        num_samples = 0
+        utterance_reports = []
+        for phoneme_ids in utterances:
+            start_time = time.perf_counter()
+            audio = runtime.synthesize(phoneme_ids, speaker_id)
+            infer_sec += time.perf_counter() - start_time
+            num_samples += len(audio)
+
+            ref_audio = reference_audio(model_g, phoneme_ids, ref_sid)
+            utterance_reports.append(
+                compare_audio(len(phoneme_ids), audio, ref_audio, errors, max_abs_diff)
+            )
+
+            if runtime.has_noise_seed:
+                audio = runtime.synthesize(phoneme_ids, speaker_id, noise_seed=0)
+                ref_audio = reference_audio(model_g, phoneme_ids, ref_sid, noise_seed=0)
+                utterance_reports.append(
+                    compare_audio(
+                        len(phoneme_ids),
+                        audio,
+                        ref_audio,
+                        errors,
+                        max_abs_diff,
+                        noise_seed=0,
+                    )
+                )
+
+        report["utterances"] = utterance_reports
+        report["max_abs_diff"] = max(
+            utt_report["max_abs_diff"] for utt_report in utterance_reports
+        )
+        report["rtf"] = infer_sec / max(1e-6, num_samples / sample_rate)
+
+        if (max_rtf is not None) and (report["rtf"] > max_rtf):
+            errors.append(f"Real-time factor {report['rtf']:.3f} > {max_rtf}")
+    except Exception as e:
+        _LOGGER.exception("Failed to verify %s", artifact_path)
+        errors.append(f"{e.__class__.__name__}: {e}")
+
+    report["errors"] = errors
+    report["passed"] = not errors
+
+    report_path = verify_report_path(artifact_path)
+    with open(report_path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=4)
+
+    if report["passed"]:
+        _LOGGER.info(
+            "Verified %s (max diff=%s, rtf=%s, load=%s sec)",
+            artifact_path,
+            report["max_abs_diff"],
+            report["rtf"],
+            report["load_sec"],
+        )
+    else:
+        _LOGGER.error("Verification failed for %s: %s", artifact_path, errors)
+
+    return report
+
+
+def verify_report_path(artifact_path: Path) -> Path:
+    if artifact_path.is_dir():
+        return artifact_path / "verify.json"
+
+    return Path(f"{artifact_path}.verify.json")
+
+
+def standard_utterances(num_symbols: int) -> List[np.ndarray]:
+    """Fixed phoneme id sequences of increasing length."""
+    rng = np.random.default_rng(_STANDARD_SEED)
+    return [
+        rng.integers(1, num_symbols, size=num_phonemes, dtype=np.int64)
+        for num_phonemes in _STANDARD_LENGTHS
+    ]
+
+
+def reference_audio(
+    model_g: SynthesizerTrn,
+    phoneme_ids: np.ndarray,
+    sid: Optional[torch.LongTensor],
+    noise_seed: Optional[int] = None,
+) -> np.ndarray:
+    text = torch.from_numpy(phoneme_ids).unsqueeze(0)
+    text_lengths = torch.LongTensor([len(phoneme_ids)])
+    noise_scale, noise_w = _scales(noise_seed)
+
+    with torch.no_grad():
+        audio, *_ = model_g.infer(
+            text,
+            text_lengths,
+            sid=sid,
+            noise_scale=noise_scale,
+            length_scale=_LENGTH_SCALE,
+            noise_scale_w=noise_w,
+            noise_seed=(
+                torch.LongTensor([noise_seed]) if noise_seed is not None else None
+            ),
+        )
+
+    return audio.squeeze().numpy()
+
+
+def compare_audio(
+    num_phonemes: int,
+    audio: np.ndarray,
+    ref_audio: np.ndarray,
+    errors: List[str],
+    max_abs_diff: float,
+    noise_seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Compare audio with the reference, adding to errors if it doesn't match."""
+    utt_report: Dict[str, Any] = {
+        "num_phonemes": num_phonemes,
+        "noise_seed": noise_seed,
+        "num_samples": len(audio),
+        "reference_samples": len(ref_audio),
+    }
+
+    num_samples = min(len(audio), len(ref_audio))
+    utt_report["max_abs_diff"] = float(
+        np.max(np.abs(audio[:num_samples] - ref_audio[:num_samples]), initial=0.0)
+    )
+
+    if len(audio) != len(ref_audio):
+        errors.append(
+            f"{num_phonemes} phonemes: {len(audio)} sample(s) != {len(ref_audio)}"
+        )
+    elif utt_report["max_abs_diff"] > max_abs_diff:
+        errors.append(
+            f"{num_phonemes} phonemes: max difference {utt_report['max_abs_diff']} > {max_abs_diff}"
+        )
+
+    return utt_report
+
+
+def _scales(noise_seed: Optional[int]):
+    """Noise scales: zero without a seed so audio is deterministic."""
+    if noise_seed is None:
+        return 0.0, 0.0
+
+    return _NOISE_SCALE, _NOISE_W
+
+
+# -----------------------------------------------------------------------------
+
+
+class ExportRuntime(ABC):
+    """Synthesizes audio with an exported artifact in its runtime."""
+
+    has_noise_seed = False
+
+    @abstractmethod
+    def synthesize(
+        self,
+        phoneme_ids: np.ndarray,
+        speaker_id: int,
+        noise_seed: Optional[int] = None,
+    ) -> np.ndarray:
+        """Audio for a single utterance [samples]"""
+
+
+class OnnxRuntime(ExportRuntime):
+    def __init__(self, model_path: Path):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.has_noise_seed = "noise_seed" in self.input_names
+
+    def synthesize(self, phoneme_ids, speaker_id, noise_seed=None):
+        audio = self.session.run(
+            None, _onnx_inputs(phoneme_ids, speaker_id, noise_seed, self.input_names)
+        )
+        if "output_lengths" in self.output_names:
+            return audio[0].squeeze()[: audio[1][0]]
+
+        return audio[0].squeeze()
+
+
+class StreamingRuntime(ExportRuntime):
+    """Encoder and decoder from export_onnx_streaming, decoded in one chunk."""
+
+    def __init__(self, model_dir: Path):
+        import onnxruntime
+
+        self.encoder = onnxruntime.InferenceSession(
+            str(model_dir / "encoder.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.decoder = onnxruntime.InferenceSession(
+            str(model_dir / "decoder.onnx"), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {
+            model_input.name for model_input in self.encoder.get_inputs()
+        }
+        self.has_noise_seed = "noise_seed" in self.input_names
+
+    def synthesize(self, phoneme_ids, speaker_id, noise_seed=None):
+        z, y_mask, *g = self.encoder.run(
+            None, _onnx_inputs(phoneme_ids, speaker_id, noise_seed, self.input_names)
+        )
+        decoder_inputs = {"z": z, "y_mask": y_mask}
+        if g:
+            decoder_inputs["g"] = g[0]
+
+        return self.decoder.run(None, decoder_inputs)[0].squeeze()
+
+
+class TorchScriptRuntime(ExportRuntime):
+    def __init__(self, model_path: Path):
+        self.model = torch.jit.load(str(model_path))
+
+    def synthesize(self, phoneme_ids, speaker_id, noise_seed=None):
+        with torch.no_grad():
+            audio = self.model(
+                torch.from_numpy(phoneme_ids).unsqueeze(0),
+                torch.LongTensor([len(phoneme_ids)]),
+                torch.LongTensor([speaker_id]),
+                torch.FloatTensor([0.0]),
+                torch.FloatTensor([_LENGTH_SCALE]),
+                torch.FloatTensor([0.0]),
+            )[0]
+
+        return audio.squeeze().numpy()
+
+
+class GeneratorRuntime(ExportRuntime):
+    def __init__(self, model_path: Path):
+        self.model = torch.load(str(model_path))
+        self.model.eval()
+
+    def synthesize(self, phoneme_ids, speaker_id, noise_seed=None):
+        sid: Optional[torch.LongTensor] = None
+        if self.model.n_speakers > 1:
+            sid = torch.LongTensor([speaker_id])
+
+        with torch.no_grad():
+            audio = self.model(
+                torch.from_numpy(phoneme_ids).unsqueeze(0),
+                torch.LongTensor([len(phoneme_ids)]),
+                sid,
+                noise_scale=0.0,
+                length_scale=_LENGTH_SCALE,
+                noise_scale_w=0.0,
+            )[0]
+
+        return audio.squeeze().numpy()
+
+
+def load_runtime(kind: str, artifact_path: Path) -> ExportRuntime:
+    if kind == "onnx":
+        return OnnxRuntime(artifact_path)
+
+    if kind == "streaming":
+        return StreamingRuntime(artifact_path)
+
+    if kind == "torchscript":
+        return TorchScriptRuntime(artifact_path)
+
+    if kind == "generator":
+        return GeneratorRuntime(artifact_path)
+
+    raise ValueError(f"Unexpected artifact kind: {kind}")
+
+
+def _onnx_inputs(
+    phoneme_ids: np.ndarray,
+    speaker_id: int,
+    noise_seed: Optional[int],
+    input_names,
+) -> Dict[str, np.ndarray]:
+    noise_scale, noise_w = _scales(noise_seed)
+    inputs = {
+        "input": np.expand_dims(phoneme_ids, 0),
+        "input_lengths": np.array([len(phoneme_ids)], dtype=np.int64),
+        "scales": np.array([noise_scale, _LENGTH_SCALE, noise_w], dtype=np.float32),
+    }
+
+    if "sid" in input_names:
+        inputs["sid"] = np.array([speaker_id], dtype=np.int64)
+
+    if "noise_seed" in input_names:
+        inputs["noise_seed"] = np.array([noise_seed or 0], dtype=np.int64)
+
+    return inputs
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import functools
 import math
 import typing
 
@@ -158,6 +159,57 @@ class Decoder(nn.Module):
         return x
 
 
+_HAS_SDPA = hasattr(F, "scaled_dot_product_attention")
+
+
+@functools.lru_cache(maxsize=32)
+def _relative_indexes(length: int, window_size: int, device: torch.device):
+    """Indexes for relative positions in [-window_size, window_size].
+
+    Returns (key_index, key_is_valid, band_index, band_is_valid):
+    * key_index[i, j] - relative embedding used for query i and key j [l, l]
+    * band_index[i, r] - key at relative position r for query i [l, 2w + 1]
+    """
+    # Cached tensors outlive the caller, so never create inference tensors that
+    # a later training step would be unable to save for backward.
+    with torch.inference_mode(False):
+        positions = torch.arange(length, device=device)
+        relative_positions = torch.arange(-window_size, window_size + 1, device=device)
+
+        key_index = positions.unsqueeze(0) - positions.unsqueeze(1) + window_size
+        key_is_valid = (key_index >= 0) & (key_index <= 2 * window_size)
+
+        band_index = positions.unsqueeze(1) + relative_positions.unsqueeze(0)
+        band_is_valid = (band_index >= 0) & (band_index < length)
+
+        return (
+            key_index.clamp(0, 2 * window_size),
+            key_is_valid,
+            band_index.clamp(0, length - 1),
+            band_is_valid,
+        )
+
+
+@functools.lru_cache(maxsize=32)
+def _block_mask(length: int, block_length: int, device: torch.device):
+    """True outside of local attention blocks [l, l]"""
+    with torch.inference_mode(False):
+        return (
+            ~torch.ones(length, length, dtype=torch.bool, device=device)
+            .triu(-block_length)
+            .tril(block_length)
+        )
+
+
+@functools.lru_cache(maxsize=32)
+def _proximal_bias(length: int, device: torch.device):
+    """Same as MultiHeadAttention._attention_bias_proximal [1, 1, l, l]"""
+    with torch.inference_mode(False):
+        r = torch.arange(length, dtype=torch.float32, device=device)
+        diff = torch.unsqueeze(r, 0) - torch.unsqueeze(r, 1)
+        return torch.unsqueeze(torch.unsqueeze(-torch.log1p(torch.abs(diff)), 0), 0)
+
+
 class MultiHeadAttention(nn.Module):
     def __init__(
         self,
@@ -223,6 +275,113 @@ class MultiHeadAttention(nn.Module):
         return x
 
     def attention(self, query, key, value, mask=None):
+        if torch.jit.is_tracing() or torch.onnx.is_in_onnx_export():
+            # Exported graphs must work for any length, so they can't use
+            # tensors cached for the example input's length.
+            return self._attention_reference(query, key, value, mask=mask)
+
+        # reshape [b, d, t] -> [b, n_h, t, d_k]
+        b, d, t_s, t_t = (key.size(0), key.size(1), key.size(2), query.size(2))
+        query = query.view(b, self.n_heads, self.k_channels, t_t).transpose(2, 3)
+        key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
+        value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
+
+        if self.window_size is not None:
+            assert (
+                t_s == t_t
+            ), "Relative attention is only available for self-attention."
+        if self.proximal_bias:
+            assert t_s == t_t, "Proximal bias is only available for self-attention."
+
+        masked = None
+        if mask is not None:
+            masked = mask == 0
+            if self.block_length is not None:
+                assert (
+                    t_s == t_t
+                ), "Local attention is only available for self-attention."
+                masked = masked | _block_mask(t_s, self.block_length, query.device)
+
+        if (self.window_size is None) and _HAS_SDPA:
+            # Attention weights are never materialized.
+            #
+            # Masked scores get -1e4 added instead of replaced, which only
+            # changes the output of queries whose keys are all masked (padding).
+            attn_bias = query.new_zeros((1, 1, t_t, t_s))
+            if self.proximal_bias:
+                attn_bias = attn_bias + _proximal_bias(t_s, query.device).type_as(
+                    attn_bias
+                )
+
+            if masked is not None:
+                attn_bias = attn_bias.masked_fill(masked, -1e4)
+
+            output = F.scaled_dot_product_attention(
+                query,
+                key,
+                value,
+                attn_mask=attn_bias,
+                dropout_p=self.p_dropout if self.training else 0.0,
+            )
+            p_attn = None
+        else:
+            query = query / math.sqrt(self.k_channels)
+            scores = torch.matmul(query, key.transpose(-2, -1))
+            if self.window_size is not None:
+                scores = scores + self._relative_key_bias(query, t_s)
+            if self.proximal_bias:
+                scores = scores + _proximal_bias(t_s, query.device).type_as(scores)
+            if masked is not None:
+                scores = scores.masked_fill(masked, -1e4)
+
+            p_attn = F.softmax(scores, dim=-1)  # [b, n_h, t_t, t_s]
+            p_attn = self.drop(p_attn)
+            output = torch.matmul(p_attn, value)
+            if self.window_size is not None:
+                output = output + self._relative_value_output(p_attn, t_s)
+
+        output = (
+            output.transpose(2, 3).contiguous().view(b, d, t_t)
+        )  # [b, n_h, t_t, d_k] -> [b, d, t_t]
+        return output, p_attn
+
+    def _relative_key_bias(self, query, length: int):
+        """
+        Scores of queries against relative key embeddings within the window.
+
+        query: [b, h, l, d]
+        ret: [b, h, l, l]
+        """
+        key_index, key_is_valid, _, _ = _relative_indexes(
+            length, self.window_size, query.device
+        )
+
+        # [b, h, l, 2 * window + 1]
+        rel_logits = self._matmul_with_relative_keys(query, self.emb_rel_k)
+        bias = torch.gather(
+            rel_logits, -1, key_index.expand(query.size(0), query.size(1), -1, -1)
+        )
+        return bias.masked_fill(~key_is_valid, 0)
+
+    def _relative_value_output(self, p_attn, length: int):
+        """
+        Attention weights applied to relative value embeddings within the window.
+
+        p_attn: [b, h, l, l]
+        ret: [b, h, l, d]
+        """
+        _, _, band_index, band_is_valid = _relative_indexes(
+            length, self.window_size, p_attn.device
+        )
+
+        # Weight of each relative position: [b, h, l, 2 * window + 1]
+        relative_weights = torch.gather(
+            p_attn, -1, band_index.expand(p_attn.size(0), p_attn.size(1), -1, -1)
+        ).masked_fill(~band_is_valid, 0)
+
+        return self._matmul_with_relative_values(relative_weights, self.emb_rel_v)
+
+    def _attention_reference(self, query, key, value, mask=None):
         # reshape [b, d, t] -> [b, n_h, t, d_k]
         b, d, t_s, t_t = (key.size(0), key.size(1), key.size(2), query.size(2))
         query = query.view(b, self.n_heads, self.k_channels, t_t).transpose(2, 3)
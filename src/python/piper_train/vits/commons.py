@@ -129,6 +129,136 @@ def generate_path(duration, mask):
     return path
 
 
+def duration_indexes(duration, t_y: int):
+    """
+    Index of the input frame used by each output frame.
+
+    duration: [b, 1, t_x] (whole numbers, 0 for padding)
+    ret: indexes [b, t_y], and is_valid [b, t_y] (False past total duration)
+    """
+    cum_duration = torch.cumsum(duration.squeeze(1), -1)  # [b, t_x]
+    frames = torch.arange(t_y, dtype=cum_duration.dtype, device=duration.device)
+
+    if torch.onnx.is_in_onnx_export():
+        # searchsorted is not available in ONNX
+        indexes = _duration_indexes_scatter(duration.squeeze(1), cum_duration, t_y)
+    else:
+        indexes = torch.searchsorted(
+            cum_duration,
+            frames.unsqueeze(0).expand(cum_duration.size(0), -1).contiguous(),
+            right=True,
+        )
+
+    is_valid = frames.unsqueeze(0) < cum_duration[:, -1:]
+    indexes = indexes.clamp(max=cum_duration.size(1) - 1)
+
+    return indexes, is_valid
+
+
+def _duration_indexes_scatter(duration, cum_duration, t_y: int):
+    """
+    Same indexes as searchsorted in duration_indexes (for valid frames), using
+    only scatter, gather, and cumsum on [b, t_x] and [b, t_y] tensors.
+
+    Frames are first mapped to their rank among the inputs with a non-zero
+    duration, whose start frames are unique. Inputs with zero duration that
+    come before each of those are then added back.
+
+    duration: [b, t_x]
+    cum_duration: [b, t_x]
+    ret: indexes [b, t_y]
+    """
+    batch_size, t_x = duration.shape
+    duration = duration.long()
+    cum_duration = cum_duration.long()
+    is_nonzero = duration > 0
+
+    # Rank of each input among the non-zero ones (only used where non-zero)
+    nonzero_rank = torch.cumsum(is_nonzero.long(), -1) - 1
+
+    # Zero-duration inputs before each non-zero input, by rank.
+    # Zero-duration inputs are scattered into an extra column that's dropped.
+    input_index = torch.arange(t_x, device=duration.device).unsqueeze(0)
+    rank_index = torch.where(is_nonzero, nonzero_rank, torch.full_like(duration, t_x))
+    zeros_before = torch.zeros(
+        (batch_size, t_x + 1), dtype=torch.long, device=duration.device
+    ).scatter(1, rank_index, (input_index - nonzero_rank).expand(batch_size, -1))
+
+    # Mark the start frame of each non-zero input, then count them per frame
+    start_index = torch.where(
+        is_nonzero,
+        (cum_duration - duration).clamp(max=t_y),
+        torch.full_like(duration, t_y),
+    )
+    starts = torch.zeros(
+        (batch_size, t_y + 1), dtype=torch.long, device=duration.device
+    ).scatter(1, start_index, is_nonzero.long())
+    frame_rank = (torch.cumsum(starts[:, :t_y], -1) - 1).clamp(min=0)
+
+    return frame_rank + torch.gather(zeros_before, 1, frame_rank)
+
+
+def expand_by_duration(x, duration, t_y: int):
+    """
+    Repeat each frame of x by its duration.
+
+    Same as multiplying by generate_path(duration, mask), without building
+    the [b, 1, t_y, t_x] path.
+
+    x: [b, d, t_x]
+    duration: [b, 1, t_x]
+    ret: [b, d, t_y]
+    """
+    indexes, is_valid = duration_indexes(duration, t_y)
+    x_expanded = torch.gather(x, 2, indexes.unsqueeze(1).expand(-1, x.size(1), -1))
+    return x_expanded * is_valid.unsqueeze(1).type_as(x)
+
+
+# Prime modulus and offsets of seeded_randn_like's hash
+_NOISE_MODULUS = 2147483647
+_NOISE_ROUND_OFFSETS = (1013904223, 1664525, 22695477, 1103515245)
+_NOISE_MAX_FRAMES = 1 << 20
+
+
+def seeded_randn_like(x, seed, stream: int = 0):
+    """
+    Standard normal noise determined by a seed, usable in exported graphs.
+
+    Each element's value only depends on (seed, stream, channel, frame), so
+    an item gets the same noise alone or in a padded batch. Uses integer
+    arithmetic that is exact in ONNX Runtime, so the same seed gives the same
+    audio on every run.
+
+    x: [b, c, t]
+    seed: [b] or [1] (int64)
+    ret: [b, c, t] with x's dtype
+    """
+    _, channels, frames = x.shape
+    modulus = _NOISE_MODULUS
+
+    channel_idx = torch.arange(channels, dtype=torch.long, device=x.device)
+    frame_idx = torch.arange(frames, dtype=torch.long, device=x.device)
+    counter = (channel_idx.view(1, -1, 1) * _NOISE_MAX_FRAMES) + frame_idx.view(
+        1, 1, -1
+    )
+    seed = torch.remainder(seed.long().view(-1, 1, 1), modulus) * 2 + stream
+
+    # Squaring mod a prime mixes nonlinearly, so neighboring elements are
+    # uncorrelated.
+    h = torch.remainder(counter * 48271 + seed, modulus)
+    hashes = []
+    for offset in _NOISE_ROUND_OFFSETS:
+        h = torch.remainder(h * h + offset, modulus)
+        hashes.append(h)
+
+    # Box-Muller transform of two uniforms in (0, 1)
+    u1 = (hashes[-2].float() + 0.5) / modulus
+    u2 = (hashes[-1].float() + 0.5) / modulus
+    noise = torch.sqrt(-2.0 * torch.log(u1)) * torch.cos((2.0 * math.pi) * u2)
+
+    return noise.to(x.dtype)
+
+
 def clip_grad_value_(parameters, clip_value, norm_type=2):
     if isinstance(parameters, torch.Tensor):
         parameters = [parameters]
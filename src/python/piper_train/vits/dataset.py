@@ -1,23 +1,22 @@
-import json
+import inspect
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import torch
 from torch import FloatTensor, LongTensor
+from torch.nn import functional as F
+from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import Dataset
 
-_LOGGER = logging.getLogger("vits.dataset")
+from .dataset_index import DatasetIndex
 
+_LOGGER = logging.getLogger("vits.dataset")
 
-@dataclass
-class Utterance:
-    phoneme_ids: List[int]
-    audio_norm_path: Path
-    audio_spec_path: Path
-    speaker_id: Optional[int] = None
-    text: Optional[str] = None
+# torch.load(mmap=True) was added in torch 2.1
+_TORCH_LOAD_HAS_MMAP = "mmap" in inspect.signature(torch.load).parameters
 
 
 @dataclass
@@ -27,6 +26,8 @@ class UtteranceTensors:
     audio_norm: FloatTensor
     speaker_id: Optional[LongTensor] = None
     text: Optional[str] = None
+    segment_start: Optional[int] = None
+    """Start frame of audio_norm if it's only a segment of the audio"""
 
     @property
     def spec_length(self) -> int:
@@ -42,6 +43,18 @@ class Batch:
     audios: FloatTensor
     audio_lengths: LongTensor
     speaker_ids: Optional[LongTensor] = None
+    segment_starts: Optional[LongTensor] = None
+
+    def pin_memory(self) -> "Batch":
+        """Called by DataLoader when pin_memory=True."""
+        pinned_values = {}
+        for field in fields(self):
+            value = getattr(self, field.name)
+            pinned_values[field.name] = (
+                value.pin_memory() if value is not None else None
+            )
+
+        return Batch(**pinned_values)
 
 
 class PiperDataset(Dataset):
@@ -54,154 +67,185 @@ class PiperDataset(Dataset):
     * text (optional)
     * phonemes (optional)
     * audio_path (optional)
+
+    Each dataset file is compiled into a memory-mapped DatasetIndex (see
+    dataset_index.py). Only phoneme ids, speaker ids, and line offsets are kept
+    in memory; the rest of an utterance is parsed when it is requested.
+
+    If segment_size is set, a random segment of each utterance is chosen
+    up front (like rand_slice_segments in the model) and only segment_size
+    samples of audio are loaded, starting at segment_start * hop_length.
     """
 
     def __init__(
         self,
         dataset_paths: List[Union[str, Path]],
         max_phoneme_ids: Optional[int] = None,
+        segment_size: Optional[int] = None,
+        hop_length: int = 256,
     ):
-        self.utterances: List[Utterance] = []
+        self.segment_size = segment_size
+        self.hop_length = hop_length
+        self.shards: List[DatasetIndex] = []
+        shard_utt_ids: List[np.ndarray] = []
 
         for dataset_path in dataset_paths:
             dataset_path = Path(dataset_path)
             _LOGGER.debug("Loading dataset: %s", dataset_path)
-            self.utterances.extend(
-                PiperDataset.load_dataset(dataset_path, max_phoneme_ids=max_phoneme_ids)
-            )
+            shard = DatasetIndex.load(dataset_path)
+            utt_ids = np.arange(len(shard), dtype=np.int64)
 
-    def __len__(self):
-        return len(self.utterances)
+            if max_phoneme_ids is not None:
+                utt_ids = utt_ids[shard.phoneme_lengths <= max_phoneme_ids]
+                num_skipped = len(shard) - len(utt_ids)
+                if num_skipped > 0:
+                    _LOGGER.warning("Skipped %s utterance(s)", num_skipped)
 
-    def __getitem__(self, idx) -> UtteranceTensors:
-        utt = self.utterances[idx]
-        return UtteranceTensors(
-            phoneme_ids=LongTensor(utt.phoneme_ids),
-            audio_norm=torch.load(utt.audio_norm_path),
-            spectrogram=torch.load(utt.audio_spec_path),
-            speaker_id=LongTensor([utt.speaker_id])
-            if utt.speaker_id is not None
-            else None,
-            text=utt.text,
-        )
+            self.shards.append(shard)
+            shard_utt_ids.append(utt_ids)
 
-    @staticmethod
-    def load_dataset(
-        dataset_path: Path,
-        max_phoneme_ids: Optional[int] = None,
-    ) -> Iterable[Utterance]:
-        num_skipped = 0
-
-        with open(dataset_path, "r", encoding="utf-8") as dataset_file:
-            for line_idx, line in enumerate(dataset_file):
-                line = line.strip()
-                if not line:
-                    continue
-
-                try:
-                    utt = PiperDataset.load_utterance(line)
-                    if (max_phoneme_ids is None) or (
-                        len(utt.phoneme_ids) <= max_phoneme_ids
-                    ):
-                        yield utt
-                    else:
-                        num_skipped += 1
-                except Exception:
-                    _LOGGER.exception(
-                        "Error on line %s of %s: %s",
-                        line_idx + 1,
-                        dataset_path,
-                        line,
-                    )
-
-        if num_skipped > 0:
-            _LOGGER.warning("Skipped %s utterance(s)", num_skipped)
-
-    @staticmethod
-    def load_utterance(line: str) -> Utterance:
-        utt_dict = json.loads(line)
-        return Utterance(
-            phoneme_ids=utt_dict["phoneme_ids"],
-            audio_norm_path=Path(utt_dict["audio_norm_path"]),
-            audio_spec_path=Path(utt_dict["audio_spec_path"]),
-            speaker_id=utt_dict.get("speaker_id"),
-            text=utt_dict.get("text"),
+        # Dataset index -> (shard, utterance in shard)
+        self.shard_offsets = np.cumsum(
+            [0] + [len(utt_ids) for utt_ids in shard_utt_ids], dtype=np.int64
+        )
+        self.utt_ids = (
+            np.concatenate(shard_utt_ids)
+            if shard_utt_ids
+            else np.zeros(0, dtype=np.int64)
         )
 
+    def __len__(self):
+        return len(self.utt_ids)
 
-class UtteranceCollate:
-    def __init__(self, is_multispeaker: bool, segment_size: int):
-        self.is_multispeaker = is_multispeaker
-        self.segment_size = segment_size
+    @property
+    def spec_lengths(self) -> np.ndarray:
+        """Number of spectrogram frames for each utterance in the dataset."""
+        return np.concatenate(
+            [
+                shard.spec_lengths[self.utt_ids[start:end]]
+                for shard, start, end in zip(
+                    self.shards, self.shard_offsets[:-1], self.shard_offsets[1:]
+                )
+            ]
+            + [np.zeros(0, dtype=np.int32)]
+        )
 
-    def __call__(self, utterances: Sequence[UtteranceTensors]) -> Batch:
-        num_utterances = len(utterances)
-        assert num_utterances > 0, "No utterances"
+    def locate(self, idx: int) -> Tuple[DatasetIndex, int]:
+        """Get shard and utterance index within shard for a dataset index."""
+        shard_idx = int(np.searchsorted(self.shard_offsets, idx, side="right")) - 1
+        return self.shards[shard_idx], int(self.utt_ids[idx])
 
-        max_phonemes_length = 0
-        max_spec_length = 0
-        max_audio_length = 0
+    def __getitem__(self, idx) -> UtteranceTensors:
+        shard, utt_idx = self.locate(idx)
+        utt_dict = shard.read_utterance(utt_idx)
+        speaker_id = shard.speaker_id(utt_idx)
+
+        spectrogram = torch.load(utt_dict["audio_spec_path"])
+
+        segment_start: Optional[int] = None
+        if self.segment_size is None:
+            audio_norm = torch.load(utt_dict["audio_norm_path"])
+        else:
+            segment_frames = self.segment_size // self.hop_length
+            max_segment_start = max(0, spectrogram.size(1) - segment_frames)
+            segment_start = int(torch.randint(0, max_segment_start + 1, ()))
+            audio_norm = load_audio_segment(
+                utt_dict["audio_norm_path"],
+                segment_start * self.hop_length,
+                self.segment_size,
+            )
 
-        num_mels = 0
+        return UtteranceTensors(
+            phoneme_ids=torch.from_numpy(shard.phoneme_ids(utt_idx).astype(np.int64)),
+            audio_norm=audio_norm,
+            spectrogram=spectrogram,
+            speaker_id=LongTensor([speaker_id]) if speaker_id is not None else None,
+            text=utt_dict.get("text"),
+            segment_start=segment_start,
+        )
 
-        # Determine lengths
-        for utt_idx, utt in enumerate(utterances):
-            assert utt.spectrogram is not None
-            assert utt.audio_norm is not None
 
-            phoneme_length = utt.phoneme_ids.size(0)
-            spec_length = utt.spectrogram.size(1)
-            audio_length = utt.audio_norm.size(1)
+def load_audio_segment(
+    audio_norm_path: Union[str, Path], start: int, length: int
+) -> FloatTensor:
+    """Load samples [start, start + length) of cached normalized audio.
 
-            max_phonemes_length = max(max_phonemes_length, phoneme_length)
-            max_spec_length = max(max_spec_length, spec_length)
-            max_audio_length = max(max_audio_length, audio_length)
+    The file is memory-mapped when torch supports it, so only the segment is
+    read from disk.
+    """
+    if _TORCH_LOAD_HAS_MMAP:
+        # mmap only accepts a file name, not a Path
+        audio_norm = torch.load(str(audio_norm_path), mmap=True)
+    else:
+        audio_norm = torch.load(audio_norm_path)
 
-            num_mels = utt.spectrogram.size(0)
-            if self.is_multispeaker:
-                assert utt.speaker_id is not None, "Missing speaker id"
+    # Copy so the rest of the audio isn't kept alive
+    return audio_norm[:, start : start + length].clone()
 
-        # Audio cannot be smaller than segment size (8192)
-        max_audio_length = max(max_audio_length, self.segment_size)
 
-        # Create padded tensors
-        phonemes_padded = LongTensor(num_utterances, max_phonemes_length)
-        spec_padded = FloatTensor(num_utterances, num_mels, max_spec_length)
-        audio_padded = FloatTensor(num_utterances, 1, max_audio_length)
+class UtteranceCollate:
+    """
+    Pads utterances into a Batch, sorted by decreasing spectrogram length.
 
-        phonemes_padded.zero_()
-        spec_padded.zero_()
-        audio_padded.zero_()
+    Phoneme ids and audio are padded with pad_sequence; spectrograms are
+    copied into a single zero-initialized tensor. Pinning is left to the
+    DataLoader (pin_memory=True), which pins batches in a separate thread.
 
-        phoneme_lengths = LongTensor(num_utterances)
-        spec_lengths = LongTensor(num_utterances)
-        audio_lengths = LongTensor(num_utterances)
+    Batches are not written into reused buffers: with worker processes, a
+    batch's storage is moved into shared memory and handed to the main
+    process, which may still be holding it when the next batch is collated.
+    """
 
-        speaker_ids: Optional[LongTensor] = None
-        if self.is_multispeaker:
-            speaker_ids = LongTensor(num_utterances)
+    def __init__(self, is_multispeaker: bool, segment_size: int):
+        self.is_multispeaker = is_multispeaker
+        self.segment_size = segment_size
+
+    def __call__(self, utterances: Sequence[UtteranceTensors]) -> Batch:
+        assert len(utterances) > 0, "No utterances"
 
         # Sort by decreasing spectrogram length
         sorted_utterances = sorted(
             utterances, key=lambda u: u.spectrogram.size(1), reverse=True
         )
-        for utt_idx, utt in enumerate(sorted_utterances):
-            phoneme_length = utt.phoneme_ids.size(0)
-            spec_length = utt.spectrogram.size(1)
-            audio_length = utt.audio_norm.size(1)
 
-            phonemes_padded[utt_idx, :phoneme_length] = utt.phoneme_ids
-            phoneme_lengths[utt_idx] = phoneme_length
+        phoneme_ids = [utt.phoneme_ids for utt in sorted_utterances]
+        spectrograms = [utt.spectrogram for utt in sorted_utterances]
+        audios = [utt.audio_norm.view(-1) for utt in sorted_utterances]
+
+        phoneme_lengths = LongTensor([ids.size(0) for ids in phoneme_ids])
+        spec_lengths = LongTensor([spec.size(1) for spec in spectrograms])
+        audio_lengths = LongTensor([audio.size(0) for audio in audios])
+
+        phonemes_padded = pad_sequence(phoneme_ids, batch_first=True)
+
+        # Audio cannot be smaller than segment size (8192)
+        audio_padded = pad_sequence(audios, batch_first=True)
+        if audio_padded.size(1) < self.segment_size:
+            audio_padded = F.pad(
+                audio_padded, (0, self.segment_size - audio_padded.size(1))
+            )
 
-            spec_padded[utt_idx, :, :spec_length] = utt.spectrogram
-            spec_lengths[utt_idx] = spec_length
+        audio_padded = audio_padded.unsqueeze(1)
 
-            audio_padded[utt_idx, :, :audio_length] = utt.audio_norm
-            audio_lengths[utt_idx] = audio_length
+        # Longest spectrogram is first
+        spec_padded = spectrograms[0].new_zeros(
+            (len(spectrograms), spectrograms[0].size(0), spectrograms[0].size(1))
+        )
+        for utt_idx, spec in enumerate(spectrograms):
+            spec_padded[utt_idx, :, : spec.size(1)] = spec
 
-            if utt.speaker_id is not None:
-                assert speaker_ids is not None
-                speaker_ids[utt_idx] = utt.speaker_id
+        speaker_ids: Optional[LongTensor] = None
+        if self.is_multispeaker:
+            assert all(
+                utt.speaker_id is not None for utt in sorted_utterances
+            ), "Missing speaker id"
+            speaker_ids = torch.cat([utt.speaker_id for utt in sorted_utterances])
+
+        segment_starts: Optional[LongTensor] = None
+        if sorted_utterances[0].segment_start is not None:
+            segment_starts = LongTensor(
+                [utt.segment_start for utt in sorted_utterances]
+            )
 
         return Batch(
             phoneme_ids=phonemes_padded,
@@ -211,4 +255,5 @@ class UtteranceCollate:
             audios=audio_padded,
             audio_lengths=audio_lengths,
             speaker_ids=speaker_ids,
+            segment_starts=segment_starts,
         )
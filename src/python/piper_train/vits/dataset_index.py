@@ -0,0 +1,276 @@
+"""Compiled, memory-mapped index over a dataset.jsonl file"""
+import json
+import logging
+import os
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Union
+
+import numpy as np
+import torch
+
+_LOGGER = logging.getLogger("vits.dataset_index")
+
+INDEX_VERSION = 2
+NO_SPEAKER = -1
+
+_ARRAY_NAMES = (
+    "phoneme_ids",
+    "phoneme_offsets",
+    "speaker_ids",
+    "spec_lengths",
+    "line_offsets",
+)
+
+
+class DatasetIndex:
+    """
+    Columnar index of a dataset.jsonl file.
+
+    * phoneme_ids - phoneme ids of all utterances in one flat int32 array
+    * phoneme_offsets - start of each utterance in phoneme_ids (int64, N + 1)
+    * speaker_ids - speaker id of each utterance (int32, -1 if missing)
+    * spec_lengths - number of spectrogram frames of each utterance (int32)
+    * line_offsets - byte offset of each utterance's line in dataset.jsonl
+
+    The index is built once next to the dataset and memory-mapped, so
+    DataLoader workers share the same pages instead of copying Python objects.
+    Everything else (audio paths, text) is parsed lazily from the source line.
+    """
+
+    def __init__(self, dataset_path: Union[str, Path], index_dir: Union[str, Path]):
+        self.dataset_path = Path(dataset_path)
+        self.index_dir = Path(index_dir)
+
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+
+        # Raw file descriptor of dataset.jsonl, read with os.pread.
+        # Forked DataLoader workers inherit it, and since pread doesn't use the
+        # shared file offset, their reads can't interfere.
+        self._dataset_fd: Optional[int] = None
+        self._dataset_size = 0
+
+        # Without os.pread (Windows), a file object is used with seek/read
+        # instead. It's reopened in each process, so the offset isn't shared.
+        self._dataset_file: Optional[BinaryIO] = None
+        self._dataset_file_pid: Optional[int] = None
+
+    @staticmethod
+    def default_index_dir(dataset_path: Union[str, Path]) -> Path:
+        return Path(dataset_path).with_suffix(".index")
+
+    @staticmethod
+    def load(
+        dataset_path: Union[str, Path],
+        index_dir: Optional[Union[str, Path]] = None,
+        rebuild: bool = False,
+    ) -> "DatasetIndex":
+        """Load index for dataset, building it first if missing or stale."""
+        dataset_path = Path(dataset_path)
+        if index_dir is None:
+            index_dir = DatasetIndex.default_index_dir(dataset_path)
+
+        index = DatasetIndex(dataset_path, index_dir)
+        if rebuild or (not index.is_current()):
+            index.build()
+
+        return index
+
+    def is_current(self) -> bool:
+        """True if index exists and matches the dataset file."""
+        meta_path = self.index_dir / "index.json"
+        if not meta_path.is_file():
+            return False
+
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except Exception:
+            _LOGGER.exception("Failed to read index metadata: %s", meta_path)
+            return False
+
+        return meta == self._source_meta(meta.get("num_utterances", 0))
+
+    def build(self) -> None:
+        """Compile dataset.jsonl into columnar arrays."""
+        _LOGGER.debug("Building index for %s in %s", self.dataset_path, self.index_dir)
+
+        phoneme_ids = array("i")
+        phoneme_offsets = array("q", [0])
+        speaker_ids = array("i")
+        spec_lengths = array("i")
+        line_offsets = array("q")
+
+        with open(self.dataset_path, "rb") as dataset_file:
+            line_offset = 0
+            for line_idx, line_bytes in enumerate(dataset_file):
+                next_offset = line_offset + len(line_bytes)
+                line = line_bytes.strip()
+                if line:
+                    try:
+                        utt_dict = json.loads(line)
+                        utt_phoneme_ids = utt_dict["phoneme_ids"]
+                        speaker_id = utt_dict.get("speaker_id")
+                        spec_length = self._get_spec_length(utt_dict)
+
+                        phoneme_ids.extend(utt_phoneme_ids)
+                        phoneme_offsets.append(len(phoneme_ids))
+                        speaker_ids.append(
+                            NO_SPEAKER if speaker_id is None else int(speaker_id)
+                        )
+                        spec_lengths.append(spec_length)
+                        line_offsets.append(line_offset)
+                    except Exception:
+                        _LOGGER.exception(
+                            "Error on line %s of %s: %s",
+                            line_idx + 1,
+                            self.dataset_path,
+                            line,
+                        )
+
+                line_offset = next_offset
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "phoneme_ids": np.frombuffer(phoneme_ids, dtype=np.int32),
+            "phoneme_offsets": np.frombuffer(phoneme_offsets, dtype=np.int64),
+            "speaker_ids": np.frombuffer(speaker_ids, dtype=np.int32),
+            "spec_lengths": np.frombuffer(spec_lengths, dtype=np.int32),
+            "line_offsets": np.frombuffer(line_offsets, dtype=np.int64),
+        }
+
+        # Write to temporary files first so concurrent readers never see a
+        # partial index. Metadata is written last and marks the index valid.
+        for name, values in arrays.items():
+            array_path = self.index_dir / f"{name}.npy"
+            temp_path = array_path.with_suffix(f".tmp{os.getpid()}.npy")
+            np.save(temp_path, values)
+            os.replace(temp_path, array_path)
+
+        meta_path = self.index_dir / "index.json"
+        temp_meta_path = meta_path.with_suffix(f".tmp{os.getpid()}")
+        with open(temp_meta_path, "w", encoding="utf-8") as meta_file:
+            json.dump(self._source_meta(len(line_offsets)), meta_file, indent=4)
+
+        os.replace(temp_meta_path, meta_path)
+        self.close()
+
+        _LOGGER.debug(
+            "Indexed %s utterance(s) with %s phoneme id(s)",
+            len(line_offsets),
+            len(phoneme_ids),
+        )
+
+    @staticmethod
+    def _get_spec_length(utt_dict: Dict[str, Any]) -> int:
+        spec_length = utt_dict.get("audio_spec_length")
+        if spec_length is not None:
+            return int(spec_length)
+
+        # Datasets from older versions of preprocess don't record the length
+        audio_spec_path = utt_dict.get("audio_spec_path")
+        if audio_spec_path:
+            return torch.load(audio_spec_path).size(1)
+
+        return 0
+
+    def _source_meta(self, num_utterances: int) -> Dict[str, Any]:
+        source_stat = self.dataset_path.stat()
+        return {
+            "version": INDEX_VERSION,
+            "source_size": source_stat.st_size,
+            "source_mtime_ns": source_stat.st_mtime_ns,
+            "num_utterances": num_utterances,
+        }
+
+    # -------------------------------------------------------------------------
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(self.index_dir / f"{name}.npy", mmap_mode="r")
+                for name in _ARRAY_NAMES
+            }
+
+        return self._arrays
+
+    @property
+    def phoneme_lengths(self) -> np.ndarray:
+        return np.diff(self.arrays["phoneme_offsets"])
+
+    @property
+    def speaker_ids(self) -> np.ndarray:
+        return self.arrays["speaker_ids"]
+
+    @property
+    def spec_lengths(self) -> np.ndarray:
+        return self.arrays["spec_lengths"]
+
+    def __len__(self) -> int:
+        return len(self.arrays["line_offsets"])
+
+    def phoneme_ids(self, idx: int) -> np.ndarray:
+        offsets = self.arrays["phoneme_offsets"]
+        return self.arrays["phoneme_ids"][offsets[idx] : offsets[idx + 1]]
+
+    def speaker_id(self, idx: int) -> Optional[int]:
+        speaker_id = int(self.speaker_ids[idx])
+        return None if speaker_id == NO_SPEAKER else speaker_id
+
+    def read_utterance(self, idx: int) -> Dict[str, Any]:
+        """Parse the original JSON line of an utterance."""
+        line_offsets = self.arrays["line_offsets"]
+        line_offset = int(line_offsets[idx])
+        if (idx + 1) < len(line_offsets):
+            line_end: Optional[int] = int(line_offsets[idx + 1])
+        else:
+            line_end = None
+
+        # May include blank lines after the utterance
+        line_bytes = self._read_dataset(line_offset, line_end)
+        return json.loads(line_bytes.split(b"\n", maxsplit=1)[0])
+
+    def _read_dataset(self, start: int, end: Optional[int]) -> bytes:
+        """Read bytes [start, end) of dataset.jsonl (end=None for end of file)."""
+        if hasattr(os, "pread"):
+            if self._dataset_fd is None:
+                self._dataset_fd = os.open(self.dataset_path, os.O_RDONLY)
+                self._dataset_size = os.fstat(self._dataset_fd).st_size
+
+            if end is None:
+                end = self._dataset_size
+
+            return os.pread(self._dataset_fd, end - start, start)
+
+        if (self._dataset_file is None) or (self._dataset_file_pid != os.getpid()):
+            # Not opened yet, or opened by the parent of this process
+            self._dataset_file = open(  # pylint: disable=consider-using-with
+                self.dataset_path, "rb"
+            )
+            self._dataset_file_pid = os.getpid()
+
+        self._dataset_file.seek(start)
+        return self._dataset_file.read(-1 if end is None else end - start)
+
+    def close(self) -> None:
+        if self._dataset_fd is not None:
+            os.close(self._dataset_fd)
+
+        if (self._dataset_file is not None) and (self._dataset_file_pid == os.getpid()):
+            self._dataset_file.close()
+
+        self._dataset_fd = None
+        self._dataset_file = None
+        self._dataset_file_pid = None
+        self._arrays = None
+
+    def __getstate__(self):
+        # Workers re-open the memory maps and file themselves instead of
+        # receiving pickled copies.
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        state["_dataset_fd"] = None
+        state["_dataset_file"] = None
+        state["_dataset_file_pid"] = None
+        return state
@@ -1,22 +1,49 @@
+import inspect
 import logging
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import pytorch_lightning as pl
 import torch
 from torch import autocast
 from torch.nn import functional as F
-from torch.utils.data import DataLoader, Dataset, random_split
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import DataLoader, Dataset, Subset, random_split
 
 from .commons import slice_segments
 from .dataset import Batch, PiperDataset, UtteranceCollate
 from .losses import discriminator_loss, feature_loss, generator_loss, kl_loss
-from .mel_processing import mel_spectrogram_torch, spec_to_mel_torch
+from .mel_processing import MelSTFT
 from .models import MultiPeriodDiscriminator, SynthesizerTrn
+from .sampler import LengthBucketSampler
 
 _LOGGER = logging.getLogger("vits.lightning")
 
 
+@dataclass
+class GeneratorOutputs:
+    """Outputs of the generator needed for its loss"""
+
+    y: torch.Tensor
+    """Real audio segment"""
+
+    y_hat: torch.Tensor
+    """Generated audio segment"""
+
+    y_mel: torch.Tensor
+    y_hat_mel: torch.Tensor
+    l_length: torch.Tensor
+    z_p: torch.Tensor
+    logs_q: torch.Tensor
+    m_p: torch.Tensor
+    logs_p: torch.Tensor
+    z_mask: torch.Tensor
+
+    teacher_mel: Optional[torch.Tensor] = None
+    """Mel of the teacher's audio for the same segment (distillation only)"""
+
+
 class VitsModel(pl.LightningModule):
     def __init__(
         self,
@@ -62,6 +89,8 @@ class VitsModel(pl.LightningModule):
         betas: Tuple[float, float] = (0.8, 0.99),
         eps: float = 1e-9,
         batch_size: int = 1,
+        max_frames_per_batch: Optional[int] = None,
+        batches_per_bucket: int = 32,
         lr_decay: float = 0.999875,
         init_lr_ratio: float = 1.0,
         warmup_epochs: int = 0,
@@ -69,10 +98,19 @@ class VitsModel(pl.LightningModule):
         c_kl: float = 1.0,
         grad_clip: Optional[float] = None,
         num_workers: int = 1,
+        pin_memory: bool = False,
+        persistent_workers: bool = False,
         seed: int = 1234,
         num_test_examples: int = 5,
+        test_example_epochs: int = 1,
         validation_split: float = 0.1,
         max_phoneme_ids: Optional[int] = None,
+        load_audio_segments: bool = False,
+        compile_model: bool = False,
+        fused_optimizers: bool = False,
+        accumulate_grad_batches: int = 1,
+        teacher_checkpoint: Optional[Union[str, Path]] = None,
+        c_distill: float = 45.0,
         **kwargs,
     ):
         super().__init__()
@@ -107,6 +145,15 @@ class VitsModel(pl.LightningModule):
         self.model_d = MultiPeriodDiscriminator(
             use_spectral_norm=self.hparams.use_spectral_norm
         )
+        self.mel_stft = MelSTFT(
+            n_fft=self.hparams.filter_length,
+            num_mels=self.hparams.mel_channels,
+            sampling_rate=self.hparams.sample_rate,
+            hop_size=self.hparams.hop_length,
+            win_size=self.hparams.win_length,
+            fmin=self.hparams.mel_fmin,
+            fmax=self.hparams.mel_fmax,
+        )
 
         # Dataset splits
         self._train_dataset: Optional[Dataset] = None
@@ -114,9 +161,11 @@ class VitsModel(pl.LightningModule):
         self._test_dataset: Optional[Dataset] = None
         self._load_datasets(validation_split, num_test_examples, max_phoneme_ids)
 
-        # State kept between training optimizers
-        self._y = None
-        self._y_hat = None
+        # Both optimizers are stepped in training_step
+        self.automatic_optimization = False
+
+        # Loaded in on_fit_start when distilling
+        self._teacher_g: Optional[SynthesizerTrn] = None
 
     def _load_datasets(
         self,
@@ -129,7 +178,12 @@ class VitsModel(pl.LightningModule):
             return
 
         full_dataset = PiperDataset(
-            self.hparams.dataset, max_phoneme_ids=max_phoneme_ids
+            self.hparams.dataset,
+            max_phoneme_ids=max_phoneme_ids,
+            segment_size=(
+                self.hparams.segment_size if self.hparams.load_audio_segments else None
+            ),
+            hop_length=self.hparams.hop_length,
         )
         valid_set_size = int(len(full_dataset) * validation_split)
         train_set_size = len(full_dataset) - valid_set_size - num_test_examples
@@ -154,46 +208,104 @@ class VitsModel(pl.LightningModule):
         return audio
 
     def train_dataloader(self):
+        # Group utterances with similar spectrogram lengths to reduce padding
+        assert isinstance(self._train_dataset, Subset)
+        full_dataset = self._train_dataset.dataset
+        assert isinstance(full_dataset, PiperDataset)
+        batch_sampler = LengthBucketSampler(
+            full_dataset.spec_lengths[self._train_dataset.indices],
+            batch_size=self.hparams.batch_size,
+            max_frames=self.hparams.max_frames_per_batch,
+            batches_per_bucket=self.hparams.batches_per_bucket,
+            seed=self.hparams.seed,
+        )
+
         return DataLoader(
             self._train_dataset,
-            collate_fn=UtteranceCollate(
-                is_multispeaker=self.hparams.num_speakers > 1,
-                segment_size=self.hparams.segment_size,
-            ),
-            num_workers=self.hparams.num_workers,
-            batch_size=self.hparams.batch_size,
+            batch_sampler=batch_sampler,
+            **self._dataloader_kwargs(),
         )
 
     def val_dataloader(self):
         return DataLoader(
             self._val_dataset,
-            collate_fn=UtteranceCollate(
-                is_multispeaker=self.hparams.num_speakers > 1,
-                segment_size=self.hparams.segment_size,
-            ),
-            num_workers=self.hparams.num_workers,
             batch_size=self.hparams.batch_size,
+            **self._dataloader_kwargs(),
         )
 
     def test_dataloader(self):
         return DataLoader(
             self._test_dataset,
-            collate_fn=UtteranceCollate(
+            batch_size=self.hparams.batch_size,
+            **self._dataloader_kwargs(),
+        )
+
+    def _dataloader_kwargs(self) -> Dict[str, Any]:
+        return {
+            "collate_fn": UtteranceCollate(
                 is_multispeaker=self.hparams.num_speakers > 1,
                 segment_size=self.hparams.segment_size,
             ),
-            num_workers=self.hparams.num_workers,
-            batch_size=self.hparams.batch_size,
+            "num_workers": self.hparams.num_workers,
+            "pin_memory": self.hparams.pin_memory,
+            # Keep workers (and their open dataset files) between epochs
+            "persistent_workers": self.hparams.persistent_workers
+            and (self.hparams.num_workers > 0),
+        }
+
+    def training_step(self, batch: Batch, batch_idx: int):
+        opt_g, opt_d = self.optimizers()
+        accumulate_grad_batches = max(1, self.hparams.accumulate_grad_batches)
+        should_step = ((batch_idx + 1) % accumulate_grad_batches == 0) or (
+            (batch_idx + 1) == self.trainer.num_training_batches
+        )
+
+        gen_outputs = self.forward_generator(batch)
+
+        # Real audio only goes through the discriminators once. Its outputs
+        # are the same for both losses, since the discriminators aren't
+        # updated until after the generator step.
+        y_d_hat_r, fmap_r = self.model_d.discriminate(gen_outputs.y)
+
+        # Generator
+        self.toggle_optimizer(opt_g, 0)
+        loss_gen_all = self.compute_generator_loss(gen_outputs, fmap_r)
+        self.manual_backward(loss_gen_all / accumulate_grad_batches)
+        if should_step:
+            self._step_optimizer(opt_g)
+
+        self.untoggle_optimizer(0)
+
+        # Discriminator
+        self.toggle_optimizer(opt_d, 1)
+        loss_disc_all = self.compute_discriminator_loss(
+            y_d_hat_r, gen_outputs.y_hat.detach()
         )
+        self.manual_backward(loss_disc_all / accumulate_grad_batches)
+        if should_step:
+            self._step_optimizer(opt_d)
 
-    def training_step(self, batch: Batch, batch_idx: int, optimizer_idx: int):
-        if optimizer_idx == 0:
-            return self.training_step_g(batch)
+        self.untoggle_optimizer(1)
+
+        self.log("loss_gen_all", loss_gen_all)
+        self.log("loss_disc_all", loss_disc_all)
+
+    def _step_optimizer(self, optimizer):
+        if self.hparams.grad_clip is not None:
+            self.clip_gradients(
+                optimizer,
+                gradient_clip_val=self.hparams.grad_clip,
+                gradient_clip_algorithm="norm",
+            )
 
-        if optimizer_idx == 1:
-            return self.training_step_d(batch)
+        optimizer.step()
+        optimizer.zero_grad()
 
-    def training_step_g(self, batch: Batch):
+    def on_train_epoch_end(self):
+        for scheduler in self.lr_schedulers():
+            scheduler.step()
+
+    def forward_generator(self, batch: Batch) -> "GeneratorOutputs":
         x, x_lengths, y, _, spec, spec_lengths, speaker_ids = (
             batch.phoneme_ids,
             batch.phoneme_lengths,
@@ -211,113 +323,265 @@ class VitsModel(pl.LightningModule):
             _x_mask,
             z_mask,
             (_z, z_p, m_p, logs_p, _m_q, logs_q),
-        ) = self.model_g(x, x_lengths, spec, spec_lengths, speaker_ids)
-        self._y_hat = y_hat
-
-        mel = spec_to_mel_torch(
+        ) = self.model_g(
+            x,
+            x_lengths,
             spec,
-            self.hparams.filter_length,
-            self.hparams.mel_channels,
-            self.hparams.sample_rate,
-            self.hparams.mel_fmin,
-            self.hparams.mel_fmax,
-        )
-        y_mel = slice_segments(
-            mel,
-            ids_slice,
-            self.hparams.segment_size // self.hparams.hop_length,
+            spec_lengths,
+            speaker_ids,
+            ids_slice=batch.segment_starts,
         )
-        y_hat_mel = mel_spectrogram_torch(
-            y_hat.squeeze(1),
-            self.hparams.filter_length,
-            self.hparams.mel_channels,
-            self.hparams.sample_rate,
-            self.hparams.hop_length,
-            self.hparams.win_length,
-            self.hparams.mel_fmin,
-            self.hparams.mel_fmax,
+
+        with autocast(self.device.type, enabled=False):
+            # Mel is computed per frame, so only the sliced segment is converted.
+            # STFT is done in float32, even with mixed precision.
+            y_mel = self.mel_stft.spec_to_mel(
+                slice_segments(
+                    spec,
+                    ids_slice,
+                    self.hparams.segment_size // self.hparams.hop_length,
+                )
+            )
+            y_hat_mel = self.mel_stft(y_hat.squeeze(1).float())
+
+        teacher_mel: Optional[torch.Tensor] = None
+        if self._teacher_g is not None:
+            teacher_mel = self._teacher_mel(spec, spec_lengths, speaker_ids, ids_slice)
+
+        if batch.segment_starts is None:
+            y = slice_segments(
+                y,
+                ids_slice * self.hparams.hop_length,
+                self.hparams.segment_size,
+            )  # slice
+
+        return GeneratorOutputs(
+            y=y,
+            y_hat=y_hat,
+            y_mel=y_mel,
+            y_hat_mel=y_hat_mel,
+            l_length=l_length,
+            z_p=z_p,
+            logs_q=logs_q,
+            m_p=m_p,
+            logs_p=logs_p,
+            z_mask=z_mask,
+            teacher_mel=teacher_mel,
         )
-        y = slice_segments(
-            y,
-            ids_slice * self.hparams.hop_length,
-            self.hparams.segment_size,
-        )  # slice
 
-        # Save for training_step_d
-        self._y = y
+    def _teacher_mel(self, spec, spec_lengths, speaker_ids, ids_slice) -> torch.Tensor:
+        """Mel of the teacher's reconstruction of the same audio segment.
+
+        Only the teacher's posterior encoder and decoder are used, so the
+        student may have different channel sizes.
+        """
+        teacher_g = self._teacher_g
+        assert teacher_g is not None
+
+        with torch.no_grad():
+            g = None
+            if teacher_g.n_speakers > 1:
+                g = teacher_g.emb_g(speaker_ids).unsqueeze(-1)  # [b, h, 1]
+
+            z, _m_q, _logs_q, _y_mask = teacher_g.enc_q(spec, spec_lengths, g=g)
+            teacher_audio = teacher_g.dec(
+                slice_segments(
+                    z, ids_slice, self.hparams.segment_size // self.hparams.hop_length
+                ),
+                g=g,
+            )
+
+            with autocast(self.device.type, enabled=False):
+                return self.mel_stft(teacher_audio.squeeze(1).float())
 
-        _y_d_hat_r, y_d_hat_g, fmap_r, fmap_g = self.model_d(y, y_hat)
+    def compute_generator_loss(
+        self, gen_outputs: "GeneratorOutputs", fmap_r
+    ) -> torch.Tensor:
+        """Generator loss, given feature maps of the real audio"""
+        y_d_hat_g, fmap_g = self.model_d.discriminate(gen_outputs.y_hat)
 
         with autocast(self.device.type, enabled=False):
-            # Generator loss
-            loss_dur = torch.sum(l_length.float())
-            loss_mel = F.l1_loss(y_mel, y_hat_mel) * self.hparams.c_mel
-            loss_kl = kl_loss(z_p, logs_q, m_p, logs_p, z_mask) * self.hparams.c_kl
+            loss_dur = torch.sum(gen_outputs.l_length.float())
+            loss_mel = (
+                F.l1_loss(gen_outputs.y_mel, gen_outputs.y_hat_mel) * self.hparams.c_mel
+            )
+            loss_kl = (
+                kl_loss(
+                    gen_outputs.z_p,
+                    gen_outputs.logs_q,
+                    gen_outputs.m_p,
+                    gen_outputs.logs_p,
+                    gen_outputs.z_mask,
+                )
+                * self.hparams.c_kl
+            )
 
             loss_fm = feature_loss(fmap_r, fmap_g)
             loss_gen, _losses_gen = generator_loss(y_d_hat_g)
             loss_gen_all = loss_gen + loss_fm + loss_mel + loss_dur + loss_kl
 
-            self.log("loss_gen_all", loss_gen_all)
+            if gen_outputs.teacher_mel is not None:
+                loss_distill = (
+                    F.l1_loss(gen_outputs.teacher_mel, gen_outputs.y_hat_mel)
+                    * self.hparams.c_distill
+                )
+                loss_gen_all = loss_gen_all + loss_distill
 
             return loss_gen_all
 
-    def training_step_d(self, batch: Batch):
-        # From training_step_g
-        y = self._y
-        y_hat = self._y_hat
-        y_d_hat_r, y_d_hat_g, _, _ = self.model_d(y, y_hat.detach())
+    def compute_discriminator_loss(self, y_d_hat_r, y_hat) -> torch.Tensor:
+        """Discriminator loss, given outputs for the real audio"""
+        y_d_hat_g, _ = self.model_d.discriminate(y_hat)
 
         with autocast(self.device.type, enabled=False):
-            # Discriminator
             loss_disc, _losses_disc_r, _losses_disc_g = discriminator_loss(
                 y_d_hat_r, y_d_hat_g
             )
             loss_disc_all = loss_disc
 
-            self.log("loss_disc_all", loss_disc_all)
-
             return loss_disc_all
 
     def validation_step(self, batch: Batch, batch_idx: int):
-        val_loss = self.training_step_g(batch) + self.training_step_d(batch)
+        with torch.no_grad():
+            gen_outputs = self.forward_generator(batch)
+            y_d_hat_r, fmap_r = self.model_d.discriminate(gen_outputs.y)
+            val_loss = self.compute_generator_loss(
+                gen_outputs, fmap_r
+            ) + self.compute_discriminator_loss(y_d_hat_r, gen_outputs.y_hat)
+
         self.log("val_loss", val_loss)
 
-        # Generate audio examples
-        for utt_idx, test_utt in enumerate(self._test_dataset):
-            text = test_utt.phoneme_ids.unsqueeze(0).to(self.device)
-            text_lengths = torch.LongTensor([len(test_utt.phoneme_ids)]).to(self.device)
-            scales = [0.667, 1.0, 0.8]
-            sid = (
-                test_utt.speaker_id.to(self.device)
-                if test_utt.speaker_id is not None
-                else None
+        return val_loss
+
+    def on_validation_epoch_end(self):
+        if self.trainer.sanity_checking:
+            return
+
+        test_example_epochs = self.hparams.test_example_epochs
+        if (test_example_epochs <= 0) or (
+            (self.current_epoch + 1) % test_example_epochs != 0
+        ):
+            return
+
+        self._log_test_examples()
+
+    def _log_test_examples(self):
+        """Synthesize all test utterances in one batch and log the audio"""
+        if not self._test_dataset:
+            return
+
+        test_utts = list(self._test_dataset)
+        text = pad_sequence(
+            [test_utt.phoneme_ids for test_utt in test_utts], batch_first=True
+        ).to(self.device)
+        text_lengths = torch.LongTensor(
+            [len(test_utt.phoneme_ids) for test_utt in test_utts]
+        ).to(self.device)
+        sid = None
+        if self.hparams.num_speakers > 1:
+            sid = torch.cat([test_utt.speaker_id for test_utt in test_utts]).to(
+                self.device
             )
-            test_audio = self(text, text_lengths, scales, sid=sid).detach()
+
+        with torch.no_grad():
+            test_audios, _attn, y_mask, _ = self.model_g.infer(
+                text,
+                text_lengths,
+                sid=sid,
+                noise_scale=0.667,
+                length_scale=1.0,
+                noise_scale_w=0.8,
+            )
+
+        # Trim padding from each item
+        audio_lengths = y_mask.sum(dim=[1, 2]).long() * self.hparams.hop_length
+        test_audios = test_audios.detach().float().cpu()
+
+        for utt_idx, test_utt in enumerate(test_utts):
+            test_audio = test_audios[utt_idx, :, : audio_lengths[utt_idx]]
 
             # Scale to make louder in [-1, 1]
             test_audio = test_audio * (1.0 / max(0.01, abs(test_audio.max())))
 
             tag = test_utt.text or str(utt_idx)
             self.logger.experiment.add_audio(
-                tag, test_audio, sample_rate=self.hparams.sample_rate
+                tag,
+                test_audio,
+                global_step=self.global_step,
+                sample_rate=self.hparams.sample_rate,
             )
 
-        return val_loss
+    def on_fit_start(self):
+        if self.hparams.teacher_checkpoint:
+            self._load_teacher()
+
+        if self.hparams.compile_model:
+            self._compile_models()
+
+    def _load_teacher(self):
+        """Load the frozen generator of the teacher model for distillation."""
+        _LOGGER.debug("Loading teacher: %s", self.hparams.teacher_checkpoint)
+        teacher = VitsModel.load_from_checkpoint(
+            self.hparams.teacher_checkpoint, dataset=None, map_location=self.device
+        )
+        assert (
+            teacher.hparams.hop_length == self.hparams.hop_length
+        ), "Teacher must have the same hop length"
+
+        teacher_g = teacher.model_g.eval().requires_grad_(False)
+
+        # Not assigned as a submodule, so it isn't saved with checkpoints
+        self.__dict__["_teacher_g"] = teacher_g
+
+    def _compile_models(self):
+        """Compile the decoder (HiFi-GAN generator) and discriminators.
+
+        These take fixed-size audio segments and do most of the work in a
+        training step. The rest of the generator runs eagerly because
+        alignment search leaves the compiled graph anyway. Only forward is
+        compiled, so state dict keys (and checkpoints) don't change.
+        """
+        if not hasattr(torch, "compile"):
+            _LOGGER.warning("Compiling requires PyTorch 2.0 or newer")
+            return
+
+        # Dynamic shapes avoid recompiling for every batch size
+        for module in (self.model_g.dec, *self.model_d.discriminators):
+            module.forward = torch.compile(module.forward, dynamic=True)
+
+        _LOGGER.debug("Compiled decoder and discriminators")
+
+    def _optimizer_kwargs(self) -> Dict[str, Any]:
+        if not self.hparams.fused_optimizers:
+            return {}
+
+        optimizer_params = inspect.signature(torch.optim.AdamW).parameters
+        if (self.device.type == "cuda") and ("fused" in optimizer_params):
+            # Single kernel for all parameters (PyTorch 2.0+, CUDA only)
+            return {"fused": True}
+
+        if "foreach" in optimizer_params:
+            # Update parameters in groups instead of one at a time
+            return {"foreach": True}
+
+        return {}
 
     def configure_optimizers(self):
+        optimizer_kwargs = self._optimizer_kwargs()
         optimizers = [
             torch.optim.AdamW(
                 self.model_g.parameters(),
                 lr=self.hparams.learning_rate,
                 betas=self.hparams.betas,
                 eps=self.hparams.eps,
+                **optimizer_kwargs,
             ),
             torch.optim.AdamW(
                 self.model_d.parameters(),
                 lr=self.hparams.learning_rate,
                 betas=self.hparams.betas,
                 eps=self.hparams.eps,
+                **optimizer_kwargs,
             ),
         ]
         schedulers = [
@@ -335,13 +599,71 @@ class VitsModel(pl.LightningModule):
     def add_model_specific_args(parent_parser):
         parser = parent_parser.add_argument_group("VitsModel")
         parser.add_argument("--batch-size", type=int, required=True)
+        parser.add_argument(
+            "--max-frames-per-batch",
+            type=int,
+            help="Limit training batches to this many spectrogram frames (with padding)",
+        )
+        parser.add_argument(
+            "--batches-per-bucket",
+            type=int,
+            default=32,
+            help="Number of batches in each bucket of similar-length utterances",
+        )
+        parser.add_argument(
+            "--num-workers",
+            type=int,
+            default=1,
+            help="Number of data loader worker processes (default: 1)",
+        )
+        parser.add_argument(
+            "--pin-memory",
+            action="store_true",
+            help="Copy batches into pinned memory for faster transfer to the GPU",
+        )
+        parser.add_argument(
+            "--persistent-workers",
+            action="store_true",
+            help="Keep data loader workers alive between epochs",
+        )
         parser.add_argument("--validation-split", type=float, default=0.1)
         parser.add_argument("--num-test-examples", type=int, default=5)
+        parser.add_argument(
+            "--test-example-epochs",
+            type=int,
+            default=1,
+            help="Synthesize test examples every N epochs (0 = never)",
+        )
         parser.add_argument(
             "--max-phoneme-ids",
             type=int,
             help="Exclude utterances with phoneme id lists longer than this",
         )
+        parser.add_argument(
+            "--load-audio-segments",
+            action="store_true",
+            help="Only load the audio segment used for each training step",
+        )
+        parser.add_argument(
+            "--teacher-checkpoint",
+            help="Distill from this model's checkpoint (.ckpt) while training",
+        )
+        parser.add_argument(
+            "--c-distill",
+            type=float,
+            default=45.0,
+            help="Weight of the mel loss against the teacher's audio (default: 45)",
+        )
+        parser.add_argument(
+            "--compile-model",
+            action="store_true",
+            help="Compile decoder and discriminators with torch.compile (PyTorch 2.0+)",
+        )
+        parser.add_argument(
+            "--fused-optimizers",
+            action="store_true",
+            help="Use fused (CUDA) or multi-tensor AdamW implementations",
+        )
         #
         parser.add_argument("--hidden-channels", type=int, default=192)
         parser.add_argument("--inter-channels", type=int, default=192)
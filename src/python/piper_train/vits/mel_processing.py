@@ -1,3 +1,5 @@
+from typing import Optional
+
 import torch
 import torch.utils.data
 from librosa.filters import mel as librosa_mel_fn
@@ -38,11 +40,6 @@ hann_window = {}
 
 
 def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False):
-    if torch.min(y) < -1.0:
-        print("min value is ", torch.min(y))
-    if torch.max(y) > 1.0:
-        print("max value is ", torch.max(y))
-
     global hann_window
     dtype_device = str(y.dtype) + "_" + str(y.device)
     wnsize_dtype_device = str(win_size) + "_" + dtype_device
@@ -76,6 +73,50 @@ def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False)
     return spec
 
 
+def batch_spectrogram_torch(ys, n_fft, sampling_rate, hop_size, win_size):
+    """Spectrograms for a list of 1D audio tensors using a single STFT call.
+
+    Each audio is reflect-padded on its own (like spectrogram_torch) and then
+    zero-padded to the longest one. Frames past the end of an audio are
+    dropped, so the results match spectrogram_torch with center=False.
+    """
+    dtype_device = str(ys[0].dtype) + "_" + str(ys[0].device)
+    wnsize_dtype_device = str(win_size) + "_" + dtype_device
+    if wnsize_dtype_device not in hann_window:
+        hann_window[wnsize_dtype_device] = torch.hann_window(win_size).type_as(ys[0])
+
+    pad_size = int((n_fft - hop_size) / 2)
+    ys_padded = [
+        torch.nn.functional.pad(
+            y.view(1, 1, -1), (pad_size, pad_size), mode="reflect"
+        ).view(-1)
+        for y in ys
+    ]
+    y_batch = torch.nn.utils.rnn.pad_sequence(ys_padded, batch_first=True)
+
+    spec = torch.view_as_real(
+        torch.stft(
+            y_batch,
+            n_fft,
+            hop_length=hop_size,
+            win_length=win_size,
+            window=hann_window[wnsize_dtype_device],
+            center=False,
+            pad_mode="reflect",
+            normalized=False,
+            onesided=True,
+            return_complex=True,
+        )
+    )
+
+    spec = torch.sqrt(spec.pow(2).sum(-1) + 1e-6)
+
+    return [
+        spec[i, :, : ((y_padded.size(0) - n_fft) // hop_size) + 1]
+        for i, y_padded in enumerate(ys_padded)
+    ]
+
+
 def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
     global mel_basis
     dtype_device = str(spec.dtype) + "_" + str(spec.device)
@@ -93,11 +134,6 @@ def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
 def mel_spectrogram_torch(
     y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False
 ):
-    if torch.min(y) < -1.0:
-        print("min value is ", torch.min(y))
-    if torch.max(y) > 1.0:
-        print("max value is ", torch.max(y))
-
     global mel_basis, hann_window
     dtype_device = str(y.dtype) + "_" + str(y.device)
     fmax_dtype_device = str(fmax) + "_" + dtype_device
@@ -137,3 +173,65 @@ def mel_spectrogram_torch(
     spec = spectral_normalize_torch(spec)
 
     return spec
+
+
+class MelSTFT(torch.nn.Module):
+    """
+    Linear and mel spectrograms with a cached window and mel filterbank.
+
+    The window and filterbank are (non-persistent) buffers, so they follow
+    the module across devices without being saved in checkpoints. Output
+    matches spectrogram_torch/spec_to_mel_torch/mel_spectrogram_torch with
+    center=False.
+    """
+
+    def __init__(
+        self,
+        n_fft: int,
+        num_mels: int,
+        sampling_rate: int,
+        hop_size: int,
+        win_size: int,
+        fmin: float = 0.0,
+        fmax: Optional[float] = None,
+    ):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop_size = hop_size
+        self.win_size = win_size
+        self.pad_size = int((n_fft - hop_size) / 2)
+
+        mel = librosa_mel_fn(
+            sr=sampling_rate, n_fft=n_fft, n_mels=num_mels, fmin=fmin, fmax=fmax
+        )
+        self.register_buffer("window", torch.hann_window(win_size), persistent=False)
+        self.register_buffer("mel_basis", torch.from_numpy(mel), persistent=False)
+
+    def spectrogram(self, y: torch.Tensor) -> torch.Tensor:
+        """Linear magnitude spectrogram of audio [b, t] -> [b, n_fft // 2 + 1, frames]"""
+        y = torch.nn.functional.pad(
+            y.unsqueeze(1), (self.pad_size, self.pad_size), mode="reflect"
+        ).squeeze(1)
+
+        spec = torch.stft(
+            y,
+            self.n_fft,
+            hop_length=self.hop_size,
+            win_length=self.win_size,
+            window=self.window,
+            center=False,
+            normalized=False,
+            onesided=True,
+            return_complex=True,
+        )
+
+        # Epsilon keeps the gradient of sqrt finite for silent frames
+        return torch.sqrt(spec.real.square() + spec.imag.square() + 1e-6)
+
+    def spec_to_mel(self, spec: torch.Tensor) -> torch.Tensor:
+        """Log mel spectrogram from a linear spectrogram"""
+        return spectral_normalize_torch(torch.matmul(self.mel_basis, spec))
+
+    def forward(self, y: torch.Tensor) -> torch.Tensor:
+        """Log mel spectrogram of audio [b, t] -> [b, num_mels, frames]"""
+        return self.spec_to_mel(self.spectrogram(y))
@@ -1,3 +1,4 @@
+import copy
 import math
 import typing
 
@@ -6,6 +7,7 @@ from torch import nn
 from torch.nn import Conv1d, Conv2d, ConvTranspose1d
 from torch.nn import functional as F
 from torch.nn.utils import remove_weight_norm, spectral_norm, weight_norm
+from torch.nn.utils.weight_norm import WeightNorm
 
 from . import attentions, commons, modules, monotonic_align
 from .commons import get_padding, init_weights
@@ -60,7 +62,9 @@ class StochasticDurationPredictor(nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, filter_channels, 1)
 
-    def forward(self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0):
+    def forward(
+        self, x, x_mask, w=None, g=None, reverse=False, noise_scale=1.0, noise=None
+    ):
         x = torch.detach(x)
         x = self.pre(x)
         if g is not None:
@@ -108,7 +112,10 @@ class StochasticDurationPredictor(nn.Module):
         else:
             flows = list(reversed(self.flows))
             flows = flows[:-2] + [flows[-1]]  # remove a useless vflow
-            z = torch.randn(x.size(0), 2, x.size(2)).type_as(x) * noise_scale
+            if noise is None:
+                noise = torch.randn(x.size(0), 2, x.size(2)).type_as(x)
+
+            z = noise * noise_scale
 
             for flow in flows:
                 z = flow(z, x_mask, g=x, reverse=reverse)
@@ -345,21 +352,35 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None):
+        """Decode latents to audio.
+
+        If x_mask ([b, 1, t]) is given, padded frames are zeroed after every
+        layer, so each batch item decodes the same as it would on its own.
+        """
         x = self.conv_pre(x)
         if g is not None:
             x = x + self.cond(g)
 
+        if x_mask is not None:
+            x = x * x_mask
+
         for i, up in enumerate(self.ups):
             x = F.leaky_relu(x, self.LRELU_SLOPE)
             x = up(x)
+
+            if x_mask is not None:
+                # [b, 1, t] -> [b, 1, t * stride]
+                x_mask = x_mask.unsqueeze(-1).repeat(1, 1, 1, up.stride[0]).flatten(2)
+                x = x * x_mask
+
             xs = torch.zeros(1)
             for j, resblock in enumerate(self.resblocks):
                 index = j - (i * self.num_kernels)
                 if index == 0:
-                    xs = resblock(x)
+                    xs = resblock(x, x_mask)
                 elif (index > 0) and (index < self.num_kernels):
-                    xs += resblock(x)
+                    xs += resblock(x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
         x = self.conv_post(x)
@@ -504,20 +525,22 @@ class MultiPeriodDiscriminator(torch.nn.Module):
         self.discriminators = nn.ModuleList(discs)
 
     def forward(self, y, y_hat):
-        y_d_rs = []
-        y_d_gs = []
-        fmap_rs = []
-        fmap_gs = []
-        for i, d in enumerate(self.discriminators):
-            y_d_r, fmap_r = d(y)
-            y_d_g, fmap_g = d(y_hat)
-            y_d_rs.append(y_d_r)
-            y_d_gs.append(y_d_g)
-            fmap_rs.append(fmap_r)
-            fmap_gs.append(fmap_g)
+        y_d_rs, fmap_rs = self.discriminate(y)
+        y_d_gs, fmap_gs = self.discriminate(y_hat)
 
         return y_d_rs, y_d_gs, fmap_rs, fmap_gs
 
+    def discriminate(self, y):
+        """Outputs and feature maps of every discriminator for a single input"""
+        y_ds = []
+        fmaps = []
+        for d in self.discriminators:
+            y_d, fmap = d(y)
+            y_ds.append(y_d)
+            fmaps.append(fmap)
+
+        return y_ds, fmaps
+
 
 class SynthesizerTrn(nn.Module):
     """
@@ -614,7 +637,8 @@ class SynthesizerTrn(nn.Module):
         if n_speakers > 1:
             self.emb_g = nn.Embedding(n_speakers, gin_channels)
 
-    def forward(self, x, x_lengths, y, y_lengths, sid=None):
+    def forward(self, x, x_lengths, y, y_lengths, sid=None, ids_slice=None):
+        """ids_slice: start frames of decoder segments (random if None)"""
 
         x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
         if self.n_speakers > 1:
@@ -664,9 +688,13 @@ class SynthesizerTrn(nn.Module):
         m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2)
         logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2)
 
-        z_slice, ids_slice = commons.rand_slice_segments(
-            z, y_lengths, self.segment_size
-        )
+        if ids_slice is None:
+            z_slice, ids_slice = commons.rand_slice_segments(
+                z, y_lengths, self.segment_size
+            )
+        else:
+            z_slice = commons.slice_segments(z, ids_slice, self.segment_size)
+
         o = self.dec(z_slice, g=g)
         return (
             o,
@@ -687,7 +715,13 @@ class SynthesizerTrn(nn.Module):
         length_scale=1,
         noise_scale_w=0.8,
         max_len=None,
+        noise_seed=None,
     ):
+        """Synthesize audio from phoneme ids.
+
+        If noise_seed ([b] or [1]) is given, noise comes from
+        commons.seeded_randn_like, and the same inputs give the same audio.
+        """
         x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
         if self.n_speakers > 1:
             assert sid is not None, "Missing speaker id"
@@ -696,7 +730,20 @@ class SynthesizerTrn(nn.Module):
             g = None
 
         if self.use_sdp:
-            logw = self.dp(x, x_mask, g=g, reverse=True, noise_scale=noise_scale_w)
+            dp_noise = None
+            if noise_seed is not None:
+                dp_noise = (
+                    commons.seeded_randn_like(x[:, :2], noise_seed, stream=0) * x_mask
+                )
+
+            logw = self.dp(
+                x,
+                x_mask,
+                g=g,
+                reverse=True,
+                noise_scale=noise_scale_w,
+                noise=dp_noise,
+            )
         else:
             logw = self.dp(x, x_mask, g=g)
         w = torch.exp(logw) * x_mask * length_scale
@@ -705,21 +752,22 @@ class SynthesizerTrn(nn.Module):
         y_mask = torch.unsqueeze(
             commons.sequence_mask(y_lengths, y_lengths.max()), 1
         ).type_as(x_mask)
-        attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
-        attn = commons.generate_path(w_ceil, attn_mask)
 
-        m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(
-            1, 2
-        )  # [b, t', t], [b, t, d] -> [b, d, t']
-        logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(
-            1, 2
-        )  # [b, t', t], [b, t, d] -> [b, d, t']
+        # Repeat phoneme frames by duration: [b, d, t] -> [b, d, t']
+        m_p = commons.expand_by_duration(m_p, w_ceil, y_mask.size(2))
+        logs_p = commons.expand_by_duration(logs_p, w_ceil, y_mask.size(2))
 
-        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+        if noise_seed is None:
+            noise = torch.randn_like(m_p)
+        else:
+            noise = commons.seeded_randn_like(m_p, noise_seed, stream=1)
+
+        z_p = m_p + noise * torch.exp(logs_p) * noise_scale
         z = self.flow(z_p, y_mask, g=g, reverse=True)
-        o = self.dec((z * y_mask)[:, :, :max_len], g=g)
+        o = self.dec((z * y_mask)[:, :, :max_len], g=g, x_mask=y_mask[:, :, :max_len])
 
-        return o, attn, y_mask, (z, z_p, m_p, logs_p)
+        # Alignment is not built at inference (attn is None)
+        return o, None, y_mask, (z, z_p, m_p, logs_p)
 
     def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
         assert self.n_speakers > 1, "n_speakers have to be larger than 1."
@@ -730,3 +778,64 @@ class SynthesizerTrn(nn.Module):
         z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True)
         o_hat = self.dec(z_hat * y_mask, g=g_tgt)
         return o_hat, y_mask, (z, z_p, z_hat)
+
+    def for_speaker(self, speaker_id: int) -> "SynthesizerTrn":
+        """Copy of a multi-speaker model specialized to a single speaker.
+
+        The speaker embedding is computed once, and each layer's projection of
+        it is added to the bias of the convolution it follows. The copy is a
+        single-speaker model, so infer() takes no sid and skips conditioning.
+        """
+        assert self.n_speakers > 1, "n_speakers have to be larger than 1."
+
+        with torch.no_grad():
+            # Weights computed by weight_norm aren't graph leaves until they're
+            # recomputed without grad, and can't be copied before.
+            for module in self.modules():
+                for hook in module._forward_pre_hooks.values():
+                    if isinstance(hook, WeightNorm):
+                        hook(module, None)
+
+            model = copy.deepcopy(self)
+            sid = torch.LongTensor([speaker_id]).to(self.emb_g.weight.device)
+            g = model.emb_g(sid).unsqueeze(-1)  # [1, h, 1]
+
+            if model.use_sdp:
+                # x = pre(x) + cond(g)
+                model.dp.pre.bias.add_(model.dp.cond(g)[0, :, 0])
+            else:
+                # Conditioning is added before masking, so it can't be folded
+                model.dp = _SpeakerConditioned(model.dp, g)
+
+            # x = conv_pre(x) + cond(g)
+            model.dec.conv_pre.bias.add_(model.dec.cond(g)[0, :, 0])
+
+            for flow in model.flow.flows:
+                if not isinstance(flow, modules.ResidualCouplingLayer):
+                    continue
+
+                # in_layers[i](x) + cond_layer(g)[layer i's channels]
+                wn = flow.enc
+                g_all = wn.cond_layer(g)[0, :, 0]
+                layer_channels = 2 * wn.hidden_channels
+                for i, in_layer in enumerate(wn.in_layers):
+                    in_layer.bias.add_(
+                        g_all[i * layer_channels : (i + 1) * layer_channels]
+                    )
+
+        model.n_speakers = 1
+        del model.emb_g
+
+        return model
+
+
+class _SpeakerConditioned(nn.Module):
+    """Calls a module with fixed speaker conditioning"""
+
+    def __init__(self, module: nn.Module, g: torch.Tensor):
+        super().__init__()
+        self.module = module
+        self.register_buffer("g", g)
+
+    def forward(self, *args, g=None, **kwargs):
+        return self.module(*args, g=self.g, **kwargs)
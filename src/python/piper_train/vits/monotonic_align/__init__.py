@@ -1,20 +1,96 @@
+import logging
+
 import numpy as np
 import torch
 
-from .monotonic_align.core import maximum_path_c
+_LOGGER = logging.getLogger("vits.monotonic_align")
+
+try:
+    from .monotonic_align.core import maximum_path_c
+except ImportError:
+    _LOGGER.warning(
+        "monotonic_align extension is not built; using slower NumPy version "
+        "(see build_monotonic_align.sh)"
+    )
+    maximum_path_c = None
 
 
 def maximum_path(neg_cent, mask):
     """Cython optimized version.
     neg_cent: [b, t_t, t_s]
     mask: [b, t_t, t_s]
+
+    Batch items are processed in parallel when the extension is built with
+    OpenMP. A contiguous float32 CPU neg_cent is used without copying, and
+    is overwritten. Other dtypes (e.g. bfloat16 under autocast) are copied.
     """
     device = neg_cent.device
     dtype = neg_cent.dtype
-    neg_cent = neg_cent.data.cpu().numpy().astype(np.float32)
+    neg_cent = np.ascontiguousarray(
+        neg_cent.detach().cpu().float().numpy(), dtype=np.float32
+    )
     path = np.zeros(neg_cent.shape, dtype=np.int32)
 
-    t_t_max = mask.sum(1)[:, 0].data.cpu().numpy().astype(np.int32)
-    t_s_max = mask.sum(2)[:, 0].data.cpu().numpy().astype(np.int32)
-    maximum_path_c(path, neg_cent, t_t_max, t_s_max)
+    t_t_max = mask.sum(1)[:, 0].detach().cpu().int().numpy()
+    t_s_max = mask.sum(2)[:, 0].detach().cpu().int().numpy()
+
+    if maximum_path_c is not None:
+        maximum_path_c(path, neg_cent, t_t_max, t_s_max)
+    else:
+        maximum_path_numpy(path, neg_cent, t_t_max, t_s_max)
+
     return torch.from_numpy(path).to(device=device, dtype=dtype)
+
+
+def maximum_path_numpy(paths, values, t_ys, t_xs, max_neg_val=-1e9):
+    """Same as maximum_path_c, vectorized over the batch and t_x.
+
+    paths: int32 [b, t_y, t_x] (filled in)
+    values: float32 [b, t_y, t_x] (overwritten)
+    """
+    batch_size, max_t_y, max_t_x = values.shape
+    max_neg_val = np.float32(max_neg_val)
+    t_ys = t_ys.astype(np.int64)
+    t_xs = t_xs.astype(np.int64)
+    x_range = np.arange(max_t_x)
+
+    # Forward pass: one row of every item at a time
+    for y in range(max_t_y):
+        if y == 0:
+            v_cur = np.full((batch_size, max_t_x), max_neg_val, dtype=np.float32)
+            v_prev = np.full((batch_size, max_t_x), max_neg_val, dtype=np.float32)
+            v_prev[:, 0] = 0
+        else:
+            v_cur = values[:, y - 1, :].copy()
+            if y < max_t_x:
+                v_cur[:, y] = max_neg_val
+
+            v_prev = np.empty_like(v_cur)
+            v_prev[:, 0] = max_neg_val
+            v_prev[:, 1:] = values[:, y - 1, :-1]
+
+        x_start = np.maximum(0, t_xs + y - t_ys)[:, None]
+        x_end = np.minimum(t_xs, y + 1)[:, None]
+        is_valid = (x_range >= x_start) & (x_range < x_end) & (y < t_ys)[:, None]
+
+        values[:, y, :] = np.where(
+            is_valid, values[:, y, :] + np.maximum(v_prev, v_cur), values[:, y, :]
+        )
+
+    # Backtrack
+    batch_range = np.arange(batch_size)
+    index = t_xs - 1
+    for y in range(max_t_y - 1, -1, -1):
+        is_active = y < t_ys
+        paths[batch_range[is_active], y, index[is_active]] = 1
+
+        if y > 0:
+            prev_index = np.maximum(index - 1, 0)
+            move_left = (index != 0) & (
+                (index == y)
+                | (
+                    values[batch_range, y - 1, index]
+                    < values[batch_range, y - 1, prev_index]
+                )
+            )
+            index = np.where(is_active & move_left, index - 1, index)
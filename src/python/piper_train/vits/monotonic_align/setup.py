@@ -1,3 +1,4 @@
+import sys
 from distutils.core import setup
 from pathlib import Path
 
@@ -6,8 +7,22 @@ from Cython.Build import cythonize
 
 _DIR = Path(__file__).parent
 
+# maximum_path_c uses prange to process batch items in parallel, which is
+# serial unless compiled with OpenMP. Apple's clang doesn't ship OpenMP.
+if sys.platform == "win32":
+    openmp_compile_args, openmp_link_args = ["/openmp"], []
+elif sys.platform == "darwin":
+    openmp_compile_args, openmp_link_args = [], []
+else:
+    openmp_compile_args, openmp_link_args = ["-fopenmp"], ["-fopenmp"]
+
+ext_modules = cythonize(str(_DIR / "core.pyx"))
+for ext_module in ext_modules:
+    ext_module.extra_compile_args.extend(openmp_compile_args)
+    ext_module.extra_link_args.extend(openmp_link_args)
+
 setup(
     name="monotonic_align",
-    ext_modules=cythonize(str(_DIR / "core.pyx")),
+    ext_modules=ext_modules,
     include_dirs=[numpy.get_include()],
 )
@@ -0,0 +1,139 @@
+"""Batch sampler that groups utterances of similar length"""
+import logging
+import math
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+_LOGGER = logging.getLogger("vits.sampler")
+
+
+class LengthBucketSampler(Sampler[List[int]]):
+    """
+    Yields batches of dataset indexes with similar spectrogram lengths.
+
+    Utterances are sorted by length and split into buckets of
+    batch_size * batches_per_bucket utterances. Every epoch, utterances are
+    shuffled inside each bucket, packed into batches, and the batches are
+    shuffled. A batch holds at most batch_size utterances, and if max_frames
+    is set, at most max_frames spectrogram frames including padding.
+
+    When torch.distributed is initialized, each process gets a disjoint
+    share of the batches (the same number for every process).
+
+    Call set_epoch at the start of each epoch to get a new shuffle.
+    """
+
+    def __init__(
+        self,
+        lengths: Sequence[int],
+        batch_size: int,
+        max_frames: Optional[int] = None,
+        batches_per_bucket: int = 32,
+        shuffle: bool = True,
+        seed: int = 0,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+    ):
+        super().__init__(None)
+
+        if (num_replicas is None) or (rank is None):
+            is_distributed = dist.is_available() and dist.is_initialized()
+            if num_replicas is None:
+                num_replicas = dist.get_world_size() if is_distributed else 1
+
+            if rank is None:
+                rank = dist.get_rank() if is_distributed else 0
+
+        assert batch_size > 0, "batch_size must be positive"
+        assert 0 <= rank < num_replicas, f"Invalid rank: {rank}"
+
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.bucket_size = batch_size * max(1, batches_per_bucket)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+        # Stable sort keeps bucket membership the same across epochs
+        self._sorted_indexes = np.argsort(self.lengths, kind="stable")
+
+        self._batches: Optional[List[List[int]]] = None
+        self._batches_epoch = -1
+
+        if (max_frames is not None) and (len(self.lengths) > 0):
+            num_too_long = int(np.sum(self.lengths > max_frames))
+            if num_too_long > 0:
+                _LOGGER.warning(
+                    "%s utterance(s) are longer than max_frames (%s) "
+                    "and will be in batches by themselves",
+                    num_too_long,
+                    max_frames,
+                )
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _make_batches(self) -> List[List[int]]:
+        if (self._batches is not None) and (self._batches_epoch == self.epoch):
+            return self._batches
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        batches: List[List[int]] = []
+
+        for bucket_start in range(0, len(self._sorted_indexes), self.bucket_size):
+            bucket = self._sorted_indexes[
+                bucket_start : bucket_start + self.bucket_size
+            ]
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+
+            batch: List[int] = []
+            batch_max_length = 0
+            for utt_idx in bucket:
+                utt_length = int(self.lengths[utt_idx])
+                new_max_length = max(batch_max_length, utt_length)
+                is_full = len(batch) >= self.batch_size
+                if (self.max_frames is not None) and (
+                    new_max_length * (len(batch) + 1) > self.max_frames
+                ):
+                    is_full = True
+
+                if batch and is_full:
+                    batches.append(batch)
+                    batch = []
+                    new_max_length = utt_length
+
+                batch.append(int(utt_idx))
+                batch_max_length = new_max_length
+
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        if batches and (self.num_replicas > 1):
+            # Every process must run the same number of steps, so repeat
+            # batches from the start until they divide evenly.
+            num_total_batches = (
+                math.ceil(len(batches) / self.num_replicas) * self.num_replicas
+            )
+            batches = [batches[i % len(batches)] for i in range(num_total_batches)]
+            batches = batches[self.rank :: self.num_replicas]
+
+        self._batches = batches
+        self._batches_epoch = self.epoch
+
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._make_batches())
+
+    def __len__(self) -> int:
+        return len(self._make_batches())
@@ -0,0 +1,219 @@
+"""Tests for the relative-position attention fast path"""
+import itertools
+
+import pytest
+import torch
+
+from piper_train.vits import attentions
+from piper_train.vits.attentions import MultiHeadAttention
+
+CHANNELS = 16
+N_HEADS = 2
+LENGTHS = (1, 3, 4, 5, 17, 40)
+TOLERANCE = 1e-5
+
+
+class _AttentionModule(torch.nn.Module):
+    """Runs MultiHeadAttention.attention directly on query/key/value"""
+
+    def __init__(self, attention: MultiHeadAttention):
+        super().__init__()
+        self.attention = attention
+
+    def forward(self, query, key, value, attn_mask):
+        return self.attention.attention(query, key, value, mask=attn_mask)[0]
+
+
+def _make_attention(**kwargs) -> MultiHeadAttention:
+    torch.manual_seed(0)
+    attention = MultiHeadAttention(CHANNELS, CHANNELS, N_HEADS, **kwargs)
+
+    if attention.window_size is not None:
+        # Embeddings are random at init, but make sure every head differs
+        with torch.no_grad():
+            attention.emb_rel_k.normal_()
+            attention.emb_rel_v.normal_()
+
+    return attention.eval()
+
+
+def _make_inputs(batch_size: int, length: int, query_length: int = 0):
+    """Random inputs with the last batch item padded to half the length"""
+    query_length = query_length or length
+    query = torch.randn(batch_size, CHANNELS, query_length)
+    key = torch.randn(batch_size, CHANNELS, length)
+    value = torch.randn(batch_size, CHANNELS, length)
+
+    key_mask = torch.ones(batch_size, length)
+    key_mask[-1, max(1, length // 2) :] = 0
+    query_mask = torch.ones(batch_size, query_length)
+    query_mask[-1, max(1, query_length // 2) :] = 0
+    attn_mask = query_mask.unsqueeze(1).unsqueeze(-1) * key_mask.unsqueeze(1).unsqueeze(
+        2
+    )
+
+    return query, key, value, attn_mask
+
+
+def _assert_close(actual, expected, attn_mask=None):
+    assert actual.shape == expected.shape
+
+    if attn_mask is not None:
+        # Queries at padding attend to nothing. Their output differs between
+        # the SDPA path and the reference, and is masked out by every caller.
+        query_mask = attn_mask.amax(-1)
+        if actual.dim() == 3:
+            # [b, d, t_t]
+            query_mask = query_mask[:, 0].unsqueeze(1)
+        actual = actual * query_mask
+        expected = expected * query_mask
+
+    assert torch.allclose(actual, expected, atol=TOLERANCE, rtol=TOLERANCE), (
+        (actual - expected).abs().max().item()
+    )
+
+
+@pytest.mark.parametrize(
+    "length,window_size,heads_share,proximal_bias,block_length",
+    [
+        (length, window_size, heads_share, proximal_bias, block_length)
+        for length, window_size, heads_share, (proximal_bias, block_length) in (
+            itertools.product(
+                LENGTHS,
+                (None, 4),
+                (True, False),
+                ((False, None), (True, None), (False, 2), (True, 3)),
+            )
+        )
+    ],
+)
+def test_self_attention_matches_reference(
+    length, window_size, heads_share, proximal_bias, block_length
+):
+    attention = _make_attention(
+        window_size=window_size,
+        heads_share=heads_share,
+        proximal_bias=proximal_bias,
+        block_length=block_length,
+    )
+    query, key, value, attn_mask = _make_inputs(2, length)
+
+    with torch.no_grad():
+        output, p_attn = attention.attention(query, key, value, mask=attn_mask)
+        expected_output, expected_p_attn = attention._attention_reference(
+            query, key, value, mask=attn_mask
+        )
+
+    _assert_close(output, expected_output, attn_mask)
+    if p_attn is not None:
+        _assert_close(p_attn, expected_p_attn, attn_mask)
+
+
+@pytest.mark.parametrize("query_length,key_length", [(1, 7), (9, 4), (12, 12)])
+def test_cross_attention_matches_reference(query_length, key_length):
+    attention = _make_attention()
+    query, key, value, attn_mask = _make_inputs(2, key_length, query_length)
+
+    with torch.no_grad():
+        output, _p_attn = attention.attention(query, key, value, mask=attn_mask)
+        expected_output, _expected_p_attn = attention._attention_reference(
+            query, key, value, mask=attn_mask
+        )
+
+    _assert_close(output, expected_output, attn_mask)
+
+
+def test_unmasked_attention_matches_reference():
+    attention = _make_attention(window_size=4)
+    query, key, value, _attn_mask = _make_inputs(1, 11)
+
+    with torch.no_grad():
+        output, _p_attn = attention.attention(query, key, value)
+        expected_output, _expected_p_attn = attention._attention_reference(
+            query, key, value
+        )
+
+    _assert_close(output, expected_output)
+
+
+def test_backward_after_inference_mode():
+    """Index tensors cached under inference_mode must still work in training"""
+    for cached in (
+        attentions._relative_indexes,
+        attentions._block_mask,
+        attentions._proximal_bias,
+    ):
+        cached.cache_clear()
+
+    attention = _make_attention(window_size=4, block_length=2, proximal_bias=True)
+    query, key, value, attn_mask = _make_inputs(2, 13)
+
+    with torch.inference_mode():
+        attention.attention(query, key, value, mask=attn_mask)
+
+    attention.train()
+    output, _p_attn = attention.attention(query, key, value, mask=attn_mask)
+    output.sum().backward()
+
+    assert attention.emb_rel_k.grad is not None
+
+
+@pytest.mark.parametrize("heads_share", [True, False])
+def test_traced_attention_works_for_other_lengths(heads_share):
+    """Tracing falls back to the reference, so no length is baked in"""
+    attention = _make_attention(window_size=4, heads_share=heads_share)
+    example_inputs = _make_inputs(2, 9)
+
+    with torch.no_grad():
+        traced_attention = torch.jit.trace(
+            _AttentionModule(attention), example_inputs, check_trace=False
+        )
+
+        for length in (3, 9, 23):
+            inputs = _make_inputs(2, length)
+            expected_output, _p_attn = attention._attention_reference(
+                *inputs[:3], mask=inputs[3]
+            )
+            _assert_close(traced_attention(*inputs), expected_output)
+
+
+def test_onnx_attention_works_for_other_lengths(tmp_path):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+
+    attention = _make_attention(window_size=4, heads_share=False)
+    example_inputs = _make_inputs(2, 9)
+    onnx_path = tmp_path / "attention.onnx"
+    input_names = ["query", "key", "value", "attn_mask"]
+    with torch.no_grad():
+        torch.onnx.export(
+            _AttentionModule(attention),
+            example_inputs,
+            str(onnx_path),
+            opset_version=15,
+            input_names=input_names,
+            output_names=["output"],
+            dynamic_axes={
+                "query": {0: "batch", 2: "time"},
+                "key": {0: "batch", 2: "time"},
+                "value": {0: "batch", 2: "time"},
+                "attn_mask": {0: "batch", 2: "time", 3: "time"},
+            },
+        )
+
+    session = onnxruntime.InferenceSession(
+        str(onnx_path), providers=["CPUExecutionProvider"]
+    )
+    for length in (3, 9, 23):
+        inputs = _make_inputs(2, length)
+        (output,) = session.run(
+            None,
+            {name: tensor.numpy() for name, tensor in zip(input_names, inputs)},
+        )
+
+        with torch.no_grad():
+            expected_output, _p_attn = attention._attention_reference(
+                *inputs[:3], mask=inputs[3]
+            )
+
+        _assert_close(torch.from_numpy(output), expected_output)
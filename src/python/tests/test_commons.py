@@ -0,0 +1,119 @@
+"""Tests for expanding phoneme frames by duration"""
+from unittest import mock
+
+import pytest
+import torch
+
+from piper_train.vits import commons
+
+CHANNELS = 3
+
+
+def _durations():
+    """Float durations like w_ceil: [b, 1, t_x] and lengths [b]"""
+    generator = torch.Generator().manual_seed(0)
+    duration = torch.randint(0, 5, (4, 1, 12), generator=generator).float()
+
+    # Leading, repeated, and trailing zeros
+    duration[0, 0, :3] = 0
+    duration[0, 0, 5:8] = 0
+    duration[0, 0, -1] = 0
+
+    # No zeros
+    duration[1, 0] = duration[1, 0].clamp(min=1)
+
+    # Padding
+    x_lengths = torch.LongTensor([12, 12, 7, 12])
+    duration[2, 0, 7:] = 0
+
+    # Nothing to expand
+    duration[3] = 0
+
+    return duration, x_lengths
+
+
+def _expand_by_path(x, duration, x_lengths, t_y: int):
+    """Expansion as done before expand_by_duration, with generate_path"""
+    x_mask = commons.sequence_mask(x_lengths, x.size(2)).unsqueeze(1).float()
+    y_lengths = duration.sum((1, 2)).long()
+    y_mask = commons.sequence_mask(y_lengths, t_y).unsqueeze(1).float()
+    attn_mask = x_mask.unsqueeze(2) * y_mask.unsqueeze(-1)
+    attn = commons.generate_path(duration, attn_mask)
+
+    # [b, t_y, t_x] x [b, t_x, d] -> [b, d, t_y]
+    return torch.matmul(attn.squeeze(1), x.transpose(1, 2)).transpose(1, 2)
+
+
+@pytest.mark.parametrize("in_onnx_export", [False, True])
+@pytest.mark.parametrize("extra_frames", [0, 5])
+def test_expand_by_duration_matches_path(in_onnx_export, extra_frames):
+    duration, x_lengths = _durations()
+    x = torch.randn(duration.size(0), CHANNELS, duration.size(2))
+    t_y = int(duration.sum((1, 2)).max()) + extra_frames
+
+    with mock.patch("torch.onnx.is_in_onnx_export", return_value=in_onnx_export):
+        expanded = commons.expand_by_duration(x, duration, t_y)
+
+    assert torch.equal(expanded, _expand_by_path(x, duration, x_lengths, t_y))
+
+
+@pytest.mark.parametrize("extra_frames", [0, 5])
+def test_scatter_indexes_match_searchsorted(extra_frames):
+    duration, _x_lengths = _durations()
+    t_y = int(duration.sum((1, 2)).max()) + extra_frames
+
+    indexes, is_valid = commons.duration_indexes(duration, t_y)
+    with mock.patch("torch.onnx.is_in_onnx_export", return_value=True):
+        scatter_indexes, scatter_is_valid = commons.duration_indexes(duration, t_y)
+
+    assert torch.equal(is_valid, scatter_is_valid)
+    assert torch.equal(indexes[is_valid], scatter_indexes[is_valid])
+
+
+def test_onnx_expand_by_duration(tmp_path):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+
+    class ExpandModule(torch.nn.Module):
+        def forward(self, x, duration, y_mask):
+            return commons.expand_by_duration(x, duration, y_mask.size(2))
+
+    def make_inputs(duration):
+        x = torch.randn(duration.size(0), CHANNELS, duration.size(2))
+        y_mask = torch.ones(duration.size(0), 1, int(duration.sum((1, 2)).max()))
+        return x, duration, y_mask
+
+    onnx_path = tmp_path / "expand.onnx"
+    input_names = ["x", "duration", "y_mask"]
+    torch.onnx.export(
+        ExpandModule(),
+        make_inputs(torch.full((1, 1, 3), 2.0)),
+        str(onnx_path),
+        opset_version=15,
+        input_names=input_names,
+        output_names=["output"],
+        dynamic_axes={
+            "x": {0: "batch", 2: "t_x"},
+            "duration": {0: "batch", 2: "t_x"},
+            "y_mask": {0: "batch", 2: "t_y"},
+        },
+    )
+
+    session = onnxruntime.InferenceSession(
+        str(onnx_path), providers=["CPUExecutionProvider"]
+    )
+
+    duration, x_lengths = _durations()
+    x, duration, y_mask = make_inputs(duration)
+    (output,) = session.run(
+        None,
+        {
+            name: tensor.numpy()
+            for name, tensor in zip(input_names, (x, duration, y_mask))
+        },
+    )
+
+    assert torch.equal(
+        torch.from_numpy(output),
+        _expand_by_path(x, duration, x_lengths, y_mask.size(2)),
+    )
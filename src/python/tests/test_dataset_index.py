@@ -0,0 +1,101 @@
+"""Tests for the memory-mapped dataset index"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from piper_train.vits.dataset_index import DatasetIndex
+
+NUM_UTTERANCES = 10000
+
+
+class _UtteranceDataset(Dataset):
+    def __init__(self, index: DatasetIndex):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        utt_dict = self.index.read_utterance(idx)
+        return idx, utt_dict["utt_id"], utt_dict["phoneme_ids"]
+
+
+def _write_dataset(dataset_path: Path) -> None:
+    with open(dataset_path, "w", encoding="utf-8") as dataset_file:
+        for utt_idx in range(NUM_UTTERANCES):
+            json.dump(
+                {
+                    "utt_id": utt_idx,
+                    "phoneme_ids": [utt_idx % 100] * (1 + (utt_idx % 7)),
+                    "audio_spec_length": 10 + utt_idx,
+                    "text": "x" * (utt_idx % 13),
+                },
+                dataset_file,
+            )
+            print("", file=dataset_file)
+
+            if (utt_idx % 10) == 0:
+                # Blank lines are skipped by the index
+                print("", file=dataset_file)
+
+
+@pytest.fixture(params=["pread", "file"])
+def read_mode(request, monkeypatch):
+    """Read with os.pread, and with the file object used where it's missing"""
+    if request.param == "file":
+        monkeypatch.delattr(os, "pread", raising=False)
+    elif not hasattr(os, "pread"):
+        pytest.skip("os.pread is not available")
+
+    return request.param
+
+
+def test_read_utterance(tmp_path, read_mode):
+    dataset_path = tmp_path / "dataset.jsonl"
+    _write_dataset(dataset_path)
+
+    index = DatasetIndex.load(dataset_path)
+    assert len(index) == NUM_UTTERANCES
+
+    for utt_idx in (0, 1, 10, 11, NUM_UTTERANCES - 1):
+        utt_dict = index.read_utterance(utt_idx)
+        assert utt_dict["utt_id"] == utt_idx
+        assert list(index.phoneme_ids(utt_idx)) == utt_dict["phoneme_ids"]
+        assert index.spec_lengths[utt_idx] == 10 + utt_idx
+
+    index.close()
+
+
+def test_read_utterance_in_forked_workers(tmp_path, read_mode):
+    """Workers forked after the parent has read must still get the right lines"""
+    dataset_path = tmp_path / "dataset.jsonl"
+    _write_dataset(dataset_path)
+
+    index = DatasetIndex.load(dataset_path)
+
+    # Opens the dataset file in the parent before the workers fork
+    assert index.read_utterance(0)["utt_id"] == 0
+
+    loader = DataLoader(
+        _UtteranceDataset(index),
+        batch_size=None,
+        shuffle=True,
+        num_workers=4,
+        multiprocessing_context="fork",
+        generator=torch.Generator().manual_seed(0),
+    )
+
+    num_read = 0
+    for _ in range(2):
+        for idx, utt_id, phoneme_ids in loader:
+            assert utt_id == idx
+            assert np.array_equal(index.phoneme_ids(idx), phoneme_ids)
+            num_read += 1
+
+    assert num_read == 2 * NUM_UTTERANCES
+    index.close()
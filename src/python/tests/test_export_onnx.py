@@ -0,0 +1,106 @@
+"""Tests for exporting batched ONNX models with per-item output lengths"""
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from piper_train.export_onnx import export_model
+from piper_train.vits.models import SynthesizerTrn
+
+NUM_SYMBOLS = 20
+NUM_SPEAKERS = 3
+UPSAMPLE_RATES = (4, 4)
+TOLERANCE = 1e-5
+
+
+def _make_model() -> SynthesizerTrn:
+    """Tiny, randomly initialized multi-speaker generator"""
+    torch.manual_seed(0)
+    model_g = SynthesizerTrn(
+        n_vocab=NUM_SYMBOLS,
+        spec_channels=17,
+        segment_size=8,
+        inter_channels=16,
+        hidden_channels=16,
+        filter_channels=32,
+        n_heads=2,
+        n_layers=1,
+        kernel_size=3,
+        p_dropout=0.0,
+        resblock="2",
+        resblock_kernel_sizes=(3,),
+        resblock_dilation_sizes=((1, 2),),
+        upsample_rates=UPSAMPLE_RATES,
+        upsample_initial_channel=16,
+        upsample_kernel_sizes=(8, 8),
+        n_speakers=NUM_SPEAKERS,
+        gin_channels=8,
+    )
+    model_g.eval()
+
+    with torch.no_grad():
+        model_g.dec.remove_weight_norm()
+
+    return model_g
+
+
+def test_output_lengths_match_single_item_runs(tmp_path):
+    onnxruntime = pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+
+    onnx_path = tmp_path / "model.onnx"
+    args = argparse.Namespace(output_lengths=True, noise_seed_input=True)
+    with torch.no_grad():
+        export_model(
+            _make_model(),
+            onnx_path,
+            SimpleNamespace(upsample_rates=UPSAMPLE_RATES),
+            args,
+        )
+
+    session = onnxruntime.InferenceSession(
+        str(onnx_path), providers=["CPUExecutionProvider"]
+    )
+
+    # Mixed lengths and speakers, padded to the longest item
+    input_lengths = np.array([7, 12, 3], dtype=np.int64)
+    speaker_ids = np.array([0, 2, 1], dtype=np.int64)
+    noise_seeds = np.array([5, 6, 7], dtype=np.int64)
+    rng = np.random.default_rng(0)
+    phoneme_ids = np.zeros((len(input_lengths), input_lengths.max()), dtype=np.int64)
+    for i, input_length in enumerate(input_lengths):
+        phoneme_ids[i, :input_length] = rng.integers(1, NUM_SYMBOLS, input_length)
+
+    scales = np.array([0.667, 1.0, 0.8], dtype=np.float32)
+    audio, output_lengths = session.run(
+        None,
+        {
+            "input": phoneme_ids,
+            "input_lengths": input_lengths,
+            "scales": scales,
+            "sid": speaker_ids,
+            "noise_seed": noise_seeds,
+        },
+    )
+
+    assert output_lengths.shape == (len(input_lengths),)
+    assert output_lengths.max() == audio.shape[-1]
+
+    for i, input_length in enumerate(input_lengths):
+        item_audio, item_lengths = session.run(
+            None,
+            {
+                "input": phoneme_ids[i : i + 1, :input_length],
+                "input_lengths": input_lengths[i : i + 1],
+                "scales": scales,
+                "sid": speaker_ids[i : i + 1],
+                "noise_seed": noise_seeds[i : i + 1],
+            },
+        )
+
+        assert output_lengths[i] == item_lengths[0] == item_audio.shape[-1]
+        np.testing.assert_allclose(
+            audio[i, ..., : output_lengths[i]], item_audio[0], atol=TOLERANCE
+        )
@@ -3,3 +3,5 @@
 PAD = "_"  # padding (0)
 BOS = "^"  # beginning of sentence
 EOS = "$"  # end of sentence
+
+DEFAULT_NOISE_SEED = 0  # models exported with --noise-seed-input
@@ -32,6 +32,12 @@ def main() -> None:
     parser.add_argument(
         "--noise-w", "--noise_w", type=float, help="Phoneme width noise"
     )
+    parser.add_argument(
+        "--noise-seed",
+        "--noise_seed",
+        type=int,
+        help="Noise seed for voices exported with --noise-seed-input (default: 0)",
+    )
     #
     parser.add_argument("--cuda", action="store_true", help="Use GPU")
     #
@@ -96,6 +102,7 @@ def main() -> None:
         "length_scale": args.length_scale,
         "noise_scale": args.noise_scale,
         "noise_w": args.noise_w,
+        "noise_seed": args.noise_seed,
         "sentence_silence": args.sentence_silence,
     }
 
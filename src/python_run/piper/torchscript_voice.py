@@ -0,0 +1,193 @@
+"""TorchScript backend for voices exported with piper_train.export_torchscript.
+
+Requires torch (pip install piper-tts[torch]).
+"""
+import json
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+import torch
+
+from .config import PiperConfig
+from .const import PAD
+from .util import audio_float_to_int16
+from .voice import PiperVoice
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class TorchScriptVoice(PiperVoice):
+    """Same interface as PiperVoice, running a TorchScript model.
+
+    Phoneme ids of several sentences can be synthesized in one padded batch.
+    The decoder sees padding past the end of shorter sentences, which changes
+    their last few frames (and so their peak normalization) slightly.
+    """
+
+    model: Optional[torch.jit.ScriptModule] = None
+    device: torch.device = field(default_factory=lambda: torch.device("cpu"))
+
+    # Sentences per batch in synthesize_stream_raw.
+    # Batches help most on GPU; on CPU, a single sentence already uses all
+    # threads.
+    batch_size: int = 1
+
+    @staticmethod
+    def load(
+        model_path: Union[str, Path],
+        config_path: Optional[Union[str, Path]] = None,
+        use_cuda: bool = False,
+        num_threads: Optional[int] = None,
+        optimize: bool = True,
+        batch_size: int = 1,
+    ) -> "TorchScriptVoice":
+        """Load a TorchScript model and config.
+
+        If optimize is True, the model is frozen (weights become constants) and
+        passed through torch.jit.optimize_for_inference. num_threads sets
+        torch's intra-op threads for the whole process.
+        """
+        if config_path is None:
+            config_path = f"{model_path}.json"
+
+        with open(config_path, "r", encoding="utf-8") as config_file:
+            config_dict = json.load(config_file)
+
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        device = torch.device("cuda" if use_cuda else "cpu")
+        model = torch.jit.load(str(model_path), map_location=device)
+        model.eval()
+
+        if optimize:
+            _LOGGER.debug("Freezing and optimizing model")
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+
+        return TorchScriptVoice(
+            # No ONNX session
+            session=None,  # type: ignore[arg-type]
+            config=PiperConfig.from_dict(config_dict),
+            model=model,
+            device=device,
+            batch_size=max(1, batch_size),
+        )
+
+    def synthesize_stream_raw(
+        self,
+        text: str,
+        speaker_id: Optional[int] = None,
+        length_scale: Optional[float] = None,
+        noise_scale: Optional[float] = None,
+        noise_w: Optional[float] = None,
+        noise_seed: Optional[int] = None,
+        sentence_silence: float = 0.0,
+    ) -> Iterable[bytes]:
+        """Synthesize raw audio per sentence from text, batch_size at a time.
+
+        TorchScript models have no noise_seed input, so noise_seed is ignored.
+        """
+        sentence_phonemes = self.phonemize(text)
+
+        # 16-bit mono
+        num_silence_samples = int(sentence_silence * self.config.sample_rate)
+        silence_bytes = bytes(num_silence_samples * 2)
+
+        for batch_start in range(0, len(sentence_phonemes), self.batch_size):
+            batch_phonemes = sentence_phonemes[
+                batch_start : batch_start + self.batch_size
+            ]
+            for audio_bytes in self.synthesize_ids_batch_to_raw(
+                [self.phonemes_to_ids(phonemes) for phonemes in batch_phonemes],
+                speaker_ids=[speaker_id] * len(batch_phonemes),
+                length_scale=length_scale,
+                noise_scale=noise_scale,
+                noise_w=noise_w,
+            ):
+                yield audio_bytes + silence_bytes
+
+    def synthesize_ids_to_raw(
+        self,
+        phoneme_ids: List[int],
+        speaker_id: Optional[int] = None,
+        length_scale: Optional[float] = None,
+        noise_scale: Optional[float] = None,
+        noise_w: Optional[float] = None,
+        noise_seed: Optional[int] = None,
+    ) -> bytes:
+        """Synthesize raw audio from phoneme ids (noise_seed is ignored)."""
+        return self.synthesize_ids_batch_to_raw(
+            [phoneme_ids],
+            speaker_ids=[speaker_id],
+            length_scale=length_scale,
+            noise_scale=noise_scale,
+            noise_w=noise_w,
+        )[0]
+
+    def synthesize_ids_batch_to_raw(
+        self,
+        phoneme_ids_batch: List[List[int]],
+        speaker_ids: Optional[List[Optional[int]]] = None,
+        length_scale: Optional[float] = None,
+        noise_scale: Optional[float] = None,
+        noise_w: Optional[float] = None,
+    ) -> List[bytes]:
+        """Synthesize raw audio for each phoneme id list in a single batch."""
+        assert self.model is not None, "Model is not loaded"
+
+        if not phoneme_ids_batch:
+            return []
+
+        if length_scale is None:
+            length_scale = self.config.length_scale
+
+        if noise_scale is None:
+            noise_scale = self.config.noise_scale
+
+        if noise_w is None:
+            noise_w = self.config.noise_w
+
+        if speaker_ids is None:
+            speaker_ids = [None] * len(phoneme_ids_batch)
+
+        # Exported models always have a speaker id input, which single speaker
+        # voices ignore.
+        sids = [
+            (speaker_id or 0) if self.config.num_speakers > 1 else 0
+            for speaker_id in speaker_ids
+        ]
+
+        pad_id = self.config.phoneme_id_map[PAD][0]
+        max_length = max(len(phoneme_ids) for phoneme_ids in phoneme_ids_batch)
+        text = torch.full(
+            (len(phoneme_ids_batch), max_length), pad_id, dtype=torch.long
+        )
+        for i, phoneme_ids in enumerate(phoneme_ids_batch):
+            text[i, : len(phoneme_ids)] = torch.LongTensor(phoneme_ids)
+
+        text_lengths = torch.LongTensor(
+            [len(phoneme_ids) for phoneme_ids in phoneme_ids_batch]
+        )
+
+        with torch.inference_mode():
+            audio, y_mask = self.model(
+                text.to(self.device),
+                text_lengths.to(self.device),
+                torch.LongTensor(sids).to(self.device),
+                torch.FloatTensor([noise_scale]).to(self.device),
+                torch.FloatTensor([length_scale]).to(self.device),
+                torch.FloatTensor([noise_w]).to(self.device),
+            )
+
+        # Remove padding: [b, 1, samples] and [b, 1, frames]
+        audio = audio.squeeze(1).float().cpu().numpy()
+        num_frames = y_mask.sum(dim=(1, 2)).long().cpu().tolist()
+        hop_length = audio.shape[-1] // y_mask.shape[-1]
+
+        return [
+            audio_float_to_int16(audio[i, : num_frames[i] * hop_length]).tobytes()
+            for i in range(len(phoneme_ids_batch))
+        ]
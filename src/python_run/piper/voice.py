@@ -1,7 +1,7 @@
 import json
 import logging
 import wave
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
@@ -10,7 +10,7 @@ import onnxruntime
 from piper_phonemize import phonemize_codepoints, phonemize_espeak, tashkeel_run
 
 from .config import PhonemeType, PiperConfig
-from .const import BOS, EOS, PAD
+from .const import BOS, DEFAULT_NOISE_SEED, EOS, PAD
 from .util import audio_float_to_int16
 
 _LOGGER = logging.getLogger(__name__)
@@ -21,13 +21,22 @@ class PiperVoice:
     session: onnxruntime.InferenceSession
     config: PiperConfig
 
+    # Graphs specialized to a single speaker (no sid input)
+    speaker_sessions: Dict[int, onnxruntime.InferenceSession] = field(
+        default_factory=dict
+    )
+
     @staticmethod
     def load(
         model_path: Union[str, Path],
         config_path: Optional[Union[str, Path]] = None,
         use_cuda: bool = False,
     ) -> "PiperVoice":
-        """Load an ONNX model and config."""
+        """Load an ONNX model and config.
+
+        Speaker graphs from export_onnx --speaker-graphs are also loaded if
+        <model>.speakers.json exists.
+        """
         if config_path is None:
             config_path = f"{model_path}.json"
 
@@ -45,6 +54,21 @@ class PiperVoice:
         else:
             providers = ["CPUExecutionProvider"]
 
+        speaker_sessions: Dict[int, onnxruntime.InferenceSession] = {}
+        speakers_path = Path(f"{model_path}.speakers.json")
+        if speakers_path.is_file():
+            with open(speakers_path, "r", encoding="utf-8") as speakers_file:
+                speaker_graphs = json.load(speakers_file).get("speaker_graphs", {})
+
+            for speaker_id, graph_name in speaker_graphs.items():
+                graph_path = speakers_path.parent / graph_name
+                _LOGGER.debug("Loading speaker %s graph: %s", speaker_id, graph_path)
+                speaker_sessions[int(speaker_id)] = onnxruntime.InferenceSession(
+                    str(graph_path),
+                    sess_options=onnxruntime.SessionOptions(),
+                    providers=providers,
+                )
+
         return PiperVoice(
             config=PiperConfig.from_dict(config_dict),
             session=onnxruntime.InferenceSession(
@@ -52,6 +76,7 @@ class PiperVoice:
                 sess_options=onnxruntime.SessionOptions(),
                 providers=providers,
             ),
+            speaker_sessions=speaker_sessions,
         )
 
     def phonemize(self, text: str) -> List[List[str]]:
@@ -94,6 +119,7 @@ class PiperVoice:
         length_scale: Optional[float] = None,
         noise_scale: Optional[float] = None,
         noise_w: Optional[float] = None,
+        noise_seed: Optional[int] = None,
         sentence_silence: float = 0.0,
     ):
         """Synthesize WAV audio from text."""
@@ -107,6 +133,7 @@ class PiperVoice:
             length_scale=length_scale,
             noise_scale=noise_scale,
             noise_w=noise_w,
+            noise_seed=noise_seed,
             sentence_silence=sentence_silence,
         ):
             wav_file.writeframes(audio_bytes)
@@ -118,6 +145,7 @@ class PiperVoice:
         length_scale: Optional[float] = None,
         noise_scale: Optional[float] = None,
         noise_w: Optional[float] = None,
+        noise_seed: Optional[int] = None,
         sentence_silence: float = 0.0,
     ) -> Iterable[bytes]:
         """Synthesize raw audio per sentence from text."""
@@ -135,6 +163,7 @@ class PiperVoice:
                 length_scale=length_scale,
                 noise_scale=noise_scale,
                 noise_w=noise_w,
+                noise_seed=noise_seed,
             ) + silence_bytes
 
     def synthesize_ids_to_raw(
@@ -144,8 +173,13 @@ class PiperVoice:
         length_scale: Optional[float] = None,
         noise_scale: Optional[float] = None,
         noise_w: Optional[float] = None,
+        noise_seed: Optional[int] = None,
     ) -> bytes:
-        """Synthesize raw audio from phoneme ids."""
+        """Synthesize raw audio from phoneme ids.
+
+        noise_seed is only used by models exported with --noise-seed-input,
+        which give the same audio for the same inputs and seed.
+        """
         if length_scale is None:
             length_scale = self.config.length_scale
 
@@ -175,11 +209,22 @@ class PiperVoice:
             # Default speaker
             speaker_id = 0
 
-        if speaker_id is not None:
+        session = self.session
+        if speaker_id in self.speaker_sessions:
+            # Speaker is folded into the graph
+            session = self.speaker_sessions[speaker_id]
+        elif speaker_id is not None:
             sid = np.array([speaker_id], dtype=np.int64)
             args["sid"] = sid
 
+        input_names = {model_input.name for model_input in session.get_inputs()}
+        if "noise_seed" in input_names:
+            if noise_seed is None:
+                noise_seed = DEFAULT_NOISE_SEED
+
+            args["noise_seed"] = np.array([noise_seed], dtype=np.int64)
+
         # Synthesize through Onnx
-        audio = self.session.run(None, args, )[0].squeeze((0, 1))
+        audio = session.run(None, args, )[0].squeeze((0, 1))
         audio = audio_float_to_int16(audio.squeeze())
         return audio.tobytes()